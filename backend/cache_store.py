@@ -0,0 +1,167 @@
+"""
+Persistent cache for analysis results.
+
+Entries live in one SQLite table, grouped by namespace (one per kind of
+result), each with an expiry time. Reads refresh an entry's last access time,
+and once the table holds more than CACHE_MAX_BYTES of values, the
+least-recently-used entries are deleted. Values are stored as JSON.
+
+Cached analyses store the fingerprint (perceptual hash) of the screenshot
+they were made from (see image_prep.image_fingerprint) and are only reused
+when a new capture looks the same. The store is synchronous; async code calls
+it through asyncio.to_thread.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from image_prep import fingerprints_match
+
+CACHE_DB = os.getenv(
+    "CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache.sqlite3")
+)
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Request values of the `cache` option
+CACHE_MODES = ("use", "refresh", "bypass")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+
+def content_hash(*parts) -> str:
+    """Stable SHA-256 of JSON-serializable parts."""
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def canonical_url(url: str) -> str:
+    """Normalize a URL for cache keys: default scheme, lower-case host, no fragment or trailing slash, sorted query."""
+    if not url.startswith(("http://", "https://")):
+        url = "https://" + url
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), host, path, query, ""))
+
+
+def resolve_cache_mode(value: Optional[str], bypass: bool = False, refresh: bool = False) -> str:
+    """Cache mode from a `cache` option or the `bypass_cache`/`refresh_cache` flags. Raises ValueError."""
+    if bypass:
+        return "bypass"
+    if refresh:
+        return "refresh"
+    mode = (value or "use").lower()
+    if mode not in CACHE_MODES:
+        raise ValueError(f"cache must be one of {', '.join(CACHE_MODES)}")
+    return mode
+
+
+def screenshot_matches(cached: Optional[str], fingerprint: Optional[str]) -> bool:
+    return bool(cached) and bool(fingerprint) and fingerprints_match(cached, fingerprint)
+
+
+class CacheStore:
+    def __init__(self, db_path: str = CACHE_DB, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed_at)")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Return the stored value, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+                self._db.commit()
+                return None
+            self._db.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+            )
+            self._db.commit()
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float, max_bytes: Optional[int] = None):
+        """Store a value for `ttl` seconds. `max_bytes` additionally caps the size of the namespace."""
+        encoded = json.dumps(value, default=str)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, created_at, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, key, encoded, len(encoded), now, now + ttl, now),
+            )
+            self._db.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+            if max_bytes is not None:
+                self._evict(max_bytes, namespace)
+            self._evict(self.max_bytes)
+            self._db.commit()
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+            self._db.commit()
+
+    def _evict(self, max_bytes: int, namespace: Optional[str] = None):
+        """Delete least-recently-used entries (of one namespace, or all) until at most max_bytes remain."""
+        where, params = ("WHERE namespace = ?", (namespace,)) if namespace is not None else ("", ())
+        total = self._db.execute(f"SELECT COALESCE(SUM(size), 0) FROM cache_entries {where}", params).fetchone()[0]
+        if total <= max_bytes:
+            return
+        rows = self._db.execute(
+            f"SELECT namespace, key, size FROM cache_entries {where} ORDER BY accessed_at", params
+        ).fetchall()
+        for entry_namespace, entry_key, size in rows:
+            if total <= max_bytes:
+                break
+            self._db.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (entry_namespace, entry_key)
+            )
+            total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries GROUP BY namespace"
+            ).fetchall()
+        return {
+            "max_bytes": self.max_bytes,
+            "namespaces": {namespace: {"entries": count, "bytes": size} for namespace, count, size in rows},
+        }
+
+
+_cache_store: Optional[CacheStore] = None
+
+
+def get_cache_store() -> CacheStore:
+    global _cache_store
+    if _cache_store is None:
+        _cache_store = CacheStore()
+    return _cache_store
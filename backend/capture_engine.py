@@ -0,0 +1,665 @@
+"""
+Embeddable Playwright capture engine.
+
+screenshot_server.py exposes this engine over HTTP; single-node deployments can
+import it directly (see SCREENSHOT_MODE in main.py) and receive the encoded image
+in memory, without the HTTP hop or polling the shared screenshots/ directory.
+"""
+
+import os
+import re
+import time
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+from pathlib import Path
+
+from pydantic import BaseModel
+from playwright.async_api import async_playwright
+
+from metrics import Counter, Gauge, Histogram, stage_timer
+
+SCREENSHOTS_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / "screenshots"
+SCREENSHOTS_DIR.mkdir(exist_ok=True)
+# Per-element images of multi-element captures, kept out of the top-level ID lookups
+ELEMENTS_DIR = SCREENSHOTS_DIR / "elements"
+ELEMENTS_DIR.mkdir(exist_ok=True)
+# Recorded network archives (HAR zips, response bodies stored by content hash) for offline replays
+HAR_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / "har_archives"
+HAR_DIR.mkdir(exist_ok=True)
+HAR_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+HAR_MODES = ("record", "replay")
+
+# Maximum number of pages rendered at the same time on the shared browser
+CAPTURE_MAX_CONCURRENCY = int(os.getenv("CAPTURE_MAX_CONCURRENCY", "4"))
+# Deadline (seconds) for captures that don't set timeout_seconds, queueing included
+CAPTURE_DEFAULT_TIMEOUT = float(os.getenv("CAPTURE_DEFAULT_TIMEOUT", "90"))
+
+# Encoded formats supported by Playwright, mapped to file extension and media type
+IMAGE_FORMATS = {
+    "png": ("png", "image/png"),
+    "jpeg": ("jpg", "image/jpeg"),
+}
+
+STAGE_DURATION = Histogram(
+    "screenshot_stage_duration_seconds", "Duration of each capture stage", ("stage",)
+)
+CAPTURE_DURATION = Histogram("screenshot_capture_duration_seconds", "End-to-end capture duration")
+QUEUE_DEPTH = Gauge("screenshot_queue_depth", "Captures waiting for a free render slot")
+ACTIVE_BROWSERS = Gauge("screenshot_active_browsers", "Running Chromium instances")
+ACTIVE_CONTEXTS = Gauge("screenshot_active_contexts", "Open browser contexts")
+BYTES_WRITTEN = Counter("screenshot_bytes_written_total", "Bytes of encoded images written to disk")
+CAPTURES_TOTAL = Counter("screenshot_captures_total", "Finished captures", ("outcome",))
+CAPTURE_FAILURES = Counter("screenshot_capture_failures_total", "Failed captures by exception type", ("exception",))
+LOOKUP_CACHE = Counter("screenshot_lookup_cache_total", "Screenshot file lookups by ID", ("result",))
+HAR_CAPTURES = Counter("screenshot_har_captures_total", "Captures recorded to or replayed from a HAR archive", ("mode",))
+
+# CSS to hide common cookie banners and popups
+POPUP_HIDING_CSS = """
+/* Hide common cookie banner selectors */
+[id*="cookie" i],
+[class*="cookie" i],
+[id*="consent" i],
+[class*="consent" i],
+[id*="gdpr" i],
+[class*="gdpr" i],
+[id*="privacy" i],
+[class*="privacy" i],
+[id*="banner" i],
+[class*="banner" i],
+[id*="notice" i],
+[class*="notice" i],
+[id*="popup" i],
+[class*="popup" i],
+[id*="modal" i],
+[class*="modal" i],
+[id*="overlay" i],
+[class*="overlay" i],
+[id*="notification" i],
+[class*="notification" i],
+[class*="toast" i],
+[id*="toast" i],
+[class*="alert" i],
+[id*="alert" i],
+
+/* Hide common newsletter popups */
+[class*="newsletter" i],
+[id*="newsletter" i],
+[class*="subscribe" i],
+[id*="subscribe" i],
+[class*="signup" i],
+[id*="signup" i],
+
+/* Hide bottom/top banners */
+div[style*="position: fixed"][style*="bottom: 0"],
+div[style*="position: fixed"][style*="top: 0"],
+div[style*="position: sticky"][style*="bottom: 0"],
+div[style*="position: sticky"][style*="top: 0"],
+
+/* Hide common popup frameworks */
+.swal2-container,
+.sweet-alert,
+.vex-content,
+.bootbox,
+.ui-dialog,
+.fancybox-container,
+.mfp-container,
+
+/* Hide consent management platforms */
+#onetrust-consent-sdk,
+#CybotCookiebotDialog,
+#cookieChoiceInfo,
+#cookiescript_injected,
+.cc-window,
+.cc-banner,
+.cookie-law-info-bar,
+.gdpr-cookie-notice,
+.cookie-notice-container,
+
+/* Hide specific cookie banner services */
+.osano-cm-widget,
+.trustarc-banner-container,
+.evidon-barrier-wrapper,
+.ot-sdk-container,
+.optanon-alert-box-wrapper,
+
+/* Common z-index overlays */
+[style*="z-index: 999"],
+[style*="z-index: 9999"],
+[style*="z-index: 99999"] {
+    display: none !important;
+    visibility: hidden !important;
+    opacity: 0 !important;
+    pointer-events: none !important;
+}
+
+/* Remove backdrop/overlay elements */
+.modal-backdrop,
+.overlay,
+.backdrop,
+[class*="backdrop" i],
+[id*="backdrop" i] {
+    display: none !important;
+}
+
+/* Remove fixed/sticky positioning that might block content */
+body {
+    overflow: auto !important;
+}
+"""
+
+# Scroll to trigger lazy loading and get full page height
+SCROLL_TO_LOAD_SCRIPT = """
+async () => {
+    // Disable smooth scrolling for faster execution
+    document.documentElement.style.scrollBehavior = 'auto';
+
+    // Get initial height
+    let lastHeight = document.body.scrollHeight;
+
+    // Scroll to bottom to trigger lazy loading
+    for (let i = 0; i < 10; i++) {
+        window.scrollTo(0, document.body.scrollHeight);
+        await new Promise(resolve => setTimeout(resolve, 500));
+
+        let newHeight = document.body.scrollHeight;
+        if (newHeight === lastHeight) {
+            break; // No new content loaded
+        }
+        lastHeight = newHeight;
+    }
+
+    // Scroll back to top for the screenshot
+    window.scrollTo(0, 0);
+    await new Promise(resolve => setTimeout(resolve, 500));
+}
+"""
+
+# Remove popup elements that might not be caught by POPUP_HIDING_CSS
+POPUP_REMOVAL_SCRIPT = """
+// Remove elements that commonly contain popups
+const selectors = [
+    '[role="dialog"]',
+    '[aria-modal="true"]',
+    '.modal',
+    '.popup',
+    '.overlay',
+    '.cookie-banner',
+    '.cookie-notice',
+    '.gdpr-notice',
+    '.consent-banner'
+];
+
+selectors.forEach(selector => {
+    document.querySelectorAll(selector).forEach(el => {
+        // Check if element has high z-index (likely a popup)
+        const style = window.getComputedStyle(el);
+        const zIndex = parseInt(style.zIndex);
+        if (zIndex > 100 || el.getAttribute('class')?.toLowerCase().includes('popup') || 
+            el.getAttribute('class')?.toLowerCase().includes('modal') ||
+            el.getAttribute('class')?.toLowerCase().includes('cookie')) {
+            el.style.display = 'none';
+            el.remove();
+        }
+    });
+});
+
+// Remove fixed position elements at the bottom (common for cookie banners)
+document.querySelectorAll('*').forEach(el => {
+    const style = window.getComputedStyle(el);
+    if (style.position === 'fixed') {
+        const rect = el.getBoundingClientRect();
+        // If it's at the bottom and wide, likely a cookie banner
+        if (rect.bottom >= window.innerHeight - 100 && rect.width > window.innerWidth * 0.5) {
+            el.style.display = 'none';
+            el.remove();
+        }
+        // If it covers a large portion of the screen, likely a modal
+        if (rect.width > window.innerWidth * 0.3 && rect.height > window.innerHeight * 0.3) {
+            el.style.display = 'none';
+            el.remove();
+        }
+    }
+});
+"""
+
+class ScreenshotRequest(BaseModel):
+    url: str  # Changed from HttpUrl to str for more flexible URL handling
+    width: int = 1920
+    height: int = 1080
+    wait_time: int = 0
+    full_page: bool = True  # Changed default to True for better full-page capture
+    element_selector: Optional[str] = None
+    hide_popups: bool = True  # New option to hide popups
+    wait: bool = False  # Capture synchronously and return the image bytes in the response
+    save_to_disk: bool = True  # Persist the capture under SCREENSHOTS_DIR
+    image_format: str = "png"  # "png" or "jpeg"
+    quality: Optional[int] = None  # JPEG quality (0-100), ignored for PNG
+    scale: str = "device"  # "device" keeps the 2x pixel density, "css" renders at 1x
+    screenshot_id: Optional[str] = None  # Client-chosen ID, lets the caller cancel a job it hasn't heard back from
+    timeout_seconds: Optional[float] = None  # Deadline for the whole capture, defaults to CAPTURE_DEFAULT_TIMEOUT
+    device_scale_factor: float = 2  # Pixel density of the page, combined with `scale`
+    har_mode: Optional[str] = None  # "record" the network into an archive, or "replay" from one without network access
+    har_id: Optional[str] = None  # Archive name; defaults to the screenshot ID when recording
+    
+    def __init__(self, **data):
+        super().__init__(**data)
+        # Normalize URL to ensure it has a protocol
+        self.url = self._normalize_url(self.url)
+    
+    def _normalize_url(self, url: str) -> str:
+        """Normalize URL to ensure it has a protocol"""
+        url = url.strip()
+        
+        # If URL doesn't start with http:// or https://, add https://
+        if not url.startswith(('http://', 'https://')):
+            # If it starts with www., add https://
+            if url.startswith('www.'):
+                url = 'https://' + url
+            # If it doesn't start with www., assume it's a domain and add https://
+            else:
+                url = 'https://' + url
+        
+        return url
+
+class ElementScreenshotRequest(ScreenshotRequest):
+    """Capture one image per matched element (and per region) from a single page load."""
+    element_selectors: List[str] = []  # CSS selectors, every match up to max_matches_per_selector
+    regions: List[Dict[str, float]] = []  # Page regions in CSS pixels: {"x", "y", "width", "height"}
+    max_matches_per_selector: int = 10
+    inline_images: bool = False  # Return base64 images in the JSON response
+
+# Page-relative box of an element in CSS pixels (scroll offset included)
+ELEMENT_BOX_SCRIPT = """
+el => {
+    const r = el.getBoundingClientRect();
+    return {x: r.left + window.scrollX, y: r.top + window.scrollY, width: r.width, height: r.height};
+}
+"""
+
+PAGE_SIZE_SCRIPT = """
+() => ({
+    width: document.documentElement.scrollWidth,
+    height: document.documentElement.scrollHeight
+})
+"""
+
+@dataclass
+class ElementImage:
+    selector: Optional[str]  # None for regions
+    index: int  # match index for the selector, or region index
+    bounding_box: Dict[str, float]  # CSS pixels, page-relative
+    bounding_box_percent: Dict[str, float]  # percentages of the full page, like the LLM boxes
+    image_bytes: bytes
+    file_path: Optional[Path] = None
+
+@dataclass
+class ElementCaptureResult:
+    screenshot_id: str
+    media_type: str
+    page_size: Dict[str, float]
+    elements: List[ElementImage]
+    timings: Dict[str, float] = field(default_factory=dict)
+    har_id: Optional[str] = None
+
+@dataclass
+class CaptureResult:
+    screenshot_id: str
+    image_bytes: bytes
+    media_type: str
+    file_path: Optional[Path] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    har_id: Optional[str] = None
+
+# screenshot_id -> finalized file, so lookups don't glob the whole directory
+_file_index: Dict[str, Path] = {}
+
+def new_screenshot_id() -> str:
+    return str(uuid.uuid4())[:8]
+
+def har_archive_path(har_id: str) -> Path:
+    if not HAR_ID_PATTERN.match(har_id):
+        raise ValueError("har_id may only contain letters, digits, '-' and '_'")
+    return HAR_DIR / f"{har_id}.har.zip"
+
+def resolve_har_id(request: ScreenshotRequest, screenshot_id: str) -> Optional[str]:
+    """Validate the HAR options of a request and return the archive it records to or replays from."""
+    if request.har_mode is None:
+        return None
+    if request.har_mode not in HAR_MODES:
+        raise ValueError(f"Unsupported har_mode '{request.har_mode}'")
+    if request.har_mode == "replay":
+        if not request.har_id:
+            raise ValueError("har_id is required to replay a capture")
+        if not har_archive_path(request.har_id).exists():
+            raise ValueError(f"HAR archive '{request.har_id}' not found")
+        return request.har_id
+    har_id = request.har_id or screenshot_id
+    har_archive_path(har_id)
+    return har_id
+
+def list_har_archives() -> List[dict]:
+    archives = []
+    for path in sorted(HAR_DIR.glob("*.har.zip")):
+        stat = path.stat()
+        archives.append({
+            "har_id": path.name[:-len(".har.zip")],
+            "size_bytes": stat.st_size,
+            "recorded_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        })
+    return archives
+
+def build_screenshot_filename(screenshot_id: str, image_format: str = "png") -> str:
+    """Return the on-disk filename for a capture; lookups match on the `_{id}.{ext}` suffix."""
+    extension = IMAGE_FORMATS[image_format][0]
+    return f"screenshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{screenshot_id}.{extension}"
+
+def find_screenshot_file(screenshot_id: str) -> Optional[Path]:
+    """Find the finalized capture file for a screenshot ID, whatever its format."""
+    indexed = _file_index.get(screenshot_id)
+    if indexed is not None and indexed.exists():
+        LOOKUP_CACHE.inc(result="hit")
+        return indexed
+    LOOKUP_CACHE.inc(result="miss")
+    for extension, _ in IMAGE_FORMATS.values():
+        found_files = list(SCREENSHOTS_DIR.glob(f"*_{screenshot_id}.{extension}"))
+        if found_files:
+            _file_index[screenshot_id] = found_files[0]
+            return found_files[0]
+    _file_index.pop(screenshot_id, None)
+    return None
+
+def write_screenshot_file(image_bytes: bytes, filename: str) -> Path:
+    """
+    Write a capture atomically: the bytes go to a hidden temp file first and are
+    renamed into place, so readers never observe a partially written image.
+    """
+    file_path = SCREENSHOTS_DIR / filename
+    tmp_path = SCREENSHOTS_DIR / f".{filename}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(image_bytes)
+    os.replace(tmp_path, file_path)
+    BYTES_WRITTEN.inc(len(image_bytes))
+    return file_path
+
+class CaptureEngine:
+    """
+    Shares one Chromium instance between captures. Each capture gets its own
+    browser context, and a semaphore bounds how many pages render at once.
+    """
+
+    def __init__(self, max_concurrency: int = CAPTURE_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._browser_lock = asyncio.Lock()
+        self._playwright = None
+        self._browser = None
+
+    async def _ensure_browser(self):
+        async with self._browser_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            print("[DEBUG] Launching shared Chromium for capture engine")
+            self._browser = await self._playwright.chromium.launch()
+            ACTIVE_BROWSERS.set(1)
+            return self._browser
+
+    @property
+    def queue_depth(self) -> int:
+        return int(QUEUE_DEPTH.value())
+
+    async def stop(self):
+        """Close the shared browser; the next capture relaunches it."""
+        async with self._browser_lock:
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception as e:
+                    print(f"[DEBUG] Error closing browser: {e}")
+                self._browser = None
+                ACTIVE_BROWSERS.set(0)
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def capture(self, request: ScreenshotRequest, screenshot_id: Optional[str] = None,
+                      timings: Optional[Dict[str, float]] = None) -> CaptureResult:
+        """
+        Take a screenshot of the specified URL and return the encoded image.
+        Writing the image to SCREENSHOTS_DIR is an optional side effect (request.save_to_disk).
+        Per-stage durations (seconds) are recorded into `timings` as they complete,
+        so callers can report progress of an in-flight job.
+
+        The capture is bounded by request.timeout_seconds (asyncio.TimeoutError) and can
+        be cancelled by cancelling the awaiting task; either way it stops at the next
+        await point and its browser context and render slot are released immediately.
+        """
+        return await self._run_job(self._capture, request, screenshot_id, timings)
+
+    async def capture_elements(self, request: ElementScreenshotRequest, screenshot_id: Optional[str] = None,
+                               timings: Optional[Dict[str, float]] = None) -> ElementCaptureResult:
+        """
+        Load the page once and return one image per element matched by
+        request.element_selectors and per request.regions, each with its page
+        bounding box. Deadline and cancellation behave as in capture().
+        """
+        return await self._run_job(self._capture_elements, request, screenshot_id, timings)
+
+    async def _run_job(self, job, request: ScreenshotRequest, screenshot_id: Optional[str],
+                       timings: Optional[Dict[str, float]]):
+        """Apply validation, the deadline and the outcome metrics around a capture job."""
+        if request.image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image_format '{request.image_format}'")
+        screenshot_id = screenshot_id or request.screenshot_id or new_screenshot_id()
+        resolve_har_id(request, screenshot_id)
+        timings = timings if timings is not None else {}
+        deadline = request.timeout_seconds or CAPTURE_DEFAULT_TIMEOUT
+        started = time.perf_counter()
+
+        try:
+            result = await asyncio.wait_for(job(request, screenshot_id, timings), deadline)
+        except asyncio.CancelledError:
+            CAPTURES_TOTAL.inc(outcome="cancelled")
+            raise
+        except asyncio.TimeoutError:
+            print(f"[DEBUG] Capture {screenshot_id} exceeded its {deadline}s deadline, aborted")
+            CAPTURES_TOTAL.inc(outcome="timeout")
+            CAPTURE_FAILURES.inc(exception="TimeoutError")
+            raise
+        except Exception as e:
+            CAPTURES_TOTAL.inc(outcome="failure")
+            CAPTURE_FAILURES.inc(exception=type(e).__name__)
+            raise
+
+        timings["total"] = round(time.perf_counter() - started, 4)
+        CAPTURE_DURATION.observe(timings["total"])
+        CAPTURES_TOTAL.inc(outcome="success")
+        return result
+
+    @asynccontextmanager
+    async def _page(self, request: ScreenshotRequest, screenshot_id: str, timings: Dict[str, float]):
+        """
+        Hold a render slot and a fresh browser context for the duration of a job.
+        In HAR record mode the context writes its traffic to the archive when it is
+        closed; in replay mode every request is answered from the archive and
+        anything not in it is aborted, so the page never touches the network.
+        """
+        context_options = {
+            "viewport": {'width': request.width, 'height': request.height},
+            "device_scale_factor": request.device_scale_factor,
+        }
+        har_id = resolve_har_id(request, screenshot_id)
+        if har_id:
+            # Service workers would bypass both recording and routing
+            context_options["service_workers"] = "block"
+        if request.har_mode == "record":
+            context_options["record_har_path"] = str(har_archive_path(har_id))
+            context_options["record_har_content"] = "attach"
+
+        QUEUE_DEPTH.inc()
+        try:
+            with stage_timer(timings, "queue", STAGE_DURATION):
+                await self._slots.acquire()
+        finally:
+            QUEUE_DEPTH.dec()
+        try:
+            with stage_timer(timings, "browser_launch", STAGE_DURATION):
+                browser = await self._ensure_browser()
+            with stage_timer(timings, "new_context", STAGE_DURATION):
+                context = await browser.new_context(**context_options)
+            ACTIVE_CONTEXTS.inc()
+            try:
+                if request.har_mode == "replay":
+                    await context.route_from_har(str(har_archive_path(har_id)), not_found="abort")
+                if har_id:
+                    HAR_CAPTURES.inc(mode=request.har_mode)
+                yield await context.new_page()
+            finally:
+                # Runs on cancellation too, so an aborted job never keeps its context
+                await context.close()
+                ACTIVE_CONTEXTS.dec()
+        finally:
+            self._slots.release()
+
+    async def _capture(self, request: ScreenshotRequest, screenshot_id: str,
+                       timings: Dict[str, float]) -> CaptureResult:
+        async with self._page(request, screenshot_id, timings) as page:
+            image_bytes = await self._render(page, request, timings)
+
+        file_path = None
+        if request.save_to_disk:
+            filename = build_screenshot_filename(screenshot_id, request.image_format)
+            with stage_timer(timings, "write", STAGE_DURATION):
+                file_path = await asyncio.to_thread(write_screenshot_file, image_bytes, filename)
+            _file_index[screenshot_id] = file_path
+            print(f"Screenshot saved to {file_path}")
+        return CaptureResult(
+            screenshot_id=screenshot_id,
+            image_bytes=image_bytes,
+            media_type=IMAGE_FORMATS[request.image_format][1],
+            file_path=file_path,
+            timings=timings,
+            har_id=resolve_har_id(request, screenshot_id),
+        )
+
+    async def _capture_elements(self, request: ElementScreenshotRequest, screenshot_id: str,
+                                timings: Dict[str, float]) -> ElementCaptureResult:
+        async with self._page(request, screenshot_id, timings) as page:
+            await self._prepare_page(page, request, timings)
+            page_size = await page.evaluate(PAGE_SIZE_SCRIPT)
+            with stage_timer(timings, "encode", STAGE_DURATION):
+                elements = await self._encode_elements(page, request, page_size)
+
+        if request.save_to_disk:
+            extension = IMAGE_FORMATS[request.image_format][0]
+            with stage_timer(timings, "write", STAGE_DURATION):
+                for n, element in enumerate(elements):
+                    element.file_path = ELEMENTS_DIR / f"{screenshot_id}_{n}.{extension}"
+                    await asyncio.to_thread(element.file_path.write_bytes, element.image_bytes)
+                    BYTES_WRITTEN.inc(len(element.image_bytes))
+        print(f"[DEBUG] Captured {len(elements)} element images for {request.url}")
+        return ElementCaptureResult(
+            screenshot_id=screenshot_id,
+            media_type=IMAGE_FORMATS[request.image_format][1],
+            page_size=page_size,
+            elements=elements,
+            timings=timings,
+            har_id=resolve_har_id(request, screenshot_id),
+        )
+
+    async def _encode_elements(self, page, request: ElementScreenshotRequest,
+                               page_size: Dict[str, float]) -> List[ElementImage]:
+        options = self._screenshot_options(request)
+        page_width = page_size.get("width") or request.width
+        page_height = page_size.get("height") or request.height
+
+        def as_percent(box):
+            return {
+                "x": round(box["x"] / page_width * 100, 2),
+                "y": round(box["y"] / page_height * 100, 2),
+                "width": round(box["width"] / page_width * 100, 2),
+                "height": round(box["height"] / page_height * 100, 2),
+            }
+
+        elements = []
+        for selector in request.element_selectors:
+            locator = page.locator(selector)
+            count = min(await locator.count(), request.max_matches_per_selector)
+            for index in range(count):
+                element = locator.nth(index)
+                box = await element.evaluate(ELEMENT_BOX_SCRIPT)
+                if box["width"] < 1 or box["height"] < 1:
+                    continue  # hidden or collapsed
+                image_bytes = await element.screenshot(**options)
+                elements.append(ElementImage(selector, index, box, as_percent(box), image_bytes))
+        for index, region in enumerate(request.regions):
+            box = {key: float(region[key]) for key in ("x", "y", "width", "height")}
+            image_bytes = await page.screenshot(full_page=True, clip=box, **options)
+            elements.append(ElementImage(None, index, box, as_percent(box), image_bytes))
+        return elements
+
+    @staticmethod
+    def _screenshot_options(request: ScreenshotRequest) -> dict:
+        screenshot_options = {
+            "type": request.image_format,
+            "scale": request.scale,
+        }
+        if request.image_format == "jpeg" and request.quality is not None:
+            screenshot_options["quality"] = request.quality
+        return screenshot_options
+
+    async def _render(self, page, request: ScreenshotRequest, timings: Dict[str, float]) -> bytes:
+        """Prepare the page and encode the screenshot, timing each stage."""
+        await self._prepare_page(page, request, timings)
+        screenshot_options = self._screenshot_options(request)
+        with stage_timer(timings, "encode", STAGE_DURATION):
+            if request.element_selector:
+                element = page.locator(request.element_selector)
+                image_bytes = await element.screenshot(**screenshot_options)
+            else:
+                image_bytes = await page.screenshot(full_page=request.full_page, **screenshot_options)
+        return image_bytes
+
+    async def _prepare_page(self, page, request: ScreenshotRequest, timings: Dict[str, float]):
+        """Navigate, settle, trigger lazy loading and hide popups."""
+        # Navigate to the page with a shorter timeout
+        print(f"[DEBUG] Navigating to {request.url}")
+        with stage_timer(timings, "goto", STAGE_DURATION):
+            await page.goto(request.url, wait_until="domcontentloaded", timeout=15000)
+        print(f"[DEBUG] Navigation completed for {request.url}")
+
+        # Wait for initial page load (default wait for dynamic content; replays have no network latency)
+        default_settle = 0.5 if request.har_mode == "replay" else 3
+        with stage_timer(timings, "settle", STAGE_DURATION):
+            await asyncio.sleep(request.wait_time if request.wait_time > 0 else default_settle)
+
+        # For full page screenshots, ensure all content is loaded
+        if request.full_page:
+            print(f"[DEBUG] Preparing full-page screenshot for {request.url}")
+            with stage_timer(timings, "scroll", STAGE_DURATION):
+                await page.evaluate(SCROLL_TO_LOAD_SCRIPT)
+                # Additional wait for content to settle
+                await asyncio.sleep(2)
+
+        # Hide popups if requested
+        if request.hide_popups:
+            print(f"[DEBUG] Injecting popup-hiding CSS for {request.url}")
+            with stage_timer(timings, "hide_popups", STAGE_DURATION):
+                await page.add_style_tag(content=POPUP_HIDING_CSS)
+                await page.evaluate(POPUP_REMOVAL_SCRIPT)
+                # Wait a bit for the changes to take effect
+                await asyncio.sleep(1)
+
+_engine: Optional[CaptureEngine] = None
+
+def get_capture_engine() -> CaptureEngine:
+    """Return the process-wide capture engine, created on first use."""
+    global _engine
+    if _engine is None:
+        _engine = CaptureEngine()
+    return _engine
@@ -0,0 +1,140 @@
+"""
+Content-addressed section crops, rendered on first request.
+
+A crop URL encodes everything that determines the image - screenshot ID,
+percentage box, scale, format and the version of the screenshot file - so the
+same crop always gets the same URL:
+
+    /crops/{screenshot_id}/{x},{y},{width},{height}/{scale}.{format}?v={version}
+
+The version (see raster_cache.source_version) changes when a deleted ID is
+captured again, so the new capture's crops get new URLs.
+
+Nothing is rendered when an analysis returns. The first GET slices the
+screenshot's cached raster (see raster_cache.py), encodes the crop and stores
+it under crop_cache/ by the hash of its URL and the version of the screenshot
+file; later requests are served from disk. Files are evicted least-recently-used once the directory exceeds
+CROP_CACHE_MAX_BYTES. Since a URL always maps to the same image, responses can
+be cached by clients as immutable.
+"""
+
+import io
+import os
+import hashlib
+from typing import List, Optional, Tuple
+
+from raster_cache import get_raster_cache, source_version
+
+CROP_CACHE_DIR = os.getenv(
+    "CROP_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "crop_cache")
+)
+CROP_CACHE_MAX_BYTES = int(os.getenv("CROP_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CROP_FORMATS = {"png": ("PNG", "image/png"), "jpg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+MIN_SCALE, MAX_SCALE = 0.1, 1.0
+# Smallest box side in a URL (percent): boxes are written with two decimals
+MIN_BOX_SIZE = 0.01
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+os.makedirs(CROP_CACHE_DIR, exist_ok=True)
+
+
+def _format_box(bounding_box: dict) -> str:
+    """
+    The box as URL segment, clamped to the page the way crop_box_pixels clamps pixels,
+    so that every URL passes parse_crop_spec.
+    """
+    x, y, width, height = (round(float(bounding_box.get(key, default)), 2)
+                           for key, default in (("x", 0), ("y", 0), ("width", 100), ("height", 100)))
+    x = max(0.0, min(x, 100 - MIN_BOX_SIZE))
+    y = max(0.0, min(y, 100 - MIN_BOX_SIZE))
+    width = max(MIN_BOX_SIZE, min(width, 100 - x))
+    height = max(MIN_BOX_SIZE, min(height, 100 - y))
+    return f"{x:.2f},{y:.2f},{width:.2f},{height:.2f}"
+
+
+def crop_url(screenshot_id: str, bounding_box: dict, scale: float = 1.0, image_format: str = "png",
+             version: Optional[str] = None) -> str:
+    """
+    Deterministic URL path of a crop; the image is rendered when it is first requested.
+    `version` is the source_version of the screenshot file the crop is taken from.
+    """
+    url = f"/crops/{screenshot_id}/{_format_box(bounding_box)}/{scale:g}.{image_format}"
+    return f"{url}?v={version}" if version else url
+
+
+def parse_crop_spec(box: str, variant: str) -> Tuple[dict, float, str]:
+    """Parse the `{x},{y},{w},{h}` and `{scale}.{format}` URL segments. Raises ValueError."""
+    values = [float(value) for value in box.split(",")]
+    if len(values) != 4:
+        raise ValueError("Crop box must be x,y,width,height")
+    x, y, width, height = values
+    if not (0 <= x <= 100 and 0 <= y <= 100 and 0 < width <= 100 and 0 < height <= 100):
+        raise ValueError("Crop box values must be percentages")
+    scale, _, image_format = variant.rpartition(".")
+    if image_format not in CROP_FORMATS:
+        raise ValueError(f"Unsupported crop format '{image_format}'")
+    scale = float(scale)
+    if not MIN_SCALE <= scale <= MAX_SCALE:
+        raise ValueError(f"Scale must be between {MIN_SCALE} and {MAX_SCALE}")
+    return {"x": x, "y": y, "width": width, "height": height}, scale, image_format
+
+
+def crop_cache_path(screenshot_id: str, screenshot_path: str, bounding_box: dict, scale: float, image_format: str) -> str:
+    key = f"{crop_url(screenshot_id, bounding_box, scale, image_format)}@{source_version(screenshot_path)}"
+    return os.path.join(CROP_CACHE_DIR, f"{hashlib.sha256(key.encode()).hexdigest()[:32]}.{image_format}")
+
+
+def render_crops(screenshot_id: str, screenshot_path: str, bounding_boxes: List[dict],
+                 scale: float = 1.0, image_format: str = "png") -> List[str]:
+    """Return cached crop files for the boxes, rendering the missing ones from one raster."""
+    from PIL import Image
+
+    paths = [crop_cache_path(screenshot_id, screenshot_path, bounding_box, scale, image_format)
+             for bounding_box in bounding_boxes]
+    missing = [(path, bounding_box) for path, bounding_box in zip(paths, bounding_boxes) if not os.path.exists(path)]
+    if missing:
+        crops = get_raster_cache().crop(screenshot_id, screenshot_path, [bounding_box for _, bounding_box in missing])
+        pil_format = CROP_FORMATS[image_format][0]
+        for (path, _), crop in zip(missing, crops):
+            image = Image.fromarray(crop["pixels"])
+            if scale != 1.0:
+                size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+                image = image.resize(size, Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format=pil_format)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, path)
+        _evict(keep=set(paths))
+    for path in paths:
+        # Mark as recently used for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+    return paths
+
+
+def _evict(keep: set):
+    entries = []
+    for filename in os.listdir(CROP_CACHE_DIR):
+        if filename.endswith(".tmp"):
+            continue
+        path = os.path.join(CROP_CACHE_DIR, filename)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= CROP_CACHE_MAX_BYTES:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
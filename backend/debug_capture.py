@@ -0,0 +1,216 @@
+"""
+Sampled, size-capped debug capture of outbound requests.
+
+Replaces dumping every OpenRouter request to a text file. A capture is only
+taken when enabled and sampled; embedded images are replaced by their hash,
+size and dimensions, secrets are redacted, and the body is capped in size.
+Records are written by a background task to a ring buffer of files under
+`debug_captures/`; the oldest files are deleted past `max_files`. The settings
+can be changed at runtime (see /admin/debug-capture in main.py).
+"""
+
+import os
+import re
+import json
+import base64
+import struct
+import random
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+DEBUG_CAPTURE_DIR = os.getenv(
+    "DEBUG_CAPTURE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "debug_captures")
+)
+
+SECRET_HEADERS = {"authorization", "proxy-authorization", "x-api-key", "api-key", "cookie", "set-cookie"}
+SECRET_PATTERN = re.compile(r"(Bearer\s+)[A-Za-z0-9._~+/=-]+|\bsk-[A-Za-z0-9_-]{8,}")
+DATA_URL_PATTERN = re.compile(r"^data:(image/[a-z0-9.+-]+);base64,", re.IGNORECASE)
+REDACTED = "[REDACTED]"
+
+
+class DebugCaptureSettings:
+    def __init__(self):
+        self.enabled = os.getenv("DEBUG_CAPTURE_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.sample_rate = float(os.getenv("DEBUG_CAPTURE_SAMPLE_RATE", "1.0"))
+        self.max_body_bytes = int(os.getenv("DEBUG_CAPTURE_MAX_BODY_BYTES", str(64 * 1024)))
+        self.max_files = int(os.getenv("DEBUG_CAPTURE_MAX_FILES", "50"))
+
+    def update(self, enabled: Optional[bool] = None, sample_rate: Optional[float] = None,
+               max_body_bytes: Optional[int] = None, max_files: Optional[int] = None):
+        if sample_rate is not None and not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        if max_body_bytes is not None and max_body_bytes < 1024:
+            raise ValueError("max_body_bytes must be at least 1024")
+        if max_files is not None and max_files < 1:
+            raise ValueError("max_files must be at least 1")
+        if enabled is not None:
+            self.enabled = enabled
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if max_body_bytes is not None:
+            self.max_body_bytes = max_body_bytes
+        if max_files is not None:
+            self.max_files = max_files
+
+    def as_dict(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "max_body_bytes": self.max_body_bytes,
+            "max_files": self.max_files,
+        }
+
+
+def image_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """Width and height from a PNG, JPEG or WebP header, without decoding the image."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+        return None
+    if data[:2] == b"\xff\xd8":
+        offset = 2
+        while offset + 9 < len(data):
+            if data[offset] != 0xFF:
+                offset += 1
+                continue
+            marker = data[offset + 1]
+            if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+                return width, height
+            offset += 2 + struct.unpack(">H", data[offset + 2:offset + 4])[0]
+    return None
+
+
+def _summarize_data_url(value: str, media_type: str) -> dict:
+    encoded = value.split(",", 1)[1]
+    try:
+        data = base64.b64decode(encoded)
+    except ValueError:
+        return {"image": media_type, "base64_chars": len(encoded)}
+    dimensions = image_dimensions(data)
+    return {
+        "image": media_type,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "bytes": len(data),
+        "width": dimensions[0] if dimensions else None,
+        "height": dimensions[1] if dimensions else None,
+    }
+
+
+def sanitize(value: Any, key: str = "") -> Any:
+    """Replace embedded images by a summary and redact secrets, recursively."""
+    if key.lower() in SECRET_HEADERS:
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: sanitize(v, str(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [sanitize(v) for v in value]
+    if isinstance(value, str):
+        match = DATA_URL_PATTERN.match(value)
+        if match:
+            return _summarize_data_url(value, match.group(1))
+        return SECRET_PATTERN.sub(lambda m: (m.group(1) or "") + REDACTED, value)
+    return value
+
+
+class DebugCapture:
+    def __init__(self, directory: str = DEBUG_CAPTURE_DIR):
+        self.directory = directory
+        self.settings = DebugCaptureSettings()
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._sequence = 0
+        self.captured = 0
+        self.dropped = 0
+
+    def capture(self, name: str, payload: Any, **metadata):
+        """Queue a sanitized record if capture is enabled and sampled. Never blocks or raises."""
+        settings = self.settings
+        if not settings.enabled or random.random() >= settings.sample_rate:
+            return
+        try:
+            body = json.dumps(sanitize(payload), indent=2, default=str)
+            if len(body) > settings.max_body_bytes:
+                body = body[:settings.max_body_bytes] + f"\n... [truncated {len(body) - settings.max_body_bytes} chars]"
+            record = {
+                "name": name,
+                "captured_at": datetime.now().isoformat(),
+                "metadata": sanitize(metadata),
+                "body": body,
+            }
+            self._ensure_writer()
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+        except Exception as e:
+            print(f"[DEBUG] Debug capture failed: {e}")
+
+    def _ensure_writer(self):
+        if self._writer is None or self._writer.done():
+            self._queue = self._queue or asyncio.Queue(maxsize=100)
+            self._writer = asyncio.get_running_loop().create_task(self._write_loop())
+
+    async def _write_loop(self):
+        while True:
+            record = await self._queue.get()
+            try:
+                await asyncio.to_thread(self._write, record)
+                self.captured += 1
+            except Exception as e:
+                print(f"[DEBUG] Failed to write debug capture: {e}")
+
+    def _write(self, record: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        filename = f"{timestamp}_{self._sequence:06d}_{record['name']}.txt"
+        with open(os.path.join(self.directory, filename), "w", encoding="utf-8") as f:
+            f.write(f"NAME: {record['name']}\n")
+            f.write(f"CAPTURED_AT: {record['captured_at']}\n")
+            f.write("METADATA: " + json.dumps(record["metadata"], default=str) + "\n")
+            f.write("DATA: " + record["body"])
+        self._rotate()
+
+    def _rotate(self):
+        # Timestamped names sort chronologically, so the ring buffer drops from the front
+        files = sorted(f for f in os.listdir(self.directory) if f.endswith(".txt"))
+        for filename in files[:max(0, len(files) - self.settings.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
+
+    def status(self) -> dict:
+        return {
+            **self.settings.as_dict(),
+            "directory": self.directory,
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize() if self._queue else 0,
+        }
+
+    async def stop(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+
+_debug_capture: Optional[DebugCapture] = None
+
+
+def get_debug_capture() -> DebugCapture:
+    global _debug_capture
+    if _debug_capture is None:
+        _debug_capture = DebugCapture()
+    return _debug_capture
@@ -1,99 +1,170 @@
 import os
-import json, re
-import requests
-import base64
+import time
+import asyncio
+import json
 from fastapi import HTTPException, Request
-from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 
+from cache_store import canonical_url, content_hash, get_cache_store, resolve_cache_mode, screenshot_matches
+from http_client import get_http_client
+from image_prep import IMAGE_TILE_OVERLAP, PreparedImage, image_fingerprint, prepare_image, tile_image
+from llm_json import IncrementalJSONParser, PartialJSONError, loads_llm_json
+from memoize import memoize_stage, stage_cache_mode
+from metrics import stage_timer
+from openrouter import OpenRouterError, OpenRouterResponseError, chat_completion, stream_chat_completion
+from pipeline import Stage, run_stages
+
 def clean_json(json_content: str):
-    """Clean and parse JSON content with better error handling"""
-    try:
-        # Remove markdown code blocks
-        cleaned = re.sub(r"^```[a-zA-Z]*\n|\n```$", "", json_content.strip())
-        
-        # Try to parse the cleaned JSON
-        return json.loads(cleaned)
-    except json.JSONDecodeError as e:
-        print(f"[DEBUG] JSON parsing failed: {e}")
-        print(f"[DEBUG] Attempting to fix common JSON issues...")
-        
-        # Try to fix common issues
-        try:
-            # Remove any trailing incomplete content
-            if cleaned.count('{') > cleaned.count('}'):
-                # Find the last complete object
-                last_brace = cleaned.rfind('}')
-                if last_brace > 0:
-                    cleaned = cleaned[:last_brace + 1]
-            
-            # Try to escape unescaped quotes in HTML content
-            cleaned = re.sub(r'(?<!\\)"', '\\"', cleaned)
-            cleaned = cleaned.replace('\\"', '"')  # But not in HTML attributes
-            
-            return json.loads(cleaned)
-        except json.JSONDecodeError as e2:
-            print(f"[DEBUG] JSON fix attempt also failed: {e2}")
-            # Return a minimal valid JSON as fallback
-            return {
-                "websiteFeatures": [
-                    {
-                        "featureName": "Header Navigation",
-                        "detailedDescription": "Navigation bar at the top of the page",
-                        "htmlStructure": "<header><nav>...</nav></header>",
-                        "cssProperties": "Basic styling"
-                    }
-                ],
-                "siteUXArchitecture": {
-                    "businessContext": "Website analysis",
-                    "targetAudience": "General users",
-                    "userGoals": "Information and navigation",
-                    "navigationStructure": "Standard web navigation"
-                }
-            }
+    """
+    Parse a JSON object from a model response with llm_json.repair_json: code fences,
+    prose and trailing commas are repaired. Raises ValueError if nothing can be salvaged
+    instead of returning placeholder data, and PartialJSONError if the output was cut off.
+    """
+    return loads_llm_json(json_content, context="OpenRouter")
 
-def detect_sections_with_cv(screenshot_path):
-    """Stub for computer vision section detection"""
-    print(f"[Backend] CV fallback not implemented yet for {screenshot_path}")
+def detect_sections_with_cv(image_source):
+    """
+    Propose page sections with the local detector (see section_detector.py).
+    Accepts a path, image bytes, PIL image or array; returns [] when NumPy/PIL are unavailable.
+    """
+    try:
+        from section_detector import detect_sections
+        return detect_sections(image_source)
+    except ImportError as e:
+        print(f"[Backend] CV section detection unavailable: {e}")
+    except Exception as e:
+        print(f"[Backend] CV section detection failed: {e}")
     return []
 
-def validate_and_fix_bounding_boxes(sections):
-    """Stub for bounding box validation"""
-    print("[Backend] Bounding box validation not implemented yet")
+def validate_and_fix_bounding_boxes(sections, image=None, report: list = None):
+    """
+    Clip, de-duplicate, edge-snap and de-overlap the sections' bounding boxes (see bbox_validation.py).
+    `image` (path, bytes, PIL image or array) enables edge snapping; per-box corrections are
+    appended to `report` when given. Without NumPy the sections are returned unchanged.
+    """
+    try:
+        from bbox_validation import validate_boxes
+    except ImportError as e:
+        print(f"[Backend] Bounding box validation unavailable: {e}")
+        return sections
+    sections, corrections = validate_boxes(sections, image)
+    if report is not None:
+        report.extend(corrections)
     return sections
 
-async def extract_bounding_boxes_only(screenshot_url: str, sections: list, website_url: str):
+async def request_screenshot_sync(website_url: str, timeout: int = 45):
     """
-    Use vision model to detect actual bounding boxes from screenshot
+    Capture a screenshot in the screenshot server's synchronous mode (`wait=true`).
+    The server only answers once the image is written, so no polling is needed.
+    Returns (screenshot_id, screenshot_path) or (None, None) on failure.
+    """
+    try:
+        response = await get_http_client("screenshot").post("http://localhost:8001/screenshot",
+            json={"url": website_url, "full_page": True, "hide_popups": True, "wait": True},
+            timeout=timeout)
+        if not response.is_success:
+            print(f"[Backend] Screenshot request failed: {response.status_code} - {response.text}")
+            return None, None
+        screenshot_id = response.headers.get("x-screenshot-id")
+        filename = response.headers.get("x-screenshot-filename")
+        if not screenshot_id or not filename:
+            print("[Backend] Screenshot server did not return a persisted capture")
+            return None, None
+        screenshot_path = os.path.join(os.path.dirname(__file__), 'screenshots', filename)
+        print(f"[Backend] ✅ Screenshot ready at: {screenshot_path} ({len(response.content)} bytes)")
+        return screenshot_id, screenshot_path
+    except Exception as e:
+        print(f"[Backend] Screenshot failed: {e}")
+        return None, None
+
+BBOX_VISION_MODEL = "openai/gpt-4o"
+TEXT_ANALYSIS_MODEL = "anthropic/claude-3.7-sonnet:thinking"  # More reliable model
+# When the CV detector finds exactly one section per feature, all at least this confident,
+# its boxes are used in page order and the vision request is skipped
+CV_TRUST_CONFIDENCE = float(os.getenv("CV_TRUST_CONFIDENCE", "0.85"))
+# Coarse boxes below this confidence are re-detected on a full-resolution crop around them
+BBOX_REFINE_THRESHOLD = float(os.getenv("BBOX_REFINE_THRESHOLD", "0.7"))
+BBOX_REFINE_CONCURRENCY = int(os.getenv("BBOX_REFINE_CONCURRENCY", "4"))
+# Context around a box in its refinement crop: a fraction of the box size, at least REFINE_MIN_MARGIN percent
+REFINE_MARGIN = 0.5
+REFINE_MIN_MARGIN = 2.0
+# Tall pages are detected tile by tile (see image_prep.tile_image), this many requests at once
+BBOX_TILE_CONCURRENCY = int(os.getenv("BBOX_TILE_CONCURRENCY", "4"))
+
+# Finished analyses are cached per page and reused while its screenshot is identical.
+# Bump the version whenever the extraction prompts change.
+EXTRACTION_CACHE_NAMESPACE = "extract-features"
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", str(24 * 3600)))
+EXTRACTION_PROMPT_VERSION = "1"
+
+# Memoized stages: vision answers for an identical image and prompt, and the text
+# analysis of a URL (see memoize.py)
+VISION_STAGE_CACHE_TTL = int(os.getenv("VISION_STAGE_CACHE_TTL", str(7 * 24 * 3600)))
+VISION_STAGE_CACHE_BYTES = int(os.getenv("VISION_STAGE_CACHE_BYTES", str(32 * 1024 * 1024)))
+TEXT_STAGE_CACHE_TTL = int(os.getenv("TEXT_STAGE_CACHE_TTL", str(6 * 3600)))
+TEXT_STAGE_CACHE_BYTES = int(os.getenv("TEXT_STAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+def resolve_local_screenshot(screenshot_url: str):
+    """Local path of a screenshot served by our own screenshot server, or None."""
+    if not screenshot_url or "localhost" not in screenshot_url:
+        return None
+    from screenshot_watcher import get_screenshot_watcher
+    screenshot_id = screenshot_url.rstrip("/").rsplit("/", 1)[-1]
+    return get_screenshot_watcher().lookup(screenshot_id)
+
+async def extract_bounding_boxes_only(screenshot_url: str, sections: list, website_url: str,
+                                      screenshot_path: str = None, image=None, candidates: list = None,
+                                      tile_label: str = None):
+    """
+    Use vision model to detect actual bounding boxes from screenshot.
+    The image is taken from `image` (bytes, PIL image or an already PreparedImage) or `screenshot_path` when given,
+    otherwise from the local screenshots directory; only remote URLs are sent as URLs.
+    `candidates` are CV section proposals, passed to the model as hints. `tile_label` marks the
+    image as one tile of a tall page; coordinates are then relative to the tile.
     """
     print(f"[Backend] Starting vision model bounding box detection for {len(sections)} features")
     
-    load_dotenv()
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        print("[Backend] No OPENROUTER_API_KEY found!")
-        return []
-    
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    
     # Create a focused prompt for bounding box detection
     feature_names = [section.get('featureName', f'Feature {i+1}') for i, section in enumerate(sections)]
     feature_list = '\n'.join([f"- {name}" for name in feature_names])
+    candidate_list = ""
+    if candidates:
+        candidate_list = (
+            "CANDIDATE REGIONS (full-width bands found by edge analysis; they may need merging or splitting):\n"
+            + '\n'.join(f"- y={c['bounding_box']['y']}%, height={c['bounding_box']['height']}%" for c in candidates)
+            + "\n\n"
+        )
+    if tile_label:
+        scope = (
+            f"This image is {tile_label}. Only locate features visible in it, give coordinates relative to "
+            "THIS image, and for a feature cut off at the top or bottom edge give its visible part.\n\n"
+        )
+        layout_hints = ""
+    else:
+        scope = ""
+        layout_hints = (
+            "- Headers typically: y=0-15%, height=10-15%\n"
+            "- Hero/main content: y=15-60%, height=20-50%\n"
+            "- Footer sections: y=80-100%, height=10-20%\n"
+        )
     
     bounding_box_prompt = (
         f"You are a computer vision expert analyzing a website screenshot from {website_url}.\n\n"
         
         "🎯 TASK: Look at this screenshot and provide PRECISE bounding box coordinates for each feature listed below.\n\n"
         
+        f"{scope}"
+        
         f"FEATURES TO LOCATE:\n{feature_list}\n\n"
         
+        f"{candidate_list}"
+        
         "📐 COORDINATE REQUIREMENTS:\n"
         "- Provide x, y, width, height as percentages (0-100)\n"
         "- x,y = TOP-LEFT corner of each element\n"
         "- Be precise based on visual inspection of the screenshot\n"
-        "- Headers typically: y=0-15%, height=10-15%\n"
-        "- Hero/main content: y=15-60%, height=20-50%\n"
-        "- Footer sections: y=80-100%, height=10-20%\n\n"
+        f"{layout_hints}"
+        "- confidence (0-1) = how sure you are of the exact edges; use a low value for small or hard to see sections\n\n"
         
         "🔍 ANALYSIS METHOD:\n"
         "1. Carefully examine the screenshot\n"
@@ -104,8 +175,8 @@ async def extract_bounding_boxes_only(screenshot_url: str, sections: list, websi
         "Return ONLY a JSON object with this exact format:\n"
         "{\n"
         '  "bounding_boxes": [\n'
-        '    {"featureName": "Header Navigation", "x": 0, "y": 0, "width": 100, "height": 12},\n'
-        '    {"featureName": "Hero Section", "x": 0, "y": 15, "width": 100, "height": 45}\n'
+        '    {"featureName": "Header Navigation", "x": 0, "y": 0, "width": 100, "height": 12, "confidence": 0.9},\n'
+        '    {"featureName": "Hero Section", "x": 0, "y": 15, "width": 100, "height": 45, "confidence": 0.6}\n'
         "  ]\n"
         "}\n\n"
         
@@ -116,390 +187,289 @@ async def extract_bounding_boxes_only(screenshot_url: str, sections: list, websi
     message_content = [{"type": "text", "text": bounding_box_prompt}]
     
     # Add screenshot to message
-    if screenshot_url:
-        if "localhost" in screenshot_url:
-            # Handle localhost screenshots by converting to base64
-            try:
-                import requests
-                import base64
-                from PIL import Image
-                import io
-                
-                # Download the screenshot
-                response = requests.get(screenshot_url)
-                if response.ok:
-                    # Compress for vision model
-                    image = Image.open(io.BytesIO(response.content))
-                    image.thumbnail((1280, 720), Image.Resampling.LANCZOS)
-                    
-                    buffer = io.BytesIO()
-                    image.convert('RGB').save(buffer, format='JPEG', quality=85)
-                    buffer.seek(0)
-                    
-                    screenshot_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                    image_data_url = f"data:image/jpeg;base64,{screenshot_b64}"
-                    
-                    message_content.append({
-                        "type": "image_url", 
-                        "image_url": {"url": image_data_url}
-                    })
-                    print(f"[Backend] Added compressed screenshot for vision analysis")
-                else:
-                    print(f"[Backend] Failed to download screenshot: {response.status_code}")
-                    return []
-            except Exception as e:
-                print(f"[Backend] Failed to process screenshot: {e}")
-                return []
-        else:
-            # External URL - can be used directly
+    if image is None and not screenshot_path:
+        screenshot_path = resolve_local_screenshot(screenshot_url)
+    image_source = image if image is not None else screenshot_path
+    if image_source is not None:
+        try:
+            if isinstance(image_source, PreparedImage):
+                prepared = image_source
+            else:
+                prepared = await asyncio.to_thread(prepare_image, image_source, BBOX_VISION_MODEL)
             message_content.append({
-                "type": "image_url", 
-                "image_url": {"url": screenshot_url}
+                "type": "image_url",
+                "image_url": {"url": prepared.data_url()}
             })
+            print("[Backend] Added compressed screenshot for vision analysis")
+        except Exception as e:
+            print(f"[Backend] Failed to process screenshot: {e}")
+            return []
+    elif screenshot_url and "localhost" in screenshot_url:
+        print(f"[Backend] Screenshot not found locally: {screenshot_url}")
+        return []
+    elif screenshot_url:
+        # External URL - can be used directly
+        message_content.append({
+            "type": "image_url", 
+            "image_url": {"url": screenshot_url}
+        })
+    
+    coordinates_data = await request_vision_json(message_content)
+    if coordinates_data is None:
+        return []
     
-    # Vision model payload
+    # Extract bounding boxes from response
+    if isinstance(coordinates_data, dict) and 'bounding_boxes' in coordinates_data:
+        coordinates = coordinates_data['bounding_boxes']
+    elif isinstance(coordinates_data, list):
+        coordinates = coordinates_data
+    else:
+        print(f"[Backend] Unexpected response format: {coordinates_data}")
+        return []
+    
+    print(f"[Backend] Successfully received {len(coordinates)} bounding box coordinates from vision model")
+    return coordinates
+
+@memoize_stage("vision_json", ttl=VISION_STAGE_CACHE_TTL, max_bytes=VISION_STAGE_CACHE_BYTES,
+               settings=lambda: {"model": BBOX_VISION_MODEL, "response_format": "json_object"})
+async def request_vision_json(message_content: list):
+    """Send one message to the bounding box vision model and return its parsed JSON content, or None."""
+    load_dotenv()
     payload = {
-        "model": "openai/gpt-4o",  # Vision-capable model
+        "model": BBOX_VISION_MODEL,  # Vision-capable model
         "messages": [{"role": "user", "content": message_content}],
         "response_format": {"type": "json_object"}
     }
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
+    for attempt in range(2):
+        try:
+            print("[Backend] Requesting bounding box coordinates from vision model...")
+            # The retry skips the completion cache
+            completion = await chat_completion(payload, label="vision", cache=False if attempt else None)
+            print(f"[Backend] Vision model response: {completion.content}")
+            return loads_llm_json(completion.content, context="vision model", expect=(dict, list))
+        except PartialJSONError as e:
+            print(f"[Backend] Vision model output incomplete (attempt {attempt + 1}): {e}")
+        except Exception as e:
+            print(f"[Backend] Vision model bounding box detection failed: {e}")
+            return None
+    return None
+
+def _confidence(bbox: dict) -> float:
     try:
-        print("[Backend] Requesting bounding box coordinates from vision model...")
-        resp = requests.post(url, json=payload, headers=headers)
-        print(f"[Backend] Vision model response status: {resp.status_code}")
-        
-        if resp.status_code != 200:
-            print(f"[Backend] Vision model request failed: {resp.text}")
-            return []
-        
-        result = resp.json()
-        
-        # Check if the response has the expected structure
-        if "choices" not in result:
-            print(f"[Backend] Unexpected response format: {result}")
-            return []
-        
-        if not result["choices"] or len(result["choices"]) == 0:
-            print(f"[Backend] No choices in response: {result}")
-            return []
-        
-        if "message" not in result["choices"][0]:
-            print(f"[Backend] Unexpected choice format: {result['choices'][0]}")
-            return []
-        
-        if "content" not in result["choices"][0]["message"]:
-            print(f"[Backend] Unexpected message format: {result['choices'][0]['message']}")
-            return []
-        
-        content = result["choices"][0]["message"]["content"]
-        print(f"[Backend] Vision model response: {content}")
-        
-        coordinates_data = json.loads(content)
-        
-        # Extract bounding boxes from response
-        if isinstance(coordinates_data, dict) and 'bounding_boxes' in coordinates_data:
-            coordinates = coordinates_data['bounding_boxes']
-        elif isinstance(coordinates_data, list):
-            coordinates = coordinates_data
+        return float(bbox.get('confidence', 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+def _candidates_in_tile(candidates: list, tile) -> list:
+    """CV proposals overlapping a tile, in the tile's coordinates."""
+    local = []
+    for candidate in candidates or []:
+        box = candidate['bounding_box']
+        top = max(box['y'], tile.top)
+        bottom = min(box['y'] + box['height'], tile.top + tile.height)
+        if bottom > top:
+            local.append({'bounding_box': {
+                'y': round((top - tile.top) / tile.height * 100, 2),
+                'height': round((bottom - top) / tile.height * 100, 2),
+            }})
+    return local
+
+def merge_tile_boxes(bounding_boxes: list, tolerance: float) -> list:
+    """
+    Deduplicate boxes detected on overlapping tiles. Boxes of the same feature that overlap
+    or are at most `tolerance` percent apart are one section cut by a seam and get joined;
+    if a feature still has several boxes, the most confident one is kept.
+    """
+    groups = {}
+    for bbox in sorted(bounding_boxes, key=lambda b: b['y']):
+        occurrences = groups.setdefault(bbox.get('featureName', '').lower().strip(), [])
+        last = occurrences[-1] if occurrences else None
+        if last and bbox['y'] <= last['y'] + last['height'] + tolerance:
+            left = min(last['x'], bbox['x'])
+            right = max(last['x'] + last['width'], bbox['x'] + bbox['width'])
+            bottom = max(last['y'] + last['height'], bbox['y'] + bbox['height'])
+            last.update(x=left, width=round(right - left, 2), height=round(bottom - last['y'], 2),
+                        confidence=max(_confidence(last), _confidence(bbox)))
         else:
-            print(f"[Backend] Unexpected response format: {coordinates_data}")
-            return []
-        
-        print(f"[Backend] Successfully received {len(coordinates)} bounding box coordinates from vision model")
-        return coordinates
-        
-    except Exception as e:
-        print(f"[Backend] Vision model bounding box detection failed: {e}")
-        return []
+            occurrences.append(dict(bbox))
+    return [max(occurrences, key=_confidence) for occurrences in groups.values()]
 
-async def extract_features_logic(request: Request):
+async def extract_bounding_boxes_tiled(tiles: list, screenshot_url: str, sections: list, website_url: str,
+                                       candidates: list = None):
     """
-    Main function to handle feature extraction requests.
-    This is the function that main.py imports and calls.
-    Uses 3-phase analysis: text → screenshot → vision model bounding boxes
+    Coarse detection on a page split into tiles (see image_prep.tile_image): one request per tile,
+    BBOX_TILE_CONCURRENCY at a time, with boxes mapped back to page percentages and
+    deduplicated across tile seams. A single tile is one plain request.
     """
-    print("[DEBUG] ===== extract_features_logic started =====")
-    try:
-        load_dotenv()
-        print("[DEBUG] About to parse request body...")
-        body = await request.json()
-        print(f"[DEBUG] Request body parsed: {body}")
-        print(f"[DEBUG] Request body type: {type(body)}")
-        
-        website_url = body.get("url")
-        
-        # PHASE 1: Text-only feature extraction
-        print("[DEBUG] PHASE 1: Starting text-only feature extraction...")
-        result = await build_openrouter_payload(body)
-        print(f"[DEBUG] Phase 1 complete. Extracted {len(result.get('websiteFeatures', []))} features")
-        
-        # PHASE 2: Generate screenshot 
-        print("[DEBUG] PHASE 2: Generating screenshot...")
-        screenshot_url = None
-        try:
-            screenshot_response = requests.post("http://localhost:8001/screenshot", 
-                json={"url": website_url, "full_page": True, "hide_popups": True}, 
-                timeout=30)
-            if screenshot_response.ok:
-                screenshot_id = screenshot_response.json().get("screenshot_id")
-                screenshot_url = f"http://localhost:8001/screenshot/{screenshot_id}"
-                
-                # Wait for screenshot to be ready
-                import time
-                for i in range(30):  # Wait up to 30 seconds
-                    try:
-                        check_response = requests.get(screenshot_url, timeout=5)
-                        if check_response.ok:
-                            print(f"[DEBUG] Screenshot ready: {screenshot_url}")
-                            break
-                    except:
-                        pass
-                    time.sleep(1)
-                else:
-                    print("[DEBUG] Screenshot timeout")
-                    screenshot_url = None
-            else:
-                print(f"[DEBUG] Screenshot request failed: {screenshot_response.text}")
-        except Exception as e:
-            print(f"[DEBUG] Screenshot generation failed: {e}")
-        
-        # PHASE 3: Vision model bounding box detection
-        if screenshot_url and result.get('websiteFeatures'):
-            print("[DEBUG] PHASE 3: Starting vision model bounding box detection...")
+    if len(tiles) == 1:
+        return await extract_bounding_boxes_only(screenshot_url, sections, website_url,
+                                                 image=tiles[0].image, candidates=candidates)
+    slots = asyncio.Semaphore(BBOX_TILE_CONCURRENCY)
+
+    async def detect(index: int, tile):
+        label = (f"part {index + 1} of {len(tiles)} of a tall page, covering y={tile.top:.1f}% to "
+                 f"{tile.top + tile.height:.1f}% of the full page")
+        async with slots:
+            boxes = await extract_bounding_boxes_only(screenshot_url, sections, website_url, image=tile.image,
+                                                      candidates=_candidates_in_tile(candidates, tile),
+                                                      tile_label=label)
+        mapped = []
+        for bbox in boxes:
             try:
-                bounding_boxes = await extract_bounding_boxes_only(
-                    screenshot_url, 
-                    result['websiteFeatures'], 
-                    website_url
-                )
-                
-                if bounding_boxes:
-                    print(f"[DEBUG] Vision model returned {len(bounding_boxes)} bounding boxes")
-                    
-                    # Merge bounding boxes with features
-                    features_with_boxes = []
-                    for feature in result['websiteFeatures']:
-                        feature_name = feature.get('featureName', '')
-                        
-                        # Find matching bounding box (case-insensitive)
-                        matching_box = None
-                        for bbox in bounding_boxes:
-                            bbox_name = bbox.get('featureName', '').lower().strip()
-                            feature_name_clean = feature_name.lower().strip()
-                            
-                            if (bbox_name == feature_name_clean or 
-                                bbox_name in feature_name_clean or 
-                                feature_name_clean in bbox_name):
-                                matching_box = bbox
-                                break
-                        
-                        if matching_box:
-                            feature['bounding_box'] = {
-                                'x': matching_box.get('x', 0),
-                                'y': matching_box.get('y', 0),
-                                'width': matching_box.get('width', 100),
-                                'height': matching_box.get('height', 20)
-                            }
-                            print(f"[DEBUG] ✅ Added vision-detected bounding box to '{feature_name}': {feature['bounding_box']}")
-                        else:
-                            print(f"[DEBUG] ❌ No vision bounding box found for '{feature_name}'")
-                        
-                        features_with_boxes.append(feature)
-                    
-                    result['websiteFeatures'] = features_with_boxes
-                    print(f"[DEBUG] Successfully merged vision model bounding boxes")
-                else:
-                    print("[DEBUG] No bounding boxes received from vision model")
-            except Exception as e:
-                print(f"[DEBUG] Vision model bounding box detection failed: {e}")
-                import traceback
-                traceback.print_exc()
+                x, y = float(bbox.get('x', 0)), float(bbox.get('y', 0))
+                width, height = float(bbox.get('width', 100)), float(bbox.get('height', 20))
+            except (TypeError, ValueError):
+                continue
+            mapped.append({**bbox, 'x': x, 'width': width,
+                           'y': round(tile.top + y / 100 * tile.height, 2),
+                           'height': round(height / 100 * tile.height, 2)})
+        return mapped
+
+    results = await asyncio.gather(*(detect(i, tile) for i, tile in enumerate(tiles)))
+    detected = [bbox for boxes in results for bbox in boxes]
+    merged = merge_tile_boxes(detected, tolerance=max(tile.height for tile in tiles) * IMAGE_TILE_OVERLAP)
+    print(f"[Backend] {len(detected)} boxes from {len(tiles)} tiles merged into {len(merged)}")
+    return merged
+
+def _refine_region(bounding_box: dict) -> dict:
+    """Percentage region around a box, with REFINE_MARGIN of context on every side."""
+    x, y = float(bounding_box.get('x', 0)), float(bounding_box.get('y', 0))
+    width, height = float(bounding_box.get('width', 100)), float(bounding_box.get('height', 20))
+    margin_x = max(REFINE_MIN_MARGIN, width * REFINE_MARGIN)
+    margin_y = max(REFINE_MIN_MARGIN, height * REFINE_MARGIN)
+    left, top = max(0.0, x - margin_x), max(0.0, y - margin_y)
+    right, bottom = min(100.0, x + width + margin_x), min(100.0, y + height + margin_y)
+    return {'x': left, 'y': top, 'width': max(0.1, right - left), 'height': max(0.1, bottom - top)}
+
+async def refine_bounding_boxes(bounding_boxes: list, screenshot_id: str, screenshot_path: str, website_url: str,
+                                threshold: float = None, concurrency: int = None):
+    """
+    Fine pass of the coarse-to-fine detector: every box below `threshold` confidence is
+    re-detected on a full-resolution crop around it, concurrently (at most `concurrency`
+    requests at once), and mapped back to page percentages. Boxes are updated in place.
+    """
+    threshold = BBOX_REFINE_THRESHOLD if threshold is None else threshold
+    concurrency = BBOX_REFINE_CONCURRENCY if concurrency is None else concurrency
+    low_confidence = [bbox for bbox in bounding_boxes if _confidence(bbox) < threshold]
+    if not low_confidence or concurrency < 1 or not screenshot_path:
+        return bounding_boxes
+    try:
+        from PIL import Image
+        from raster_cache import get_raster_cache
+    except ImportError as e:
+        print(f"[Backend] Bounding box refinement unavailable: {e}")
+        return bounding_boxes
+
+    print(f"[Backend] Refining {len(low_confidence)}/{len(bounding_boxes)} low-confidence boxes (threshold {threshold})")
+    slots = asyncio.Semaphore(concurrency)
+
+    async def refine(bbox: dict):
+        region = _refine_region(bbox)
+        feature_name = bbox.get('featureName', '')
+        async with slots:
+            crops = await asyncio.to_thread(get_raster_cache().crop, screenshot_id, screenshot_path, [region])
+            prepared = await asyncio.to_thread(prepare_image, Image.fromarray(crops[0]['pixels']), BBOX_VISION_MODEL)
+            refined = await request_vision_json([
+                {"type": "text", "text": (
+                    f"This image is a crop of a screenshot of {website_url}, taken around the section "
+                    f"'{feature_name}'.\n\n"
+                    "Locate that section in THIS image and return ONLY a JSON object:\n"
+                    '{"found": true, "x": 0, "y": 10, "width": 100, "height": 60, "confidence": 0.9}\n\n'
+                    "- x, y, width, height are percentages (0-100) of this image; x,y = TOP-LEFT corner\n"
+                    "- confidence is how sure you are (0-1)\n"
+                    '- Return {"found": false} if the section is not visible in this image'
+                )},
+                {"type": "image_url", "image_url": {"url": prepared.data_url()}},
+            ])
+        if not isinstance(refined, dict) or not refined.get('found'):
+            print(f"[Backend] Refinement kept the coarse box for '{feature_name}'")
+            return
+        local = {key: float(refined[key]) for key in ('x', 'y', 'width', 'height')}
+        bbox['x'] = round(region['x'] + local['x'] / 100 * region['width'], 2)
+        bbox['y'] = round(region['y'] + local['y'] / 100 * region['height'], 2)
+        bbox['width'] = round(local['width'] / 100 * region['width'], 2)
+        bbox['height'] = round(local['height'] / 100 * region['height'], 2)
+        bbox['confidence'] = float(refined.get('confidence', threshold))
+        bbox['refined'] = True
+        print(f"[Backend] ✅ Refined box for '{feature_name}': {bbox}")
+
+    results = await asyncio.gather(*(refine(bbox) for bbox in low_confidence), return_exceptions=True)
+    for bbox, result in zip(low_confidence, results):
+        if isinstance(result, Exception):
+            print(f"[Backend] Refinement failed for '{bbox.get('featureName', '')}': {result}")
+    return bounding_boxes
+
+def merge_bounding_boxes(features: list, bounding_boxes: list) -> int:
+    """
+    Attach vision-detected boxes to features by fuzzy name matching.
+    Returns the number of features that received a box.
+    """
+    features_matched = 0
+    for feature in features:
+        feature_name = feature.get('featureName', '')
+        feature_name_clean = feature_name.lower().strip()
+
+        # Find matching bounding box (case-insensitive and fuzzy matching)
+        matching_box = None
+        best_match_score = 0
+
+        for bbox in bounding_boxes:
+            bbox_name = bbox.get('featureName', '').lower().strip()
+
+            # Try different matching strategies
+            match_score = 0
+            if bbox_name == feature_name_clean:
+                match_score = 100  # Perfect match
+            elif bbox_name in feature_name_clean or feature_name_clean in bbox_name:
+                match_score = 80   # Partial match
+            elif any(word in bbox_name for word in feature_name_clean.split() if len(word) > 2):
+                match_score = 60   # Word match
+            elif any(word in feature_name_clean for word in bbox_name.split() if len(word) > 2):
+                match_score = 60   # Word match reverse
+
+            if match_score > best_match_score:
+                best_match_score = match_score
+                matching_box = bbox
+
+        if matching_box and best_match_score >= 60:  # Minimum 60% confidence
+            feature['bounding_box'] = {
+                'x': matching_box.get('x', 0),
+                'y': matching_box.get('y', 0),
+                'width': matching_box.get('width', 100),
+                'height': matching_box.get('height', 20)
+            }
+            features_matched += 1
+            print(f"[Backend] ✅ Added bounding box to feature '{feature_name}' (score: {best_match_score}): {feature['bounding_box']}")
         else:
-            print("[DEBUG] Skipping vision model phase (no screenshot or features)")
-        
-        print("[DEBUG] ===== extract_features_logic completed successfully =====")
-        return result
-    except Exception as e:
-        print(f"[DEBUG] ===== ERROR in extract_features_logic =====")
-        print(f"[DEBUG] Exception type: {type(e)}")
-        print(f"[DEBUG] Exception message: {str(e)}")
-        import traceback
-        print(f"[DEBUG] Full traceback:")
-        traceback.print_exc()
-        print("[DEBUG] ===== END ERROR =====")
-        raise HTTPException(status_code=500, detail=str(e))
+            print(f"[Backend] ❌ No matching bounding box found for feature: '{feature_name}' (best score: {best_match_score})")
+    return features_matched
 
-async def build_openrouter_payload(body, screenshot_image_url=None):
-    print("[DEBUG] ===== build_openrouter_payload started =====")
-    print(f"[DEBUG] Input body: {body}")
-    print(f"[DEBUG] Input body type: {type(body)}")
-    
-    website_url = body.get("url", "https://www.apple.com")
-    print(f"[DEBUG] Website URL: {website_url}")
-    
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    print(f"[DEBUG] API key present: {api_key is not None}")
-    print(f"[DEBUG] API key starts with 'sk-': {api_key.startswith('sk-') if api_key else 'N/A'}")
-    
-    if not api_key:
-        print("[DEBUG] ERROR: OpenRouter API key not configured")
-        raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
-    
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    print("[Backend] Processing body:", body)
-    website_url = body.get("url")
-    use_screenshot = body.get("screenshot", False)
-    print("[Backend] use_screenshot value:", use_screenshot)
-    stream = False  # Always use non-streaming mode for OpenRouter
-    
-    # Validate and normalize website_url
-    if not website_url or not isinstance(website_url, str):
-        print("[Backend] Invalid or missing 'url' for screenshot:", website_url)
-        raise HTTPException(status_code=400, detail="Invalid or missing 'url' for screenshot.")
-    if not (website_url.startswith("http://") or website_url.startswith("https://")):
-        website_url = "https://" + website_url
-        body["url"] = website_url
-
-    print("[Backend] Starting 2-phase analysis: Text-only first, then bounding boxes")
-    print(f"[Backend] Screenshot coordination status: {body.get('screenshot_coordination_success', False)}")
-    
-    # Get screenshot for bounding box analysis (if needed)
-    screenshot_b64 = None
-    screenshot_path = None  
-    screenshot_url = None
-    screenshot_id = None
-    
-    # Check if screenshot was already coordinated by main.py
-    screenshot_coordination_success = body.get('screenshot_coordination_success', False)
-    if screenshot_coordination_success:
-        print("[Backend] ✅ Using pre-coordinated screenshot from main.py")
-        screenshot_id = body.get('screenshot_id')
-        screenshot_path = body.get('screenshot_path') 
-        screenshot_url = body.get('screenshot_url')
-        print(f"[Backend] Pre-coordinated screenshot: ID={screenshot_id}, URL={screenshot_url}")
-        
-        # Verify the pre-coordinated screenshot is actually ready
-        if screenshot_path and os.path.exists(screenshot_path) and os.path.getsize(screenshot_path) > 0:
-            print(f"[Backend] ✅ Pre-coordinated screenshot verified: {screenshot_path}")
+def apply_cv_fallback(features: list, cv_features: list):
+    """Assign computer-vision section boxes, in page order, to the features."""
+    for i, cv_feature in enumerate(cv_features):
+        if i < len(features):
+            features[i]['bounding_box'] = cv_feature['bounding_box']
+            print(f"[Backend] Applied CV bounding box to feature: {features[i].get('featureName')}")
+
+def assign_crop_urls(features: list, screenshot_id: str, screenshot_path: str):
+    """Crop URLs for feature images, rendered lazily by GET /crops/... on first view."""
+    from crop_cache import crop_url
+    from raster_cache import source_version
+
+    version = source_version(screenshot_path) if screenshot_path else None
+    assigned = 0
+    for i, feature in enumerate(features):
+        if 'bounding_box' in feature:
+            # Full URL for frontend; the same box of the same capture always yields the same URL
+            crop_path = crop_url(screenshot_id, feature['bounding_box'], version=version)
+            feature['cropped_image_url'] = f"http://localhost:8000{crop_path}"
+            assigned += 1
         else:
-            print(f"[Backend] ⚠️ Pre-coordinated screenshot not found, will request new one")
-            screenshot_coordination_success = False
-            # Reset variables for new request
-            screenshot_id = None
-            screenshot_path = None
-            screenshot_url = None
-    
-    if use_screenshot and not screenshot_coordination_success:
-        try:
-            print("[Backend] Requesting screenshot for bounding box analysis...")
-            screenshot_response = requests.post("http://localhost:8001/screenshot", 
-                json={"url": website_url, "full_page": True, "hide_popups": True}, 
-                timeout=30)
-            if screenshot_response.ok:
-                screenshot_id = screenshot_response.json().get("screenshot_id")
-                print(f"[Backend] Screenshot requested with ID: {screenshot_id}")
-                
-                # Wait for screenshot to be ready and get the image
-                import time
-                screenshots_dir = os.path.join(os.path.dirname(__file__), 'screenshots')
-                print(f"[Backend] Screenshots directory: {screenshots_dir}")
-                print(f"[Backend] Directory exists: {os.path.exists(screenshots_dir)}")
-                
-                pattern = f'_{screenshot_id}.png'
-                print(f"[Backend] Looking for files ending with: {pattern}")
-                
-                screenshot_ready = False
-                for i in range(45):  # Increased to 45 seconds
-                    try:
-                        if not os.path.exists(screenshots_dir):
-                            print(f"[Backend] Screenshots directory doesn't exist: {screenshots_dir}")
-                            time.sleep(1)
-                            continue
-                            
-                        files_in_dir = os.listdir(screenshots_dir)
-                        matching_files = [f for f in files_in_dir if f.endswith(pattern)]
-                        
-                        if i % 5 == 0:  # Log every 5 seconds
-                            print(f"[Backend] Attempt {i+1}/45: Found {len(files_in_dir)} files in screenshots_dir")
-                            print(f"[Backend] Looking for pattern: {pattern}")
-                            print(f"[Backend] Matching files: {matching_files}")
-                        
-                        if matching_files:
-                            potential_screenshot_path = os.path.join(screenshots_dir, matching_files[0])
-                            
-                            # Check if file is fully written by testing file size stability
-                            try:
-                                stat1 = os.stat(potential_screenshot_path)
-                                time.sleep(0.5)  # Wait half a second
-                                stat2 = os.stat(potential_screenshot_path)
-                                
-                                # If file size is stable and > 0, consider it ready
-                                if stat1.st_size == stat2.st_size and stat1.st_size > 0:
-                                    screenshot_path = potential_screenshot_path
-                                    screenshot_url = f"http://localhost:8001/screenshot/{screenshot_id}"
-                                    screenshot_ready = True
-                                    print(f"[Backend] ✅ Screenshot ready at: {screenshot_path}")
-                                    print(f"[Backend] File size: {stat1.st_size} bytes")
-                                    break
-                                else:
-                                    print(f"[Backend] File size not stable yet: {stat1.st_size} -> {stat2.st_size}")
-                            except OSError as e:
-                                print(f"[Backend] Error checking file stability: {e}")
-                                
-                    except Exception as e:
-                        print(f"[Backend] Error while waiting for screenshot: {e}")
-                    
-                    time.sleep(1)
-                
-                if not screenshot_ready:
-                    print("[Backend] ❌ Screenshot not ready after 45 seconds, proceeding without visual analysis")
-                    
-                    # Try to check what files actually exist
-                    try:
-                        all_files = os.listdir(screenshots_dir) if os.path.exists(screenshots_dir) else []
-                        print(f"[Backend] All files in screenshots dir: {all_files}")
-                        recent_files = [f for f in all_files if screenshot_id in f]
-                        print(f"[Backend] Files containing screenshot_id '{screenshot_id}': {recent_files}")
-                    except Exception as e:
-                        print(f"[Backend] Error listing directory: {e}")
-            else:
-                print(f"[Backend] Screenshot request failed: {screenshot_response.status_code} - {screenshot_response.text}")
-        except Exception as e:
-            print(f"[Backend] Screenshot failed: {e}, proceeding without visual analysis")
-    
-    # Prepare compressed image fallback if we have a valid screenshot (either pre-coordinated or newly requested)
-    if screenshot_path and os.path.exists(screenshot_path) and "localhost" in (screenshot_url or ""):
-        print("[Backend] Preparing compressed image fallback for bounding box detection")
-        try:
-            from PIL import Image
-            import io
-            
-            # Compress image for smaller base64
-            with Image.open(screenshot_path) as img:
-                # Resize to smaller dimensions for analysis
-                img.thumbnail((1280, 720), Image.Resampling.LANCZOS)
-                
-                # Save as JPEG with compression
-                buffer = io.BytesIO()
-                img.convert('RGB').save(buffer, format='JPEG', quality=85)
-                buffer.seek(0)
-                
-                screenshot_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                print(f"[Backend] Compressed image size: {len(screenshot_b64)} characters")
-        except ImportError:
-            print("[Backend] PIL not available, skipping compression")
-        except Exception as e:
-            print(f"[Backend] Image compression failed: {e}")
-    
-    detailed_prompt = (
-    f"Analyze the website {website_url} and identify its main UI sections.\n\n"
-    
+            print(f"[Backend] ⚠️ No bounding box for feature '{feature.get('featureName', f'Feature_{i}')}', skipping crop")
+    print(f"[Backend] Crop URLs assigned for {assigned} features.")
+
+# Instructions of the text-only analysis, after the line naming the website
+FEATURE_ANALYSIS_INSTRUCTIONS = (
     "Return ONLY a JSON object with this structure:\n"
     "{\n"
     '  "websiteFeatures": [\n'
@@ -517,36 +487,21 @@ async def build_openrouter_payload(body, screenshot_image_url=None):
     '    "navigationStructure": "Site organization"\n'
     "  }\n"
     "}\n\n"
-    
+
     "Identify 3-5 main sections: Header, Hero, Services, About, Footer. Keep descriptions concise."
-    )
+)
 
-    # PHASE 1: Text-only analysis (cheap and fast)
-    text_only_prompt = (
-        "You are an advanced UI/UX analyst and business intelligence extractor. "
-        f"Analyze the website {website_url} based on its content and provide a structured breakdown WITHOUT any visual analysis:\n\n"
-        
-        "1. Content Analysis & Feature Detection\n"
-        "Based on typical website patterns, identify likely UI sections and their purposes.\n\n"
-        
-        "2. Per-Section Breakdown\n"
-        "For each section provide:\n"
-        "- name (descriptive of likely content)\n"
-        "- elements (common UI components for this type of section)\n" 
-        "- purpose (what this section likely achieves)\n"
-        "- style (typical styling patterns)\n"
-        "- mobile_behavior (how it would adapt)\n"
-        "- image_crop_url (leave empty)\n\n"
-        
-        "Analyze these typical sections: Header Navigation, Hero Section, Services/Features, Testimonials, Contact/CTA, Footer.\n\n"
-        
-        "CRITICAL: Return ONLY the JSON object. Start directly with { and end with }. No other text."
+def feature_analysis_payload(website_url: str, stream: bool = False) -> dict:
+    """OpenRouter payload of the text-only feature analysis."""
+    detailed_prompt = (
+        f"Analyze the website {website_url} and identify its main UI sections.\n\n"
+        + FEATURE_ANALYSIS_INSTRUCTIONS
     )
-    
+
     print("[Backend] Building OpenRouter payload for:", website_url)
-    openrouter_payload = {
-        "model": "anthropic/claude-3.7-sonnet:thinking", # More reliable model
-        "stream": False,
+    return {
+        "model": TEXT_ANALYSIS_MODEL,
+        "stream": stream,
         "messages": [
             {
                 "role": "user",
@@ -554,309 +509,350 @@ async def build_openrouter_payload(body, screenshot_image_url=None):
             }
         ]
     }
-    print(f"[DEBUG] OpenRouter payload built successfully")
-    print(f"[DEBUG] Payload keys: {list(openrouter_payload.keys())}")
-    print(f"[DEBUG] Messages count: {len(openrouter_payload['messages'])}")
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    if stream:
-        def event_stream():
-            print("[Backend] Sending streaming request to OpenRouter...")
-            with requests.post(url, json=openrouter_payload, headers=headers, stream=True) as r:
-                for line in r.iter_lines():
-                    if line:
-                        decoded = line.decode()
-                        print("[Backend] Stream chunk:", decoded)
-                        if decoded.startswith("data: "):
-                            data = decoded[6:]
-                            if data == "[DONE]":
-                                print("[Backend] Stream done.")
-                                yield "event: done\ndata: [DONE]\n\n"
-                                break
-                            yield f"event: result\ndata: {data}\n\n"
-                        elif decoded.startswith(":"):
-                            yield f"event: progress\ndata: {json.dumps({'message': decoded})}\n\n"
-        return StreamingResponse(event_stream(), media_type='text/event-stream')
-    else:
+
+async def stream_feature_analysis(website_url: str, api_key: str):
+    """
+    Stream the text-only analysis as server-sent events. Every feature is sent as a
+    `section` event as soon as the model has written it, followed by `architecture`,
+    `summary` and `field` events for the other parts, the full `result` and `done`.
+    """
+    parser = IncrementalJSONParser()
+    started = time.perf_counter()
+    first_section = None
+    try:
+        print("[Backend] Sending streaming request to OpenRouter...")
+        async for chunk in stream_chat_completion(feature_analysis_payload(website_url, stream=True),
+                                                  label="text-analysis-stream", api_key=api_key):
+            if chunk.comment:
+                # OpenRouter keep-alive comments while the model is thinking
+                yield f"event: progress\ndata: {json.dumps({'message': chunk.comment})}\n\n"
+                continue
+            for event in parser.feed(chunk.content):
+                if event["event"] == "section" and first_section is None:
+                    first_section = round(time.perf_counter() - started, 4)
+                    print(f"[Backend] First section after {first_section}s")
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    except OpenRouterError as e:
+        print("[Backend] OpenRouter error:", e.detail)
+        yield f"event: error\ndata: {json.dumps({'error': e.detail, 'status': e.upstream_status})}\n\n"
+        return
+    except Exception as e:
+        print(f"[Backend] Streaming analysis failed: {e}")
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        return
+
+    try:
+        result = parser.result() or clean_json(parser.buffer)
+    except ValueError as e:
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        return
+    timings = {"first_section": first_section, "total": round(time.perf_counter() - started, 4)}
+    yield f"event: result\ndata: {json.dumps(result)}\n\n"
+    yield f"event: timings\ndata: {json.dumps(timings)}\n\n"
+    yield "event: done\ndata: [DONE]\n\n"
+
+@memoize_stage("text_analysis", ttl=TEXT_STAGE_CACHE_TTL, max_bytes=TEXT_STAGE_CACHE_BYTES,
+               settings={"model": TEXT_ANALYSIS_MODEL, "instructions": FEATURE_ANALYSIS_INSTRUCTIONS}, ignore=("api_key",),
+               cache_if=lambda result: bool(result) and not result.get("fallback"))
+async def analyze_website_text(website_url: str, api_key: str) -> dict:
+    """Text-only feature analysis of a website (no screenshot involved)."""
+    print("[Backend] Sending request to OpenRouter for text-only analysis...")
+    payload = feature_analysis_payload(website_url)
+    for attempt in range(2):
         try:
-            print("[Backend] Sending request to OpenRouter for text-only analysis...")
-            resp = requests.post(url, json=openrouter_payload, headers=headers, timeout=60)
-            print("[Backend] OpenRouter response status:", resp.status_code)
-            print("[Backend] OpenRouter response text:", resp.text[:500])
-            if resp.status_code != 200:
-                print("[Backend] OpenRouter error:", resp.text)
-                raise HTTPException(status_code=resp.status_code, detail=resp.text)
-            if not resp.text:
-                print("[Backend] Empty response from OpenRouter!")
-                raise HTTPException(status_code=500, detail="Empty response from upstream service")
-            try:
-                # Handle OpenRouter's chunked response format
-                text = resp.text
-                json_start = text.find('{')
-                if json_start != -1:
-                    json_part = text[json_start:]
-                    data = json.loads(json_part)
-                    print(f"[DEBUG] Successfully parsed JSON from position {json_start}")
-                    print(f"[DEBUG] Parsed response keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
-                else:
-                    print("[Backend] No JSON found in OpenRouter response")
-                    raise HTTPException(status_code=500, detail="No JSON found in OpenRouter response")
-            except Exception as e:
-                print("[Backend] Failed to parse JSON from OpenRouter:", resp.text[:500])
-                raise HTTPException(status_code=500, detail="Invalid JSON from upstream service")
-            
-            if "choices" not in data:
-                print(f"[DEBUG] No 'choices' key in response. Available keys: {list(data.keys())}")
-                print("[DEBUG] OpenRouter failed, using fallback mock data...")
-                
-                # Fallback to mock data when OpenRouter fails
-                content_json = {
-                    "websiteFeatures": [
-                        {
-                            "featureName": "Header Navigation",
-                            "detailedDescription": "Top navigation bar with menu items and logo",
-                            "htmlStructure": "<header><nav><ul><li><a href='/'>Home</a></li></ul></nav></header>",
-                            "cssProperties": "display: flex; justify-content: space-between; padding: 1rem;"
-                        },
-                        {
-                            "featureName": "Hero Section",
-                            "detailedDescription": "Main banner area with headline and call-to-action",
-                            "htmlStructure": "<section class='hero'><h1>Welcome</h1><p>Description</p><button>CTA</button></section>",
-                            "cssProperties": "text-align: center; padding: 4rem 2rem; background: linear-gradient;"
-                        },
-                        {
-                            "featureName": "Footer",
-                            "detailedDescription": "Bottom section with links and contact info",
-                            "htmlStructure": "<footer><div class='footer-links'><a href='/privacy'>Privacy</a></div></footer>",
-                            "cssProperties": "background: #333; color: white; padding: 2rem;"
-                        }
-                    ],
-                    "siteUXArchitecture": {
-                        "businessContext": "Website for business services",
-                        "targetAudience": "General users and potential customers",
-                        "userGoals": "Find information and take action",
-                        "navigationStructure": "Standard web navigation with header and footer"
+            # A retry after incomplete output skips the completion cache
+            completion = await chat_completion(payload, label="text-analysis", api_key=api_key,
+                                               cache=False if attempt else None)
+        except OpenRouterResponseError as e:
+            print(f"[DEBUG] No usable completion from OpenRouter: {e.detail[:500]}")
+            print("[DEBUG] OpenRouter failed, using fallback mock data...")
+            # Fallback to mock data when OpenRouter fails (never cached)
+            return {
+                "fallback": True,
+                "websiteFeatures": [
+                    {
+                        "featureName": "Header Navigation",
+                        "detailedDescription": "Top navigation bar with menu items and logo",
+                        "htmlStructure": "<header><nav><ul><li><a href='/'>Home</a></li></ul></nav></header>",
+                        "cssProperties": "display: flex; justify-content: space-between; padding: 1rem;"
+                    },
+                    {
+                        "featureName": "Hero Section",
+                        "detailedDescription": "Main banner area with headline and call-to-action",
+                        "htmlStructure": "<section class='hero'><h1>Welcome</h1><p>Description</p><button>CTA</button></section>",
+                        "cssProperties": "text-align: center; padding: 4rem 2rem; background: linear-gradient;"
+                    },
+                    {
+                        "featureName": "Footer",
+                        "detailedDescription": "Bottom section with links and contact info",
+                        "htmlStructure": "<footer><div class='footer-links'><a href='/privacy'>Privacy</a></div></footer>",
+                        "cssProperties": "background: #333; color: white; padding: 2rem;"
                     }
+                ],
+                "siteUXArchitecture": {
+                    "businessContext": "Website for business services",
+                    "targetAudience": "General users and potential customers",
+                    "userGoals": "Find information and take action",
+                    "navigationStructure": "Standard web navigation with header and footer"
                 }
-                print("[DEBUG] Using fallback mock data for feature extraction")
-            else:
-                # Check if the response has the expected structure
-                if "choices" not in data:
-                    print(f"[Backend] Unexpected response format: {data}")
-                    raise HTTPException(status_code=500, detail=f"Unexpected OpenRouter response format: {data}")
-                
-                if not data["choices"] or len(data["choices"]) == 0:
-                    print(f"[Backend] No choices in response: {data}")
-                    raise HTTPException(status_code=500, detail="No choices in OpenRouter response")
-                
-                if "message" not in data["choices"][0]:
-                    print(f"[Backend] Unexpected choice format: {data['choices'][0]}")
-                    raise HTTPException(status_code=500, detail=f"Unexpected choice format: {data['choices'][0]}")
-                
-                if "content" not in data["choices"][0]["message"]:
-                    print(f"[Backend] Unexpected message format: {data['choices'][0]['message']}")
-                    raise HTTPException(status_code=500, detail=f"Unexpected message format: {data['choices'][0]['message']}")
-                
-                content_str = data["choices"][0]["message"]["content"]
-            print("[Backend] Content string from OpenRouter:", content_str[:500])
+            }
+
+        content_str = completion.content
+        print("[Backend] Content string from OpenRouter:", content_str[:500])
+        try:
+            return clean_json(content_str)
+        except PartialJSONError as e:
+            error = e
+            print(f"[Backend] Incomplete JSON from text analysis (attempt {attempt + 1}): {e}")
+        except Exception as e:
+            error = e
+            break
+    print("[Backend] Failed to parse content as JSON:", content_str)
+    raise HTTPException(status_code=500, detail=f"Failed to parse content as JSON: {error}")
+
+def extraction_cache_key(website_url: str) -> str:
+    return content_hash(canonical_url(website_url), TEXT_ANALYSIS_MODEL, BBOX_VISION_MODEL, EXTRACTION_PROMPT_VERSION)
+
+def _cached_extraction(cached: dict, captured: tuple) -> dict:
+    """A cached analysis, pointed at the freshly captured screenshot."""
+    content_json = cached['result']
+    features = content_json.get('websiteFeatures') or []
+    if any('bounding_box' in feature for feature in features):
+        assign_crop_urls(features, captured[0], captured[1])
+    return content_json
+
+class _CacheHit(Exception):
+    """Raised by the cache stage to end the pipeline with a cached analysis."""
+
+    def __init__(self, cached: dict, captured: tuple):
+        super().__init__("cached analysis")
+        self.cached = cached
+        self.captured = captured
+
+async def run_feature_pipeline(website_url: str, api_key: str, capture=None, screenshot=None, cache_mode: str = "use"):
+    """
+    Run feature extraction as a stage graph:
+
+        capture ──> thumbnail ──> cv ──┐
+           ├──> tiles ─────────────────┤
+           └──> cache                  │
+        text ──────────────────────────┴──> bbox ──> crops
+
+    Text analysis does not need the screenshot, so it overlaps with the capture,
+    the downscaled thumbnail (for CV detection and validation), the tiles sent to
+    the vision model and the CV section detection. `capture(url)` returns
+    (screenshot_id, screenshot_path); `screenshot` is an already captured pair.
+
+    The cache stage fingerprints the screenshot while the text analysis runs. With
+    `cache_mode` "use", a cached analysis of the same URL (and models and prompt
+    version) whose screenshot looks the same is returned, and the stages still
+    running are cancelled. "refresh" skips the lookup but stores the new result,
+    "bypass" does neither. Returns the analysis with per-stage durations under
+    "pipeline_timings" and the cache outcome under "cache".
+    """
+    capture = capture or request_screenshot_sync
+    timings = {}
+    cache = get_cache_store()
+    cache_key = extraction_cache_key(website_url)
+    cache_info = {"status": cache_mode if cache_mode != "use" else "miss", "key": cache_key[:16]}
+
+    async def capture_stage():
+        if screenshot and screenshot[1] and os.path.exists(screenshot[1]) and os.path.getsize(screenshot[1]) > 0:
+            print(f"[Backend] ✅ Using pre-coordinated screenshot: {screenshot[0]}")
+            return screenshot
+        try:
+            screenshot_id, screenshot_path = await capture(website_url)
+        except Exception as e:
+            print(f"[Backend] ❌ Screenshot not available, proceeding without visual analysis: {e}")
+            return None
+        if not screenshot_id:
+            print("[Backend] ❌ Screenshot not available, proceeding without visual analysis")
+            return None
+        return screenshot_id, screenshot_path
+
+    async def cache_stage(captured):
+        if cache_mode == "bypass" or not captured or not captured[1]:
+            return None
+        try:
+            screenshot_fingerprint = await asyncio.to_thread(image_fingerprint, captured[1])
+        except Exception as e:
+            print(f"[Backend] Failed to fingerprint screenshot: {e}")
+            return None
+        cached = await asyncio.to_thread(cache.get, EXTRACTION_CACHE_NAMESPACE, cache_key) if cache_mode == "use" else None
+        if cached:
+            if screenshot_matches(cached.get('fingerprint'), screenshot_fingerprint):
+                raise _CacheHit(cached, captured)
+            print("[Backend] Page changed since the cached analysis, running the pipeline")
+            cache_info["reason"] = "screenshot_changed"
+        return screenshot_fingerprint
+
+    async def text_stage():
+        return await analyze_website_text(website_url, api_key)
+
+    async def thumbnail_stage(captured):
+        if not captured or not captured[1]:
+            return None
+        try:
+            return await asyncio.to_thread(prepare_image, captured[1], BBOX_VISION_MODEL)
+        except Exception as e:
+            print(f"[Backend] Failed to process screenshot: {e}")
+            return None
+
+    async def tiles_stage(captured):
+        if not captured or not captured[1]:
+            return []
+        try:
+            return await asyncio.to_thread(tile_image, captured[1], BBOX_VISION_MODEL)
+        except Exception as e:
+            print(f"[Backend] Failed to tile screenshot: {e}")
+            return []
+
+    async def cv_stage(captured, thumbnail):
+        if thumbnail is not None and thumbnail.width:
+            # Already downscaled: decoding the small JPEG is much cheaper than the full PNG
+            return await asyncio.to_thread(detect_sections_with_cv, thumbnail.data)
+        if captured and captured[1]:
+            return await asyncio.to_thread(detect_sections_with_cv, captured[1])
+        return []
+
+    async def bbox_stage(content_json, captured, thumbnail, tiles, cv_sections):
+        features = content_json.get('websiteFeatures')
+        if not features:
+            return content_json
+        if (cv_sections and len(cv_sections) == len(features)
+                and min(section['confidence'] for section in cv_sections) >= CV_TRUST_CONFIDENCE):
+            print(f"[Backend] CV found {len(cv_sections)} confident sections, skipping the vision model")
+            apply_cv_fallback(features, cv_sections)
+        elif tiles:
             try:
-                content_json = clean_json(content_str)
-            except Exception as e:
-                print("[Backend] Failed to parse content as JSON:", content_str)
-                raise HTTPException(status_code=500, detail=f"Failed to parse content as JSON: {e}")
-            
-            print("[Backend] Text-only analysis complete")
-            print(f"[Backend] Current screenshot state: ID={screenshot_id}, URL={screenshot_url}, Path exists={screenshot_path and os.path.exists(screenshot_path) if screenshot_path else False}")
-            
-            # PHASE 2: Add bounding boxes if screenshot is available
-            if use_screenshot and content_json.get('websiteFeatures'):
-                print("[Backend] Starting Phase 2: Bounding box detection")
-                
-                # If we don't have a screenshot URL yet, try one more time to find it
-                if not screenshot_url and screenshot_id:
-                    print("[Backend] Attempting to find screenshot one more time...")
-                    screenshots_dir = os.path.join(os.path.dirname(__file__), 'screenshots')
-                    pattern = f'_{screenshot_id}.png'
-                    
-                    try:
-                        files_in_dir = os.listdir(screenshots_dir) if os.path.exists(screenshots_dir) else []
-                        matching_files = [f for f in files_in_dir if f.endswith(pattern)]
-                        
-                        if matching_files:
-                            potential_screenshot_path = os.path.join(screenshots_dir, matching_files[0])
-                            if os.path.exists(potential_screenshot_path) and os.path.getsize(potential_screenshot_path) > 0:
-                                screenshot_path = potential_screenshot_path
-                                screenshot_url = f"http://localhost:8001/screenshot/{screenshot_id}"
-                                print(f"[Backend] 🔄 Found screenshot on retry: {screenshot_url}")
-                    except Exception as e:
-                        print(f"[Backend] Error during screenshot retry: {e}")
-                
-                if screenshot_url:
-                    try:
-                        bounding_boxes = await extract_bounding_boxes_only(screenshot_url, content_json['websiteFeatures'], website_url)
-                        
-                        if bounding_boxes:
-                            print(f"[Backend] Successfully got {len(bounding_boxes)} bounding boxes")
-                            print(f"[Backend] Bounding boxes received: {bounding_boxes}")
-                            
-                            # Merge bounding boxes with features
-                            features_with_boxes = []
-                            features_matched = 0
-                            
-                            for feature in content_json['websiteFeatures']:
-                                feature_name = feature.get('featureName', '')
-                                print(f"[Backend] Processing feature: '{feature_name}'")
-                                
-                                # Find matching bounding box (case-insensitive and fuzzy matching)
-                                matching_box = None
-                                best_match_score = 0
-                                
-                                for bbox in bounding_boxes:
-                                    bbox_name = bbox.get('featureName', '').lower().strip()
-                                    feature_name_clean = feature_name.lower().strip()
-                                    
-                                    # Try different matching strategies
-                                    match_score = 0
-                                    if bbox_name == feature_name_clean:
-                                        match_score = 100  # Perfect match
-                                    elif bbox_name in feature_name_clean or feature_name_clean in bbox_name:
-                                        match_score = 80   # Partial match
-                                    elif any(word in bbox_name for word in feature_name_clean.split() if len(word) > 2):
-                                        match_score = 60   # Word match
-                                    elif any(word in feature_name_clean for word in bbox_name.split() if len(word) > 2):
-                                        match_score = 60   # Word match reverse
-                                    
-                                    if match_score > best_match_score:
-                                        best_match_score = match_score
-                                        matching_box = bbox
-                                
-                                if matching_box and best_match_score >= 60:  # Minimum 60% confidence
-                                    feature['bounding_box'] = {
-                                        'x': matching_box['x'],
-                                        'y': matching_box['y'], 
-                                        'width': matching_box['width'],
-                                        'height': matching_box['height']
-                                    }
-                                    features_matched += 1
-                                    print(f"[Backend] ✅ Added bounding box to feature '{feature_name}' (score: {best_match_score}): {feature['bounding_box']}")
-                                else:
-                                    print(f"[Backend] ❌ No matching bounding box found for feature: '{feature_name}' (best score: {best_match_score})")
-                                
-                                features_with_boxes.append(feature)
-                            
-                            content_json['websiteFeatures'] = features_with_boxes
-                            print(f"[Backend] Final result: {features_matched}/{len(content_json['websiteFeatures'])} features have bounding boxes")
-                        else:
-                            print("[Backend] No bounding boxes received from AI, trying computer vision fallback")
-                            # Apply computer vision fallback if no AI bounding boxes
-                            if screenshot_path and os.path.exists(screenshot_path):
-                                cv_features = detect_sections_with_cv(screenshot_path)
-                                if cv_features:
-                                    # Merge AI analysis with CV bounding boxes
-                                    for i, cv_feature in enumerate(cv_features):
-                                        if i < len(content_json['websiteFeatures']):
-                                            content_json['websiteFeatures'][i]['bounding_box'] = cv_feature['bounding_box']
-                                            print(f"[Backend] Applied CV bounding box to feature: {content_json['websiteFeatures'][i].get('featureName')}")
-                    
-                    except Exception as e:
-                        print(f"[Backend] Bounding box detection failed: {e}")
-                        import traceback
-                        print(f"[Backend] Traceback: {traceback.format_exc()}")
-                        # Continue without bounding boxes
-                else:
-                    print("[Backend] ⚠️ No screenshot available for bounding box detection")
-                    # Store screenshot info for potential later use
-                    if screenshot_id:
-                        content_json['screenshot_id'] = screenshot_id
-                        print(f"[Backend] Stored screenshot_id for later use: {screenshot_id}")
-            
-            # Apply validation to any existing bounding boxes
-            if content_json.get('websiteFeatures'):
-                print("[Backend] Applying bounding box validation...")
-                content_json['websiteFeatures'] = validate_and_fix_bounding_boxes(content_json['websiteFeatures'])
-                features_with_bboxes = len([f for f in content_json['websiteFeatures'] if 'bounding_box' in f])
-                print(f"[Backend] Validation complete. {features_with_bboxes}/{len(content_json['websiteFeatures'])} features have bounding boxes")
-                
-                # PHASE 4: Automatic cropping of feature images
-                if screenshot_path and os.path.exists(screenshot_path) and features_with_bboxes > 0:
-                    print("[Backend] Starting Phase 4: Automatic feature cropping...")
-                    try:
-                        from PIL import Image
-                        import uuid
-                        import re
-                        
-                        # Create crops directory if it doesn't exist
-                        crops_dir = os.path.join(os.path.dirname(__file__), 'section_crops')
-                        os.makedirs(crops_dir, exist_ok=True)
-                        
-                        # Open the screenshot once for all crops
-                        with Image.open(screenshot_path) as img:
-                            img_width, img_height = img.size
-                            print(f"[Backend] Screenshot dimensions: {img_width}x{img_height}")
-                            
-                            for i, feature in enumerate(content_json['websiteFeatures']):
-                                if 'bounding_box' in feature:
-                                    bbox = feature['bounding_box']
-                                    feature_name = feature.get('featureName', f'Feature_{i}')
-                                    
-                                    # Convert percentages to pixels
-                                    x_percent = bbox.get('x', 0)
-                                    y_percent = bbox.get('y', 0)
-                                    width_percent = bbox.get('width', 100)
-                                    height_percent = bbox.get('height', 100)
-                                    
-                                    x = int((x_percent / 100) * img_width)
-                                    y = int((y_percent / 100) * img_height)
-                                    width = int((width_percent / 100) * img_width)
-                                    height = int((height_percent / 100) * img_height)
-                                    
-                                    # Ensure coordinates are within image bounds
-                                    x = max(0, min(x, img_width))
-                                    y = max(0, min(y, img_height))
-                                    width = max(1, min(width, img_width - x))
-                                    height = max(1, min(height, img_height - y))
-                                    
-                                    # Crop the image
-                                    cropped_img = img.crop((x, y, x + width, y + height))
-                                    
-                                    # Save the cropped image
-                                    crop_id = str(uuid.uuid4())
-                                    safe_feature_name = re.sub(r'[^a-zA-Z0-9_-]', '_', feature_name.lower())
-                                    crop_filename = f'feature_{safe_feature_name}_{crop_id}.png'
-                                    crop_path = os.path.join(crops_dir, crop_filename)
-                                    
-                                    cropped_img.save(crop_path, 'PNG')
-                                    
-                                    # Add the cropped image URL to the feature (full URL for frontend)
-                                    feature['cropped_image_url'] = f'http://localhost:8000/section-crops/{crop_filename}'
-                                    print(f"[Backend] ✅ Cropped feature '{feature_name}' and saved to: {feature['cropped_image_url']}")
-                                else:
-                                    print(f"[Backend] ⚠️ No bounding box for feature '{feature.get('featureName', f'Feature_{i}')}', skipping crop")
-                        
-                        print(f"[Backend] Automatic cropping complete. {features_with_bboxes} features cropped.")
-                        
-                    except ImportError:
-                        print("[Backend] ⚠️ PIL not available, skipping automatic cropping")
-                    except Exception as e:
-                        print(f"[Backend] ⚠️ Automatic cropping failed: {e}")
-                        import traceback
-                        traceback.print_exc()
+                screenshot_url = f"http://localhost:8001/screenshot/{captured[0]}"
+                bounding_boxes = await extract_bounding_boxes_tiled(
+                    tiles, screenshot_url, features, website_url, candidates=cv_sections
+                )
+                if bounding_boxes:
+                    print(f"[Backend] Successfully got {len(bounding_boxes)} bounding boxes")
+                    with stage_timer(timings, "bbox_refine"):
+                        await refine_bounding_boxes(bounding_boxes, captured[0], captured[1], website_url)
+                    features_matched = merge_bounding_boxes(features, bounding_boxes)
+                    print(f"[Backend] Final result: {features_matched}/{len(features)} features have bounding boxes")
                 else:
-                    print("[Backend] ⚠️ No screenshot or bounding boxes available for automatic cropping")
-            
-            # ALWAYS include screenshot_id in response when available (for frontend display)
-            if screenshot_id:
-                content_json['screenshot_id'] = screenshot_id
-                content_json['screenshot_url'] = f"http://localhost:8001/screenshot/{screenshot_id}"
-                print(f"[Backend] ✅ Added screenshot info to response: ID={screenshot_id}")
-            
-            print("[Backend] Returning complete analysis")
-            return content_json
-        except Exception as e:
-            print(f"[DEBUG] Failed to parse content as JSON: {e}")
-            if 'content_str' in locals():
-                print(f"[DEBUG] Content string that failed to parse: {content_str}")
-            raise HTTPException(status_code=500, detail=f"Failed to parse content as JSON: {e}")
+                    print("[Backend] No bounding boxes received from AI, trying computer vision fallback")
+                    apply_cv_fallback(features, cv_sections)
+            except Exception as e:
+                print(f"[Backend] Bounding box detection failed: {e}")
+                import traceback
+                print(f"[Backend] Traceback: {traceback.format_exc()}")
+                # Continue without bounding boxes
+        else:
+            print("[Backend] ⚠️ No screenshot available for bounding box detection")
+
+        # Apply validation to any existing bounding boxes, snapping edges on the downscaled image
+        corrections = []
+        image = thumbnail.data if thumbnail is not None and thumbnail.width else (captured[1] if captured else None)
+        content_json['websiteFeatures'] = await asyncio.to_thread(
+            validate_and_fix_bounding_boxes, features, image, corrections
+        )
+        content_json['bbox_corrections'] = corrections
+        return content_json
+
+    async def crops_stage(content_json, captured):
+        features = content_json.get('websiteFeatures') or []
+        if captured and any('bounding_box' in feature for feature in features):
+            assign_crop_urls(features, captured[0], captured[1])
+        else:
+            print("[Backend] ⚠️ No screenshot or bounding boxes available for automatic cropping")
+        return content_json
+
+    # Memoized stages follow the result cache: refreshed or bypassed along with it
+    try:
+        with stage_cache_mode(cache_mode):
+            results = await run_stages([
+                Stage("capture", capture_stage),
+                Stage("text", text_stage),
+                Stage("cache", cache_stage, ("capture",)),
+                Stage("thumbnail", thumbnail_stage, ("capture",)),
+                Stage("tiles", tiles_stage, ("capture",)),
+                Stage("cv", cv_stage, ("capture", "thumbnail")),
+                Stage("bbox", bbox_stage, ("text", "capture", "thumbnail", "tiles", "cv")),
+                Stage("crops", crops_stage, ("bbox", "capture")),
+            ], timings)
+    except _CacheHit as hit:
+        cached, captured = hit.cached, hit.captured
+        print(f"[Backend] ♻️ Page unchanged since {time.ctime(cached['cached_at'])}, reusing cached analysis")
+        content_json = _cached_extraction(cached, captured)
+        content_json['screenshot_id'] = captured[0]
+        content_json['screenshot_url'] = f"http://localhost:8001/screenshot/{captured[0]}"
+        content_json['pipeline_timings'] = timings
+        content_json['cache'] = {"status": "hit", "key": cache_key[:16], "age": round(time.time() - cached['cached_at'])}
+        return content_json
+
+    content_json = results["crops"]
+    captured = results["capture"]
+    # ALWAYS include screenshot_id in response when available (for frontend display)
+    if captured:
+        content_json['screenshot_id'] = captured[0]
+        content_json['screenshot_url'] = f"http://localhost:8001/screenshot/{captured[0]}"
+        print(f"[Backend] ✅ Added screenshot info to response: ID={captured[0]}")
+    content_json['pipeline_timings'] = timings
+    print(f"[Backend] Pipeline timings: {timings}")
+
+    # The cache stage only fingerprints when results are stored
+    screenshot_fingerprint = results["cache"]
+    if screenshot_fingerprint and content_json.get('websiteFeatures') and not content_json.get('fallback'):
+        stored = {key: value for key, value in content_json.items()
+                  if key not in ('screenshot_id', 'screenshot_url', 'pipeline_timings')}
+        await asyncio.to_thread(cache.set, EXTRACTION_CACHE_NAMESPACE, cache_key,
+                                {"fingerprint": screenshot_fingerprint, "cached_at": time.time(), "result": stored},
+                                EXTRACTION_CACHE_TTL)
+    content_json['cache'] = cache_info
+    return content_json
+
+async def extract_features_logic(request: Request, capture=None):
+    """
+    Main function to handle feature extraction requests.
+    This is the function that main.py imports and calls.
+    `capture(url)` overrides how the screenshot is taken (see run_feature_pipeline).
+    """
+    print("[DEBUG] ===== extract_features_logic started =====")
+    try:
+        load_dotenv()
+        body = await request.json()
+        print(f"[DEBUG] Request body parsed: {body}")
+
+        website_url = body.get("url")
+        # Validate and normalize website_url
+        if not website_url or not isinstance(website_url, str):
+            print("[Backend] Invalid or missing 'url' for screenshot:", website_url)
+            raise HTTPException(status_code=400, detail="Invalid or missing 'url' for screenshot.")
+        if not (website_url.startswith("http://") or website_url.startswith("https://")):
+            website_url = "https://" + website_url
+
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        if not api_key:
+            print("[DEBUG] ERROR: OpenRouter API key not configured")
+            raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
+
+        screenshot = None
+        if body.get('screenshot_coordination_success') and body.get('screenshot_id'):
+            screenshot = (body['screenshot_id'], body.get('screenshot_path'))
+
+        try:
+            cache_mode = resolve_cache_mode(body.get('cache'), bool(body.get('bypass_cache')), bool(body.get('refresh_cache')))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        result = await run_feature_pipeline(website_url, api_key, capture=capture, screenshot=screenshot,
+                                            cache_mode=cache_mode)
+        print("[DEBUG] ===== extract_features_logic completed successfully =====")
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[DEBUG] ===== ERROR in extract_features_logic =====")
+        print(f"[DEBUG] Exception type: {type(e)}")
+        print(f"[DEBUG] Exception message: {str(e)}")
+        import traceback
+        print(f"[DEBUG] Full traceback:")
+        traceback.print_exc()
+        print("[DEBUG] ===== END ERROR =====")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,62 @@
+"""
+Application-scoped async HTTP clients for outbound calls.
+
+Each upstream (OpenRouter, Firecrawl, the screenshot service) gets its own
+pooled httpx.AsyncClient with keep-alive connections, its own connection limit
+and its own default timeout, so a slow upstream can only exhaust its own pool.
+Clients are created lazily on first use and closed on application shutdown.
+"""
+
+import os
+from typing import Dict
+
+import httpx
+
+
+def _upstream(timeout: float, max_connections: int, connect_timeout: float = 10.0) -> dict:
+    return {
+        "timeout": httpx.Timeout(timeout, connect=connect_timeout),
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=30.0,
+        ),
+    }
+
+
+# Per-upstream defaults; callers may still pass `timeout=` for a single request
+UPSTREAMS = {
+    "openrouter": _upstream(
+        float(os.getenv("OPENROUTER_TIMEOUT", "120")),
+        int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "20")),
+    ),
+    "firecrawl": _upstream(
+        float(os.getenv("FIRECRAWL_TIMEOUT", "60")),
+        int(os.getenv("FIRECRAWL_MAX_CONNECTIONS", "5")),
+    ),
+    "screenshot": _upstream(
+        float(os.getenv("SCREENSHOT_SERVER_TIMEOUT", "90")),
+        int(os.getenv("SCREENSHOT_SERVER_MAX_CONNECTIONS", "20")),
+        connect_timeout=5.0,
+    ),
+    "default": _upstream(30.0, 10),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_http_client(upstream: str = "default") -> httpx.AsyncClient:
+    """Return the shared client for an upstream, creating it on first use."""
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        settings = UPSTREAMS.get(upstream, UPSTREAMS["default"])
+        client = httpx.AsyncClient(timeout=settings["timeout"], limits=settings["limits"])
+        _clients[upstream] = client
+    return client
+
+
+async def close_http_clients():
+    """Close every pooled client; called from the application's shutdown hook."""
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
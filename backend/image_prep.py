@@ -0,0 +1,284 @@
+"""
+Image preparation for vision model requests.
+
+Screenshots are captured as full-resolution 2x PNGs; sent as-is a tall page is
+a 10-30 MB request body. `prepare_image` downsamples to the resolution the
+target model actually uses, then picks the highest JPEG/WebP quality that fits
+a byte budget (binary search), shrinking further only if even the lowest
+quality does not fit.
+
+Shrinking a 30,000 px tall page to fit the model turns it into an unreadable
+sliver, so `tile_image` instead splits tall pages into overlapping tiles of
+roughly viewport aspect, each prepared at the model's resolution. The number of
+tiles is capped, which keeps the cost per page predictable.
+
+`image_fingerprint` reduces a screenshot to a coarse grid of brightness
+values, so cached analyses are reused when a new capture of a page looks the
+same even if its bytes differ (compression, anti-aliasing, a blinking cursor);
+`fingerprints_match` compares two of them cell by cell.
+"""
+
+import io
+import os
+import math
+import base64
+import hashlib
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+# Longest side the model resizes to anyway, and (for OpenAI high-detail) the shortest side.
+# Matched by model ID prefix; the first match wins.
+MODEL_IMAGE_LIMITS = (
+    ("openai/", (2048, 768)),
+    ("anthropic/", (1568, None)),
+    ("google/", (3072, None)),
+    ("mistralai/", (1540, None)),
+)
+DEFAULT_IMAGE_LIMITS = (1568, None)
+
+IMAGE_PREP_MAX_BYTES = int(os.getenv("IMAGE_PREP_MAX_BYTES", str(1_500_000)))
+IMAGE_PREP_FORMAT = os.getenv("IMAGE_PREP_FORMAT", "jpeg")
+MEDIA_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+MIN_QUALITY = 35
+MAX_QUALITY = 90
+
+# Tiles of tall pages: width / height of a tile (a desktop viewport), the share of a
+# tile's height repeated in the next one, and the most tiles sent for one page
+IMAGE_TILE_ASPECT = float(os.getenv("IMAGE_TILE_ASPECT", "1.6"))
+IMAGE_TILE_OVERLAP = 0.1
+IMAGE_MAX_TILES = int(os.getenv("IMAGE_MAX_TILES", "8"))
+
+# Screenshot fingerprints: cells per side of each page-width square band, the most
+# bands per page, how far (0-255) a cell's mean brightness may move and the share the
+# page height may change by for two captures to still match
+FINGERPRINT_GRID = 16
+FINGERPRINT_MAX_BANDS = 32
+FINGERPRINT_MAX_DIFFERENCE = int(os.getenv("FINGERPRINT_MAX_DIFFERENCE", "8"))
+FINGERPRINT_HEIGHT_TOLERANCE = 0.01
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    media_type: str
+    width: int
+    height: int
+    original_bytes: int
+    quality: Optional[int] = None
+    scale: float = 1.0  # Prepared size / original size, to map coordinates back
+
+    def data_url(self) -> str:
+        return f"data:{self.media_type};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+@dataclass
+class ImageTile:
+    image: PreparedImage
+    top: float     # Percent of the page height where the tile starts
+    height: float  # Percent of the page height the tile covers
+
+
+def model_image_limits(model: str) -> Tuple[int, Optional[int]]:
+    for prefix, limits in MODEL_IMAGE_LIMITS:
+        if model.startswith(prefix):
+            return limits
+    return DEFAULT_IMAGE_LIMITS
+
+
+def target_size(width: int, height: int, max_side: int, short_side: Optional[int] = None) -> Tuple[int, int]:
+    """Size after fitting into max_side x max_side and, if given, capping the shorter side."""
+    scale = min(1.0, max_side / max(width, height))
+    if short_side:
+        scale = min(scale, short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode(image, image_format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format.upper(), quality=quality, optimize=image_format == "jpeg")
+    return buffer.getvalue()
+
+
+def _encode_to_budget(image, image_format: str, max_bytes: int):
+    """Highest quality that fits max_bytes, or None if MIN_QUALITY does not fit."""
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(image, image_format, quality)
+        if len(data) <= max_bytes:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best
+
+
+def prepare_image(image_source, model: str = "", max_bytes: int = IMAGE_PREP_MAX_BYTES,
+                  image_format: str = IMAGE_PREP_FORMAT, max_side: Optional[int] = None) -> PreparedImage:
+    """
+    Downsample and re-encode an image (bytes, path or PIL image) for a vision request.
+    Without Pillow the original bytes are returned unchanged.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        if isinstance(image_source, (bytes, bytearray)):
+            data = bytes(image_source)
+        else:
+            with open(image_source, "rb") as f:
+                data = f.read()
+        print("[ImagePrep] PIL not available, sending the original image")
+        return PreparedImage(data=data, media_type="image/png", width=0, height=0, original_bytes=len(data))
+
+    if isinstance(image_source, (bytes, bytearray)):
+        original_bytes = len(image_source)
+        image = Image.open(io.BytesIO(image_source))
+    elif isinstance(image_source, Image.Image):
+        original_bytes = 0
+        image = image_source
+    else:
+        original_bytes = os.path.getsize(image_source)
+        image = Image.open(image_source)
+
+    original_width, original_height = image.size
+    limit_side, short_side = model_image_limits(model)
+    width, height = target_size(original_width, original_height, max_side or limit_side, short_side)
+    if (width, height) != image.size:
+        # reducing_gap lets Pillow shrink by integer factors first, which is much faster on huge pages
+        image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    while True:
+        encoded = _encode_to_budget(image, image_format, max_bytes)
+        if encoded or min(image.size) <= 64:
+            break
+        # Even the lowest quality is too big: shrink and search again
+        image = image.resize((max(1, image.width * 3 // 4), max(1, image.height * 3 // 4)), Image.Resampling.LANCZOS)
+    data, quality = encoded or (_encode(image, image_format, MIN_QUALITY), MIN_QUALITY)
+
+    prepared = PreparedImage(
+        data=data,
+        media_type=MEDIA_TYPES[image_format],
+        width=image.width,
+        height=image.height,
+        original_bytes=original_bytes,
+        quality=quality,
+        scale=image.width / original_width,
+    )
+    print(
+        f"[ImagePrep] {model or 'default'}: {original_width}x{original_height} ({original_bytes} bytes) -> "
+        f"{prepared.width}x{prepared.height} {image_format} q{quality} ({len(data)} bytes)"
+    )
+    return prepared
+
+
+def tile_image(image_source, model: str = "", max_tiles: int = IMAGE_MAX_TILES, aspect: float = IMAGE_TILE_ASPECT,
+               overlap: float = IMAGE_TILE_OVERLAP, max_bytes: int = IMAGE_PREP_MAX_BYTES,
+               image_format: str = IMAGE_PREP_FORMAT) -> List[ImageTile]:
+    """
+    Split a tall image (bytes, path or PIL image) into full-width tiles of about `aspect`,
+    overlapping by `overlap`, each prepared for `model`. Tiles grow taller rather than
+    exceeding `max_tiles`. Images up to 1.25 tiles tall, or without Pillow, give one tile.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return [ImageTile(prepare_image(image_source, model, max_bytes, image_format), 0.0, 100.0)]
+
+    if isinstance(image_source, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image_source))
+    elif isinstance(image_source, Image.Image):
+        image = image_source
+    else:
+        image = Image.open(image_source)
+
+    width, height = image.size
+    tile_height = width / aspect
+    if height <= tile_height * 1.25:
+        return [ImageTile(prepare_image(image, model, max_bytes, image_format), 0.0, 100.0)]
+
+    count = math.ceil((height - overlap * tile_height) / (tile_height * (1 - overlap)))
+    if count > max_tiles:
+        count = max_tiles
+        tile_height = height / (count - (count - 1) * overlap)
+    tile_height = min(height, math.ceil(tile_height))
+    step = (height - tile_height) / (count - 1)
+
+    image.load()
+    tiles = []
+    for i in range(count):
+        top = round(i * step)
+        crop = image.crop((0, top, width, min(height, top + tile_height)))
+        tiles.append(ImageTile(
+            image=prepare_image(crop, model, max_bytes, image_format),
+            top=100 * top / height,
+            height=100 * crop.height / height,
+        ))
+    print(f"[ImagePrep] Split {width}x{height} into {count} tiles of {width}x{tile_height}")
+    return tiles
+
+
+def _content_hash(image_source) -> str:
+    digest = hashlib.sha256()
+    if isinstance(image_source, (bytes, bytearray)):
+        digest.update(image_source)
+    else:
+        with open(image_source, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    return "sha256:" + digest.hexdigest()
+
+
+def image_fingerprint(image_source, grid: int = FINGERPRINT_GRID, max_bands: int = FINGERPRINT_MAX_BANDS) -> str:
+    """
+    Perceptual fingerprint of a screenshot (bytes or path) for result caching:
+    "gray:<width>x<height>:<band>,...". The page is cut into bands about as tall as
+    it is wide, and each band into `grid` x `grid` cells whose mean brightness is
+    stored as hex, so a change anywhere on a tall page still shows up in its cells.
+    Without Pillow, or for data it cannot decode, the exact content hash
+    "sha256:<hex>" is returned instead.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return _content_hash(image_source)
+    try:
+        image = Image.open(io.BytesIO(image_source) if isinstance(image_source, (bytes, bytearray)) else image_source)
+        width, height = image.size
+        bands = min(max_bands, max(1, round(height / width)))
+        # BOX resampling averages exactly the pixels of each cell
+        cells = image.convert("L").resize((grid, grid * bands), Image.Resampling.BOX, reducing_gap=3.0).tobytes()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"[ImagePrep] Could not decode screenshot for fingerprinting, using its content hash: {e}")
+        return _content_hash(image_source)
+    band_size = grid * grid
+    hashes = [cells[i:i + band_size].hex() for i in range(0, len(cells), band_size)]
+    return f"gray:{width}x{height}:{','.join(hashes)}"
+
+
+def fingerprints_match(first: str, second: str, max_difference: int = FINGERPRINT_MAX_DIFFERENCE,
+                       height_tolerance: float = FINGERPRINT_HEIGHT_TOLERANCE) -> bool:
+    """
+    Whether two image_fingerprint values show the same page: same width and number of
+    cells, height within `height_tolerance`, and no cell's brightness more than
+    `max_difference` apart. Content hashes only match exactly.
+    """
+    if not first.startswith("gray:") or not second.startswith("gray:"):
+        return first == second
+    try:
+        first_size, first_cells = first[len("gray:"):].split(":")
+        second_size, second_cells = second[len("gray:"):].split(":")
+        first_width, first_height = (int(value) for value in first_size.split("x"))
+        second_width, second_height = (int(value) for value in second_size.split("x"))
+        first_cells = bytes.fromhex(first_cells.replace(",", ""))
+        second_cells = bytes.fromhex(second_cells.replace(",", ""))
+    except ValueError:
+        return False
+    if first_width != second_width or len(first_cells) != len(second_cells):
+        return False
+    if abs(first_height - second_height) > height_tolerance * max(first_height, second_height):
+        return False
+    return all(abs(a - b) <= max_difference for a, b in zip(first_cells, second_cells))
@@ -0,0 +1,376 @@
+"""
+JSON handling for LLM output.
+
+`IncrementalJSONParser` consumes a streamed completion chunk by chunk and
+reports parts of the top-level object as soon as they are complete: every
+element of a section array (`websiteFeatures`, `sections`) when its closing
+brace arrives, then every other top-level member when its value closes. Each
+character is scanned once, so the cost is linear in the length of the output
+regardless of how it is chunked. Leading prose and code fences are skipped by
+starting at the first `{`.
+
+`repair_json` parses complete (non-streamed) output that may be wrapped in
+prose, slightly malformed or cut off at the token limit, and returns the
+largest valid value it can recover together with a list of the repairs made.
+`loads_llm_json` raises PartialJSONError for values that are incomplete, so
+callers can retry instead of using (or caching) them.
+"""
+
+import re
+import json
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+
+# Arrays whose elements are reported one by one as "section" events
+SECTION_KEYS = ("websiteFeatures", "sections")
+ARCHITECTURE_KEYS = ("siteUXArchitecture", "ux_architecture")
+SUMMARY_KEYS = ("global_design_summary", "business_analysis")
+
+
+class _Frame:
+    __slots__ = ("kind", "key", "start", "expect_key", "pending_key", "count")
+
+    def __init__(self, kind: str, key: Optional[str], start: int):
+        self.kind = kind              # "{" or "["
+        self.key = key                # Member name of this container in its parent object
+        self.start = start            # Buffer offset of the opening bracket
+        self.expect_key = kind == "{"
+        self.pending_key = None       # Last member name read in this object
+        self.count = 0                # Elements closed so far in this array
+
+
+class IncrementalJSONParser:
+    def __init__(self):
+        self.buffer = ""
+        self.done = False
+        self._position = 0
+        self._started = False
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+
+    def feed(self, chunk: str) -> List[dict]:
+        """
+        Add text and return the events it completed, in order:
+        {"event": "section" | "architecture" | "summary" | "field", "key": ..., "index": ..., "data": ...}
+        """
+        self.buffer += chunk
+        events = []
+        buffer = self.buffer
+        i = self._position
+        if not self._started:
+            i = buffer.find("{", i)
+            if i == -1:
+                self._position = len(buffer)
+                return events
+            self._started = True
+
+        while i < len(buffer) and not self.done:
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    frame = self._stack[-1] if self._stack else None
+                    if frame is not None and frame.kind == "{" and frame.expect_key:
+                        frame.pending_key = self._decode_key(buffer[self._string_start:i + 1])
+            elif char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in "{[":
+                parent = self._stack[-1] if self._stack else None
+                key = parent.pending_key if parent is not None and parent.kind == "{" else None
+                self._stack.append(_Frame(char, key, i))
+            elif char in "}]":
+                if self._stack:
+                    self._close(i, events)
+            elif char == ":":
+                if self._stack and self._stack[-1].kind == "{":
+                    self._stack[-1].expect_key = False
+            elif char == ",":
+                if self._stack and self._stack[-1].kind == "{":
+                    self._stack[-1].expect_key = True
+            i += 1
+        self._position = i
+        return events
+
+    def _close(self, i: int, events: List[dict]):
+        frame = self._stack.pop()
+        if not self._stack:
+            self.done = True
+            return
+        parent = self._stack[-1]
+        value_text = self.buffer[frame.start:i + 1]
+        if parent.kind == "[" and len(self._stack) == 2 and parent.key in SECTION_KEYS:
+            index = parent.count
+            parent.count += 1
+            data = self._loads(value_text)
+            if data is not None:
+                events.append({"event": "section", "key": parent.key, "index": index, "data": data})
+        elif parent.kind == "[":
+            parent.count += 1
+        elif len(self._stack) == 1:
+            data = self._loads(value_text)
+            if data is None:
+                return
+            if frame.key in ARCHITECTURE_KEYS:
+                name = "architecture"
+            elif frame.key in SUMMARY_KEYS:
+                name = "summary"
+            elif frame.key in SECTION_KEYS:
+                # The sections were already reported one by one
+                return
+            else:
+                name = "field"
+            events.append({"event": name, "key": frame.key, "data": data})
+
+    @staticmethod
+    def _decode_key(text: str) -> str:
+        """Member name of a quoted key; keys with invalid escapes are kept as written."""
+        try:
+            return json.loads(text, strict=False)
+        except ValueError:
+            return text[1:-1]
+
+    @staticmethod
+    def _loads(text: str):
+        try:
+            return json.loads(text, strict=False)
+        except ValueError:
+            return None
+
+    def result(self):
+        """The complete top-level object once the parser is done, otherwise None."""
+        if not self.done:
+            return None
+        start = self.buffer.find("{")
+        return self._loads(self.buffer[start:self._position])
+
+
+@dataclass
+class RepairedJSON:
+    value: Any                      # Parsed value, or None if nothing could be salvaged
+    complete: bool                  # False if the input was cut off and had to be closed
+    repairs: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_FENCE = re.compile(r"```[\w-]*[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+
+
+def _repair_at(text: str, start: int, stop: int) -> Tuple[RepairedJSON, int]:
+    """Repair the value opening at text[start], reading no further than `stop`. Also returns where it ended."""
+    repairs = []
+    out: List[str] = []
+    closers: List[str] = []        # Expected closing bracket per open container
+    states: List[str] = []         # Per container: "key", "colon", "value" or "comma"
+    safe_points = [(0, "")]        # (length of out, closers) where closing everything is valid JSON
+    in_string = False
+    escape = False
+    scalar_start = None
+    pending_comma = None
+    finished = False
+
+    def add_repair(name: str):
+        if name not in repairs:
+            repairs.append(name)
+
+    def value_done():
+        if closers:
+            states[-1] = "comma"
+            safe_points.append((len(out), "".join(reversed(closers))))
+
+    def finish_scalar() -> bool:
+        token = "".join(out[scalar_start:])
+        if token in _PYTHON_LITERALS:
+            out[scalar_start:] = _PYTHON_LITERALS[token]
+            add_repair("python_literal")
+            token = _PYTHON_LITERALS[token]
+        try:
+            json.loads(token)
+        except ValueError:
+            return False
+        value_done()
+        return True
+
+    i = start
+    while i < stop:
+        char = text[i]
+        i += 1
+        if in_string:
+            if escape:
+                escape = False
+                out.append(char)
+            elif char == "\\":
+                escape = True
+                out.append(char)
+            elif char == '"':
+                in_string = False
+                out.append(char)
+                if states[-1] == "key":
+                    states[-1] = "colon"
+                else:
+                    value_done()
+            elif char in _CONTROL_ESCAPES:
+                out.extend(_CONTROL_ESCAPES[char])
+                add_repair("escaped_control_characters")
+            else:
+                out.append(char)
+            continue
+
+        if scalar_start is not None and (char in ",:]}" or char.isspace()):
+            finish_scalar()
+            scalar_start = None
+        if char.isspace():
+            out.append(char)
+            continue
+        if char in "}]":
+            if pending_comma is not None:
+                del out[pending_comma]
+                add_repair("trailing_comma")
+            pending_comma = None
+            expected = closers.pop()
+            states.pop()
+            if char != expected:
+                add_repair("mismatched_bracket")
+            out.append(expected)
+            if not closers:
+                finished = True
+                break
+            value_done()
+            continue
+        pending_comma = None
+        if char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+            states.append("key" if char == "{" else "value")
+            out.append(char)
+            safe_points.append((len(out), "".join(reversed(closers))))
+        elif char == ",":
+            pending_comma = len(out)
+            out.append(char)
+            states[-1] = "key" if closers[-1] == "}" else "value"
+        elif char == ":":
+            out.append(char)
+            states[-1] = "value"
+        else:
+            if scalar_start is None:
+                scalar_start = len(out)
+            out.append(char)
+
+    if finished:
+        complete = True
+    else:
+        # Cut off: close a string value, finish a scalar, or fall back to the last safe point
+        complete = False
+        add_repair("truncated")
+        if in_string and states[-1] == "value":
+            if escape:
+                out.pop()
+            out.append('"')
+            value_done()
+            add_repair("unterminated_string")
+        elif scalar_start is not None:
+            finish_scalar()
+
+    # Parse; on a remaining syntax error cut back to the last safe point before it.
+    # `out` holds one character per item, so error positions are indices into it.
+    error = None
+    limit = len(out)
+    if complete:
+        try:
+            return RepairedJSON(json.loads("".join(out)), True, repairs), i
+        except json.JSONDecodeError as e:
+            error = f"{e.msg} at position {e.pos}"
+            limit = e.pos
+    for length, suffix in reversed(safe_points):
+        if length > limit or length == 0:
+            continue
+        try:
+            value = json.loads("".join(out[:length]) + suffix)
+        except json.JSONDecodeError as e:
+            error = error or f"{e.msg} at position {e.pos}"
+            limit = min(limit, e.pos)
+            continue
+        if error is not None:
+            add_repair("cut_at_error")
+        return RepairedJSON(value, False, repairs, error), i
+    return RepairedJSON(None, False, repairs, error), i
+
+
+def _expected(value, expect) -> bool:
+    return value is not None and (expect is None or isinstance(value, expect))
+
+
+def repair_json(text: str, expect=None) -> RepairedJSON:
+    """
+    Tolerant single-pass parse of model output. Looks inside code fences first, then
+    tries each `{`/`[` in turn and takes the first value that parses cleanly into
+    `expect` (a type or tuple of types, None for any), so brackets in surrounding prose
+    are skipped. Drops trailing commas, escapes raw control characters in strings, maps
+    Python literals, and closes unterminated strings and truncated output. Whatever
+    cannot be repaired is cut back to the longest prefix that is valid JSON; such a
+    value is only returned when no candidate parses cleanly, with `complete` False.
+    `repairs` lists what was done.
+    """
+    segments = [(match.start(1), match.end(1)) for match in _FENCE.finditer(text)]
+    segments.append((0, len(text)))
+    fallback = None
+    found = False
+    for segment_start, stop in segments:
+        position = segment_start
+        while True:
+            starts = [index for index in (text.find("{", position, stop), text.find("[", position, stop)) if index != -1]
+            if not starts:
+                break
+            start = min(starts)
+            found = True
+            repaired, end = _repair_at(text, start, stop)
+            if _expected(repaired.value, expect):
+                if text[:start].strip():
+                    repaired.repairs.insert(0, "skipped_prefix")
+                if text[end:].strip().strip("`").strip():
+                    repaired.repairs.append("skipped_suffix")
+                if repaired.complete:
+                    return repaired
+                if fallback is None:
+                    fallback = repaired
+            # Candidates inside this one are parts of it, not alternatives
+            position = max(end, start + 1)
+    if fallback is not None:
+        return fallback
+    if found:
+        return RepairedJSON(None, False, error="No JSON value of the expected type found")
+    return RepairedJSON(None, False, error="No JSON object or array found")
+
+
+class PartialJSONError(ValueError):
+    """Model output that could only be parsed partially (cut off or malformed)."""
+
+    def __init__(self, message: str, repaired: RepairedJSON):
+        super().__init__(message)
+        self.repaired = repaired
+
+
+def loads_llm_json(text: str, context: str = "LLM", expect=dict, allow_partial: bool = False):
+    """
+    Parse model output with repair_json. Raises ValueError when nothing can be salvaged
+    and PartialJSONError when the value is incomplete, unless `allow_partial`.
+    """
+    repaired = repair_json(text, expect)
+    if repaired.repairs:
+        print(f"[DEBUG] Repaired {context} JSON: {', '.join(repaired.repairs)}"
+              + (f" ({repaired.error})" if repaired.error else ""))
+    if repaired.value is None:
+        raise ValueError(f"Could not parse JSON from {context} response: {repaired.error}")
+    if not repaired.complete and not allow_partial:
+        raise PartialJSONError(f"Incomplete JSON in {context} response ({', '.join(repaired.repairs)})", repaired)
+    return repaired.value
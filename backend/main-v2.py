@@ -279,8 +279,9 @@ async def extract_features_stream(url: str, stream: bool = True):
     }
     print("[BACKEND] Built OpenRouter payload:", openrouter_payload)
     def event_stream():
+        from llm_json import IncrementalJSONParser
         print("[BACKEND] Starting stream to frontend...")
-        buffer = ""
+        parser = IncrementalJSONParser()
         with requests.post(openrouter_url, json=openrouter_payload, headers=headers, stream=True) as r:
             for line in r.iter_lines():
                 print("[BACKEND] Streaming chunk:", line)
@@ -289,20 +290,23 @@ async def extract_features_stream(url: str, stream: bool = True):
                     if decoded.startswith("data: "):
                         data = decoded[6:]
                         if data == "[DONE]":
-                            print("[BACKEND] Final buffer before JSON parse:", buffer)
-                            try:
-                                content_json = json.loads(buffer)
+                            print("[BACKEND] Final buffer before JSON parse:", parser.buffer)
+                            content_json = parser.result()
+                            if content_json is not None:
                                 yield f"event: result\ndata: {json.dumps(content_json)}\n\n"
-                            except Exception as e:
-                                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+                            else:
+                                yield f"event: error\ndata: {json.dumps({'error': 'Incomplete JSON in response'})}\n\n"
                             break
                         try:
                             data_obj = json.loads(data)
                             delta = data_obj["choices"][0]["delta"].get("content")
-                            if delta:
-                                buffer += delta
                         except Exception as e:
                             yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+                            continue
+                        if delta:
+                            # Sections are sent as soon as their closing brace arrives
+                            for event in parser.feed(delta):
+                                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
                     elif decoded.startswith(":"):
                         yield f"event: progress\ndata: {json.dumps({'message': decoded})}\n\n"
     return StreamingResponse(event_stream(), media_type='text/event-stream') 
\ No newline at end of file
@@ -1,6 +1,6 @@
 import os
 import asyncio
-import requests
+import httpx
 import json
 from fastapi import FastAPI, HTTPException, UploadFile, Request, BackgroundTasks, Body
 from fastapi.middleware.cors import CORSMiddleware
@@ -13,12 +13,20 @@ import uuid
 from fastapi.staticfiles import StaticFiles
 import glob
 from typing import List, Optional, Dict, Any
-import openai
 import re
 
-# Correct import for the official client
-from futurehouse_client import FutureHouseClient, JobNames
-from feature_extraction import extract_features_logic, extract_bounding_boxes_only
+from research_jobs import TERMINAL_STATUSES, get_research_jobs
+from feature_extraction import extract_features_logic, extract_bounding_boxes_only, stream_feature_analysis
+from llm_json import PartialJSONError, loads_llm_json
+from screenshot_watcher import get_screenshot_watcher
+from http_client import get_http_client, close_http_clients
+from image_prep import image_fingerprint, prepare_image
+from openrouter import OpenRouterError, chat_completion, usage_totals
+from cache_store import canonical_url, content_hash, get_cache_store, resolve_cache_mode, screenshot_matches
+from memoize import memoize_stage, stage_cache_mode
+from debug_capture import get_debug_capture
+from crop_cache import CROP_FORMATS, IMMUTABLE_CACHE_CONTROL, crop_cache_path, crop_url, parse_crop_spec, render_crops
+from raster_cache import source_version
 
 # Load environment variables from .env file
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
@@ -45,38 +53,18 @@ async def wait_for_screenshot(screenshot_id: str, timeout_seconds: int = 30) ->
     """
     Helper function to wait for screenshot to be ready with consistent logic.
     Returns the full path to the screenshot file when ready.
+    Waiters are woken by the directory watcher as soon as the capture is renamed
+    into place (inotify on Linux, polling elsewhere).
     """
-    screenshots_dir = os.path.join(os.path.dirname(__file__), 'screenshots')
-    pattern = f'_{screenshot_id}.png'
-    
-    print(f'[DEBUG] Waiting for screenshot with pattern: {pattern}')
-    
-    for i in range(timeout_seconds):
-        try:
-            if not os.path.exists(screenshots_dir):
-                print(f'[DEBUG] Screenshots directory does not exist: {screenshots_dir}')
-                await asyncio.sleep(1)
-                continue
-                
-            files_in_dir = os.listdir(screenshots_dir)
-            matching_files = [f for f in files_in_dir if f.endswith(pattern)]
-            
-            if matching_files:
-                screenshot_path = os.path.abspath(os.path.normpath(os.path.join(screenshots_dir, matching_files[0])))
-                
-                # Check if file exists and has content
-                if os.path.exists(screenshot_path) and os.path.getsize(screenshot_path) > 0:
-                    print(f'[DEBUG] Screenshot ready after {i+1} seconds: {screenshot_path}')
-                    # Small delay to ensure file is fully written to disk
-                    await asyncio.sleep(0.5)
-                    return screenshot_path
-                    
-        except Exception as e:
-            print(f'[DEBUG] Error checking for screenshot (attempt {i+1}): {e}')
-        
-        await asyncio.sleep(1)
-    
-    raise HTTPException(status_code=408, detail=f"Screenshot not ready after {timeout_seconds} seconds timeout")
+    print(f'[DEBUG] Waiting for screenshot {screenshot_id}')
+    started = asyncio.get_running_loop().time()
+    try:
+        screenshot_path = await get_screenshot_watcher().wait_for(screenshot_id, timeout_seconds)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=408, detail=f"Screenshot not ready after {timeout_seconds} seconds timeout")
+    elapsed = asyncio.get_running_loop().time() - started
+    print(f'[DEBUG] Screenshot ready after {elapsed:.2f} seconds: {screenshot_path}')
+    return os.path.abspath(os.path.normpath(screenshot_path))
 
 def check_existing_screenshot(screenshot_id: str) -> Optional[str]:
     """
@@ -85,53 +73,135 @@ def check_existing_screenshot(screenshot_id: str) -> Optional[str]:
     """
     if not screenshot_id:
         return None
-        
-    screenshots_dir = os.path.join(os.path.dirname(__file__), 'screenshots')
-    pattern = f'_{screenshot_id}.png'
     
     try:
-        if not os.path.exists(screenshots_dir):
-            return None
-            
-        files_in_dir = os.listdir(screenshots_dir)
-        matching_files = [f for f in files_in_dir if f.endswith(pattern)]
-        
-        if matching_files:
-            screenshot_path = os.path.join(screenshots_dir, matching_files[0])
-            if os.path.exists(screenshot_path) and os.path.getsize(screenshot_path) > 0:
-                print(f'[DEBUG] Found existing valid screenshot: {screenshot_path}')
-                return screenshot_path
-                
+        screenshot_path = get_screenshot_watcher().lookup(screenshot_id)
+        if screenshot_path:
+            print(f'[DEBUG] Found existing valid screenshot: {screenshot_path}')
+            return screenshot_path
     except Exception as e:
         print(f'[DEBUG] Error checking existing screenshot: {e}')
     
     return None
 
-async def request_screenshot_and_wait(url: str, timeout_seconds: int = 30) -> tuple[str, str]:
+SCREENSHOT_SERVER_URL = "http://localhost:8001"
+# "http" talks to screenshot_server.py on :8001, "inprocess" runs the capture engine in this process
+SCREENSHOT_MODE = os.getenv("SCREENSHOT_MODE", "http")
+
+async def capture_screenshot_inprocess(url: str, timeout_seconds: int = 30) -> tuple[str, bytes, Optional[str]]:
     """
-    Helper function to request a screenshot and wait for it to be ready.
-    Returns (screenshot_id, screenshot_path) when ready.
+    Capture with the embedded engine from capture_engine.py (single-node deployments).
+    The image buffer is returned directly; the file is still written to screenshots/
+    so that the screenshot URLs handed to the frontend keep working.
+    """
+    from capture_engine import ScreenshotRequest, get_capture_engine
+    
+    print(f'[DEBUG] Capturing screenshot in-process for URL: {url}')
+    # The engine enforces the deadline itself; cancelling this coroutine (e.g. the
+    # client of /analyze-ui disconnected) aborts the capture at its next await point
+    capture_request = ScreenshotRequest(url=url, full_page=True, hide_popups=True, timeout_seconds=timeout_seconds)
+    try:
+        result = await get_capture_engine().capture(capture_request)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=408, detail=f"Screenshot not ready after {timeout_seconds} seconds timeout")
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Screenshot failed: {e}")
+    
+    screenshot_path = str(result.file_path) if result.file_path else None
+    return result.screenshot_id, result.image_bytes, screenshot_path
+
+# Fire-and-forget tasks, referenced until done so they are not garbage collected
+BACKGROUND_TASKS: set = set()
+
+def cancel_screenshot_job(screenshot_id: str):
+    """
+    Ask the screenshot server to cancel an in-flight capture so it stops holding a
+    browser slot. Fire-and-forget: it runs as a separate task and is not awaited,
+    so it is safe to call while the current task is being cancelled.
+    """
+    async def _cancel():
+        try:
+            await get_http_client("screenshot").delete(f"{SCREENSHOT_SERVER_URL}/screenshot/{screenshot_id}", timeout=5)
+            print(f'[DEBUG] Requested cancellation of screenshot {screenshot_id}')
+        except httpx.HTTPError as e:
+            print(f'[DEBUG] Failed to cancel screenshot {screenshot_id}: {e}')
+    
+    task = asyncio.get_running_loop().create_task(_cancel())
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+
+async def request_screenshot_bytes(url: str, timeout_seconds: int = 30) -> tuple[str, bytes, Optional[str]]:
+    """
+    Request a screenshot in synchronous mode (`wait=true`): the screenshot server runs
+    the capture inline and returns the encoded PNG in the same HTTP response.
+    Returns (screenshot_id, image_bytes, screenshot_path); the path is None when the
+    server did not persist the capture.
     """
-    print(f'[DEBUG] Requesting screenshot for URL: {url}')
-    screenshot_payload = {"url": url, "full_page": True, "hide_popups": True}
+    if SCREENSHOT_MODE == "inprocess":
+        return await capture_screenshot_inprocess(url, timeout_seconds)
+    
+    # Choose the ID up front so the job can be cancelled even if its response never arrives
+    screenshot_id = str(uuid.uuid4())[:8]
+    print(f'[DEBUG] Requesting synchronous screenshot {screenshot_id} for URL: {url}')
+    screenshot_payload = {
+        "url": url,
+        "full_page": True,
+        "hide_popups": True,
+        "wait": True,
+        "screenshot_id": screenshot_id,
+        "timeout_seconds": timeout_seconds,
+    }
     
     try:
-        response = requests.post("http://localhost:8001/screenshot", json=screenshot_payload, timeout=30)
+        response = await get_http_client("screenshot").post(
+            f"{SCREENSHOT_SERVER_URL}/screenshot", json=screenshot_payload, timeout=timeout_seconds
+        )
         response.raise_for_status()
+    except asyncio.CancelledError:
+        # Our caller went away (e.g. the /analyze-ui client disconnected)
+        cancel_screenshot_job(screenshot_id)
+        raise
+    except httpx.TimeoutException:
+        cancel_screenshot_job(screenshot_id)
+        raise HTTPException(status_code=408, detail=f"Screenshot not ready after {timeout_seconds} seconds timeout")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Failed to connect to screenshot server: {e}")
+    
+    if not response.headers.get("content-type", "").startswith("image/"):
+        # Older screenshot servers ignore `wait` and answer with the JSON ticket
         screenshot_id = response.json().get("screenshot_id")
-        
         if not screenshot_id:
             raise HTTPException(status_code=500, detail="No screenshot ID returned from screenshot service")
-        
-        print(f'[DEBUG] Screenshot requested, ID: {screenshot_id}')
-        
-        # Wait for screenshot to be ready
+        try:
+            screenshot_path = await wait_for_screenshot(screenshot_id, timeout_seconds)
+        except (HTTPException, asyncio.CancelledError):
+            cancel_screenshot_job(screenshot_id)
+            raise
+        async with aiofiles.open(screenshot_path, "rb") as f:
+            return screenshot_id, await f.read(), screenshot_path
+    
+    screenshot_id = response.headers.get("x-screenshot-id")
+    if not screenshot_id:
+        raise HTTPException(status_code=500, detail="No screenshot ID returned from screenshot service")
+    
+    screenshot_path = None
+    filename = response.headers.get("x-screenshot-filename")
+    if filename:
+        screenshot_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'screenshots', filename))
+    
+    print(f'[DEBUG] Screenshot {screenshot_id} received in-band ({len(response.content)} bytes)')
+    return screenshot_id, response.content, screenshot_path
+
+async def request_screenshot_and_wait(url: str, timeout_seconds: int = 30) -> tuple[str, str]:
+    """
+    Helper function to request a screenshot and wait for it to be ready.
+    Returns (screenshot_id, screenshot_path) when ready.
+    """
+    screenshot_id, _, screenshot_path = await request_screenshot_bytes(url, timeout_seconds)
+    if not screenshot_path:
+        # The capture was not persisted by the server; fall back to the shared directory
         screenshot_path = await wait_for_screenshot(screenshot_id, timeout_seconds)
-        
-        return screenshot_id, screenshot_path
-        
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=503, detail=f"Failed to connect to screenshot server: {e}")
+    return screenshot_id, screenshot_path
 
 class AnalyzeRequest(BaseModel):
     url: str
@@ -151,13 +221,13 @@ async def analysis_and_screenshot_stream(url: str):
         # Step 1: Trigger screenshot server
         yield "event: progress\ndata: {\"message\": \"📸 Requesting screenshot...\"}\n\n"
         screenshot_payload = {"url": url, "full_page": True, "hide_popups": True}
-        response = requests.post("http://localhost:8001/screenshot", json=screenshot_payload, timeout=10)
+        response = await get_http_client("screenshot").post(f"{SCREENSHOT_SERVER_URL}/screenshot", json=screenshot_payload, timeout=10)
         response.raise_for_status()
         screenshot_id = response.json().get("screenshot_id")
         yield f'event: screenshot_id\ndata: {{"screenshot_id": "{screenshot_id}"}}\n\n'
         yield 'event: progress\ndata: {"message": "✅ Screenshot requested. Analyzing URL..."}\n\n'
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         error_message = f"Failed to connect to screenshot server: {e}"
         yield f'event: error\ndata: {{"error": "{error_message}"}}\n\n'
         # Continue without screenshot
@@ -235,6 +305,7 @@ class RecommendationResponse(BaseModel):
 class RelevantHeuristicsRequest(BaseModel):
     feature: str
     currentDesign: str
+    cache: Optional[str] = None  # "use" (default), "refresh" or "bypass" the completion cache
 
 class RelevantHeuristicsResponse(BaseModel):
     relevant: List[int]
@@ -243,6 +314,7 @@ class EnrichRecommendationRequest(BaseModel):
     recommendation: str
     feature: str
     currentDesign: str
+    cache: Optional[str] = None  # "use" (default), "refresh" or "bypass" the completion cache
 
 class EnrichedRecommendation(BaseModel):
     title: str
@@ -252,52 +324,62 @@ class EnrichedRecommendation(BaseModel):
     impact: str = ''
     category: str = ''
 
-def call_mistral_via_openrouter(prompt: str) -> str:
+def request_cache_mode(value: Optional[str]) -> str:
+    """Cache mode of a request's `cache` field; see memoize.stage_cache_mode."""
+    try:
+        return resolve_cache_mode(value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Sampling settings are part of the payload, and so of the completion cache key
+MISTRAL_SETTINGS = {"model": "mistralai/mistral-7b-instruct"}
+
+async def call_mistral_via_openrouter(prompt: str, cache: Optional[bool] = None) -> str:
     if not OPENROUTER_API_KEY:
         raise HTTPException(status_code=500, detail="OpenRouter API key not set. Please add OPENROUTER_API_KEY to your .env file.")
     print("[Mistral] Connecting to OpenRouter with prompt:")
     print(prompt)
     print("[Mistral] Waiting for response...")
-    client = openai.OpenAI(api_key=OPENROUTER_API_KEY, base_url="https://openrouter.ai/api/v1")
-    response = client.chat.completions.create(
-        model="mistralai/mistral-7b-instruct",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    content = response.choices[0].message.content
+    completion = await chat_completion({
+        **MISTRAL_SETTINGS,
+        "messages": [{"role": "user", "content": prompt}],
+    }, label="mistral", cache=cache)
     print("[Mistral] Got response:")
-    print(content)
-    return content if content is not None else ""
+    print(completion.content)
+    return completion.content
+
+RESEARCH_JOB_WAIT_TIMEOUT = float(os.getenv("RESEARCH_JOB_WAIT_TIMEOUT", "1200"))
+
+async def run_research_job(query: str) -> dict:
+    """
+    Submit a FutureHouse research job and wait for its result. Used by the endpoints
+    that answer in one response; new clients should use /research-jobs instead.
+    """
+    jobs = get_research_jobs()
+    job = jobs.submit(query)
+    try:
+        job = await jobs.wait(job["id"], RESEARCH_JOB_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Research job {job['id']} is still running, poll /research-jobs/{job['id']}")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=500, detail=f"FutureHouse API error: {job['error']}")
+    return job["result"]
 
 @app.post("/recommendations", response_model=RecommendationResponse)
-def get_recommendations(request: RecommendationRequest):
+async def get_recommendations(request: RecommendationRequest):
     if not FUTURE_HOUSE_API_KEY:
         raise HTTPException(status_code=500, detail="Future House API key not set.")
 
     # Compose the query for the scientific recommendation
     query = f"Based on scientific research papers, provide recommendations for improving the following UI feature:\n\nFeature: {request.feature}\nCurrent Design: {request.currentDesign}\n{f'Additional Context: {request.context}' if request.context else ''}\n\nPlease provide recommendations that are:\n1. Backed by scientific research\n2. Specific to the current design\n3. Actionable and implementable\n4. Focused on improving user experience and usability"
 
-    # Use the Crow job for fast search (or Falcon for deep search)
-    client = FutureHouseClient(api_key=FUTURE_HOUSE_API_KEY)
-    task_data = {
-        "name": JobNames.CROW,
-        "query": query,
-    }
+    # Runs as a Crow job (fast search) on the research job queue
+    result = await run_research_job(query)
     try:
-        task_response = client.run_tasks_until_done(task_data)
-        # The response may contain answer, formatted_answer, and references
-        answer = getattr(task_response, "answer", "")
-        formatted_answer = getattr(task_response, "formatted_answer", "")
-        # Extract references/papers if available
+        answer = result["answer"]
         papers = []
-        # Fix: handle if task_response is a list
-        if isinstance(task_response, list):
-            response_obj = task_response[0] if task_response else None
-        else:
-            response_obj = task_response
-        # Use getattr to safely access "references" and avoid linter errors
-        references = getattr(response_obj, 'references', None)
-        if references:
-            for ref in references:
+        for ref in result["references"]:
+            if isinstance(ref, dict):
                 papers.append(
                     Paper(
                         title=ref.get("title", ""),
@@ -313,12 +395,70 @@ def get_recommendations(request: RecommendationRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"FutureHouse API error: {str(e)}")
 
+class ResearchJobRequest(BaseModel):
+    query: str
+    job_name: str = "crow"
+
+@app.post("/research-jobs")
+async def create_research_job(request: ResearchJobRequest):
+    """
+    Submit a FutureHouse research task. Returns the job immediately; poll
+    GET /research-jobs/{id} or subscribe to /research-jobs/{id}/events for the result.
+    """
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Missing query in request body.")
+    if not os.getenv("FUTURE_HOUSE_API_KEY", ""):
+        raise HTTPException(status_code=500, detail="Future House API key not set.")
+    try:
+        return get_research_jobs().submit(request.query.strip(), request.job_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/research-jobs/{job_id}")
+async def get_research_job(job_id: str):
+    """Returns the state, progress and (once completed) the result of a research job."""
+    job = get_research_jobs().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Research job not found.")
+    return job
+
+@app.get("/research-jobs/{job_id}/events")
+async def research_job_events(job_id: str):
+    """Server-sent events: a `status` event on every change, then `result` or `error`."""
+    jobs = get_research_jobs()
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Research job not found.")
+
+    async def event_stream():
+        async for job in jobs.events(job_id):
+            if job is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_event("status", json.dumps({"status": job["status"], "progress": job["progress"]}))
+            if job["status"] == "completed":
+                yield sse_event("result", json.dumps(job))
+            elif job["status"] in TERMINAL_STATUSES:
+                yield sse_event("error", json.dumps({"error": job["error"]}))
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.on_event("startup")
+async def resume_research_jobs():
+    if os.getenv("FUTURE_HOUSE_API_KEY", ""):
+        get_research_jobs().resume()
+
+@app.on_event("shutdown")
+async def stop_research_jobs():
+    await get_research_jobs().stop()
+
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', 'sk-...')  # Replace with your key or .env
-OPENROUTER_API_URL = 'https://openrouter.ai/api/v1/chat/completions'
 OPENROUTER_MODEL = 'mistralai/mistral-small-3.1-24b-instruct'  # Can be changed
 CROPS_DIR = os.path.join(os.path.dirname(__file__), 'section_crops')
 os.makedirs(CROPS_DIR, exist_ok=True)
 
+ANALYSIS_CACHE_NAMESPACE = "analyze-ui"
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(24 * 3600)))
+
 ANALYSIS_PROMPT = '''You are an advanced UI/UX analyst, visual design expert, and business intelligence extractor. Given website URL and screenshot, perform the following complete analysis pipeline:
 1. Visual Analysis & Cropping
 Identify and crop UI sections into separate labeled images
@@ -389,8 +529,18 @@ def sse_event(event: str, data: str) -> str:
     return f"event: {event}\ndata: {data}\n\n"
 
 
+def _query_flag(request: Request, name: str) -> bool:
+    return request.query_params.get(name, "").lower() in ("1", "true", "yes")
+
+
 @app.get("/analyze-ui")
 async def analyze_ui(request: Request):
+    """
+    UI analysis of a page as server-sent events. Analyses are cached per page and
+    reused while a fresh screenshot still matches: `cache=refresh` (or
+    `refresh_cache=true`) recomputes, `cache=bypass` (or `bypass_cache=true`)
+    skips the cache. The `result` event reports the outcome under "cache".
+    """
     print("[DEBUG] /analyze-ui endpoint called")
     url = request.query_params.get('url')
     if not url:
@@ -402,22 +552,50 @@ async def analyze_ui(request: Request):
 
         return StreamingResponse(event_stream(), media_type="text/event-stream")
 
+    try:
+        cache_mode = resolve_cache_mode(request.query_params.get('cache'), _query_flag(request, 'bypass_cache'),
+                                        _query_flag(request, 'refresh_cache'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cache = get_cache_store()
+    cache_key = content_hash(canonical_url(url), OPENROUTER_MODEL, content_hash(ANALYSIS_PROMPT))
+    cache_info = {"status": cache_mode if cache_mode != "use" else "miss", "key": cache_key[:16]}
+
     async def event_stream():
         try:
             yield sse_event('progress', '{"message": "📸 Requesting screenshot..."}')
             
-            # Use the new helper function for consistent screenshot handling
-            screenshot_id, screenshot_path = await request_screenshot_and_wait(url, timeout_seconds=30)
-            
+            # The image comes back in the same response, no polling or disk read needed
+            screenshot_id, screenshot_bytes, _ = await request_screenshot_bytes(url, timeout_seconds=30)
+
+            fingerprint = None
+            if cache_mode != "bypass":
+                try:
+                    fingerprint = await asyncio.to_thread(image_fingerprint, screenshot_bytes)
+                except Exception as e:
+                    print(f"[DEBUG] Failed to fingerprint screenshot: {e}")
+            cached = await asyncio.to_thread(cache.get, ANALYSIS_CACHE_NAMESPACE, cache_key) if cache_mode == "use" else None
+            if cached and screenshot_matches(cached.get("fingerprint"), fingerprint):
+                print("[DEBUG] Page unchanged, reusing cached analysis")
+                analysis = cached["result"]
+                analysis["screenshot_id"] = screenshot_id
+                analysis["cache"] = {"status": "hit", "key": cache_key[:16], "age": round(time.time() - cached["cached_at"])}
+                yield sse_event("progress", '{"message": "♻️ Page unchanged, using the cached analysis."}')
+                yield sse_event("result", json.dumps(analysis))
+                return
+            if cached:
+                cache_info["reason"] = "screenshot_changed"
+
             yield sse_event('progress', '{"message": "✅ Screenshot ready. Sending to LLM..."}')
 
             # 3. Send screenshot + URL to OpenRouter LLM
             try:
-                print("[DEBUG] Encoding screenshot as base64")
-                with open(screenshot_path, "rb") as img_file:
-                    img_b64 = base64.b64encode(img_file.read()).decode("utf-8")
+                # Downsample and re-encode to the model's resolution and a byte budget
+                prepared = await asyncio.to_thread(prepare_image, screenshot_bytes, OPENROUTER_MODEL)
+                del screenshot_bytes
+                print(f"[DEBUG] Sending {len(prepared.data)} image bytes to the LLM ({prepared.original_bytes} captured)")
                 # Prepare vision API format for OpenRouter
-                image_data_url = f"data:image/png;base64,{img_b64}"
+                image_data_url = prepared.data_url()
                 data = {
                     "model": OPENROUTER_MODEL,
                     "messages": [
@@ -436,35 +614,15 @@ async def analyze_ui(request: Request):
                         }
                     ],
                 }
-                headers = {
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                }
                 print("[DEBUG] Sending request to OpenRouter LLM")
-                # Save request to file for debugging
-                import datetime
-
-                debug_filename = f'openrouter_request_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")}.txt'
-                debug_path = os.path.join(os.path.dirname(__file__), debug_filename)
-                with open(debug_path, "w", encoding="utf-8") as f:
-                    f.write("MODEL: " + str(OPENROUTER_MODEL) + "\n")
-                    f.write("HEADERS: " + str(headers) + "\n")
-                    import json as _json
-
-                    f.write("DATA: " + _json.dumps(data, indent=2))
                 yield sse_event(
                     "progress", '{"message": "🤖 Waiting for LLM analysis..."}'
                 )
-                resp = requests.post(OPENROUTER_API_URL, json=data, headers=headers)
-                print("[DEBUG] LLM response status:", resp.status_code)
-                print("[DEBUG] LLM response text (first 500 chars):", resp.text[:500])
-                if resp.status_code != 200:
-                    print("[ERROR] OpenRouter error:", resp.text)
-                    yield sse_event(
-                        "error", f'{{"error": "OpenRouter error: {resp.text}"}}'
-                    )
-                    return
-                llm_result = resp.json()
+                completion = await chat_completion(data, label="analyze-ui")
+            except OpenRouterError as e:
+                print("[ERROR] OpenRouter error:", e.detail)
+                yield sse_event("error", json.dumps({"error": e.detail}))
+                return
             except Exception as e:
                 print("[ERROR] Exception during LLM call:", e)
                 yield sse_event("error", f'{{"error": "Failed to call LLM: {str(e)}"}}')
@@ -473,21 +631,13 @@ async def analyze_ui(request: Request):
             # 4. Parse LLM response
             try:
                 print("[DEBUG] Parsing LLM response")
-                
-                # Check if the response has the expected structure
-                if "choices" not in llm_result:
-                    raise Exception(f"Unexpected OpenRouter response format: {llm_result}")
-                
-                if not llm_result["choices"] or len(llm_result["choices"]) == 0:
-                    raise Exception("No choices in OpenRouter response")
-                
-                if "message" not in llm_result["choices"][0]:
-                    raise Exception(f"Unexpected choice format: {llm_result['choices'][0]}")
-                
-                if "content" not in llm_result["choices"][0]["message"]:
-                    raise Exception(f"Unexpected message format: {llm_result['choices'][0]['message']}")
-                
-                analysis = json.loads(llm_result["choices"][0]["message"]["content"])
+                try:
+                    analysis = loads_llm_json(completion.content, context="analyze-ui")
+                except PartialJSONError as e:
+                    # Cut off or malformed: ask once more without the completion cache rather than keep half an analysis
+                    print("[DEBUG] Incomplete LLM response, retrying once:", e)
+                    completion = await chat_completion(data, label="analyze-ui", cache=False)
+                    analysis = loads_llm_json(completion.content, context="analyze-ui")
                 print("[DEBUG] Parsed analysis:", str(analysis)[:500])
             except Exception as e:
                 print("[ERROR] Failed to parse LLM response:", e)
@@ -510,7 +660,12 @@ async def analyze_ui(request: Request):
                     )
                     del section["cropped_image_base64"]
 
+            if fingerprint:
+                await asyncio.to_thread(cache.set, ANALYSIS_CACHE_NAMESPACE, cache_key,
+                                        {"fingerprint": fingerprint, "cached_at": time.time(), "result": analysis},
+                                        ANALYSIS_CACHE_TTL)
             analysis["screenshot_id"] = screenshot_id
+            analysis["cache"] = cache_info
             print("[DEBUG] Yielding analysis result")
             yield sse_event("progress", '{"message": "🎉 Analysis complete."}')
             yield sse_event("result", json.dumps(analysis))
@@ -562,36 +717,9 @@ async def chat_with_feature(request: ChatRequest):
             "max_tokens": 1000,
         }
 
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-        }
-
         print(f"[DEBUG] Sending chat request for {request.feature_name}")
-        resp = requests.post(OPENROUTER_API_URL, json=data, headers=headers)
-
-        if resp.status_code != 200:
-            print("[ERROR] OpenRouter chat error:", resp.text)
-            raise HTTPException(
-                status_code=500, detail=f"OpenRouter error: {resp.text}"
-            )
-
-        result = resp.json()
-        
-        # Check if the response has the expected structure
-        if "choices" not in result:
-            raise HTTPException(status_code=500, detail=f"Unexpected OpenRouter response format: {result}")
-        
-        if not result["choices"] or len(result["choices"]) == 0:
-            raise HTTPException(status_code=500, detail="No choices in OpenRouter response")
-        
-        if "message" not in result["choices"][0]:
-            raise HTTPException(status_code=500, detail=f"Unexpected choice format: {result['choices'][0]}")
-        
-        if "content" not in result["choices"][0]["message"]:
-            raise HTTPException(status_code=500, detail=f"Unexpected message format: {result['choices'][0]['message']}")
-        
-        response_text = result["choices"][0]["message"]["content"]
+        completion = await chat_completion(data, label="chat")
+        response_text = completion.content
 
         return ChatResponse(response=response_text)
 
@@ -653,7 +781,7 @@ async def firecrawl_analyze(request: FirecrawlAnalyzeRequest):
         "Content-Type": "application/json"
     }
     try:
-        resp = requests.post(firecrawl_url, json=payload, headers=headers, timeout=60)
+        resp = await get_http_client("firecrawl").post(firecrawl_url, json=payload, headers=headers, timeout=60)
         resp.raise_for_status()
         return resp.json()
     except Exception as e:
@@ -662,60 +790,41 @@ async def firecrawl_analyze(request: FirecrawlAnalyzeRequest):
 @app.post("/extract-features")
 async def extract_features(request: Request):
     """
-    Enhanced 2-phase analysis: Text-only first, then targeted bounding box detection.
-    Much more cost-effective than full visual analysis.
-    Includes improved screenshot timing coordination.
+    Feature extraction as a stage graph (see run_feature_pipeline): the screenshot
+    capture runs alongside the text analysis instead of before it, and the
+    response includes per-stage durations under "pipeline_timings".
+    Results are cached per page: `"cache": "refresh"` (or `"refresh_cache": true`)
+    recomputes and stores, `"cache": "bypass"` (or `"bypass_cache": true`) skips
+    the cache; the response reports the outcome under "cache".
     """
-    print("[DEBUG] /extract-features endpoint called with 2-phase analysis")
-    
-    try:
-        # Parse the request to get the URL
-        body = await request.json()
-        url = body.get('url')
-        
-        if not url:
-            raise HTTPException(status_code=400, detail="URL is required")
-        
-        print(f"[DEBUG] Ensuring screenshot is ready for URL: {url}")
-        
-                 # First, ensure we have a screenshot ready with proper timing
-        # This prevents the race condition where feature extraction runs before screenshot is ready
-        try:
-            print(f"[DEBUG] Starting screenshot coordination for feature extraction...")
-            screenshot_id, screenshot_path = await request_screenshot_and_wait(url, timeout_seconds=45)
-            print(f"[DEBUG] ✅ Screenshot confirmed ready for feature extraction: {screenshot_id}")
-            print(f"[DEBUG] Screenshot path: {screenshot_path}")
-            
-            # Add screenshot info to the request body for the extraction logic
-            body['screenshot_id'] = screenshot_id
-            body['screenshot_path'] = screenshot_path
-            body['screenshot_url'] = f"http://localhost:8001/screenshot/{screenshot_id}"
-            body['screenshot_coordination_success'] = True
-            
-            # Create a new request object with the enhanced body
-            class EnhancedRequest:
-                def __init__(self, enhanced_body):
-                    self._body = enhanced_body
-                
-                async def json(self):
-                    return self._body
-            
-            enhanced_request = EnhancedRequest(body)
-            print(f"[DEBUG] Proceeding with feature extraction with guaranteed screenshot availability")
-            
-        except HTTPException as e:
-            print(f"[WARNING] Screenshot coordination failed: {e.detail}")
-            print(f"[WARNING] Falling back to original extraction logic - may fail if screenshot not ready")
-            # Continue with original request if screenshot fails - extraction logic might handle it
-            enhanced_request = request
-        
-        # Now call the extraction logic with confirmed screenshot availability
-        return await extract_features_logic(enhanced_request)
-        
-    except Exception as e:
-        print(f"[ERROR] Error in extract_features coordination: {e}")
-        # Fallback to original logic if coordination fails
-        return await extract_features_logic(request)
+    print("[DEBUG] /extract-features endpoint called")
+    body = await request.json()
+    url = body.get('url')
+    if not url:
+        raise HTTPException(status_code=400, detail="URL is required")
+
+    async def capture(website_url: str):
+        screenshot_id, screenshot_path = await request_screenshot_and_wait(website_url, timeout_seconds=45)
+        print(f"[DEBUG] ✅ Screenshot confirmed ready for feature extraction: {screenshot_id}")
+        return screenshot_id, screenshot_path
+
+    return await extract_features_logic(request, capture=capture)
+
+@app.get("/extract-features/stream")
+async def extract_features_stream(url: str):
+    """
+    Text-only feature analysis as server-sent events: each feature is sent as a
+    `section` event as soon as the model has finished writing it, then the
+    architecture and summary objects, the full `result` and `done`.
+    """
+    if not url:
+        raise HTTPException(status_code=400, detail="URL is required")
+    if not (url.startswith("http://") or url.startswith("https://")):
+        url = "https://" + url
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
+    return StreamingResponse(stream_feature_analysis(url, api_key), media_type="text/event-stream")
 
 @app.post("/extract-bounding-boxes") 
 async def extract_bounding_boxes(request: BoundingBoxRequest):
@@ -770,14 +879,9 @@ async def test_bounding_boxes():
         }
 
 @app.get("/test-openrouter")
-def test_openrouter():
+async def test_openrouter():
     if not OPENROUTER_API_KEY:
         raise HTTPException(status_code=500, detail="OpenRouter API key not set.")
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
     data = {
         "model": "openai/gpt-3.5-turbo",
         "messages": [
@@ -786,18 +890,72 @@ def test_openrouter():
         ]
     }
     try:
-        resp = requests.post(url, headers=headers, json=data, timeout=30)
-        resp.raise_for_status()
-        return resp.json()
+        completion = await chat_completion(data, label="test", timeout=30, max_retries=0)
+        return completion.response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OpenRouter API error: {str(e)}")
 
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(request: Request):
+    if ADMIN_TOKEN and request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+class DebugCaptureUpdate(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = None
+    max_body_bytes: Optional[int] = None
+    max_files: Optional[int] = None
+
+@app.get("/admin/debug-capture")
+async def get_debug_capture_settings(request: Request):
+    require_admin(request)
+    return get_debug_capture().status()
+
+@app.post("/admin/debug-capture")
+async def update_debug_capture_settings(update: DebugCaptureUpdate, request: Request):
+    """Switch debug capture on/off or change its sampling and size limits at runtime."""
+    require_admin(request)
+    try:
+        get_debug_capture().settings.update(**update.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return get_debug_capture().status()
+
+@app.get("/admin/openrouter-usage")
+async def get_openrouter_usage(request: Request):
+    """Requests, failures, tokens, cost and time per model since startup (see openrouter.py)."""
+    require_admin(request)
+    return usage_totals()
+
+@app.on_event("startup")
+async def start_screenshot_watcher():
+    get_screenshot_watcher().start()
+
+@app.on_event("shutdown")
+async def stop_screenshot_watcher():
+    get_screenshot_watcher().stop()
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await close_http_clients()
+
+@app.on_event("shutdown")
+async def stop_debug_capture():
+    await get_debug_capture().stop()
+
+@app.on_event("shutdown")
+async def shutdown_capture_engine():
+    if SCREENSHOT_MODE == "inprocess":
+        from capture_engine import get_capture_engine
+        await get_capture_engine().stop()
+
 # Serve cropped images statically
 app.mount("/section-crops", StaticFiles(directory=CROPS_DIR), name="section-crops")
 
 
 @app.post("/relevant-heuristics", response_model=RelevantHeuristicsResponse)
-def get_relevant_heuristics(request: RelevantHeuristicsRequest):
+async def get_relevant_heuristics(request: RelevantHeuristicsRequest):
     if not OPENROUTER_API_KEY:
         raise HTTPException(status_code=500, detail="OpenRouter API key not set. Please add OPENROUTER_API_KEY to your .env file.")
 
@@ -819,8 +977,11 @@ def get_relevant_heuristics(request: RelevantHeuristicsRequest):
         f"Return only a comma-separated list of the numbers of the relevant heuristics (e.g., 1,3,5).\n\n"
         f"Feature: {request.feature}\nCurrent Design: {request.currentDesign}\n\nHeuristics:\n{heuristics_str}"
     )
+    cache_mode = request_cache_mode(request.cache)
     try:
-        answer = call_mistral_via_openrouter(prompt)
+        # Same feature, design and settings, same answer: repeated calls are served from the completion cache
+        with stage_cache_mode(cache_mode):
+            answer = await call_mistral_via_openrouter(prompt, cache=True)
         numbers = re.findall(r'\b\d+\b', answer)
         relevant = [int(n) for n in numbers if 1 <= int(n) <= 10]
         return RelevantHeuristicsResponse(relevant=relevant)
@@ -828,7 +989,7 @@ def get_relevant_heuristics(request: RelevantHeuristicsRequest):
         raise HTTPException(status_code=500, detail=f"OpenRouter API error: {str(e)}")
 
 @app.post("/enrich-recommendation", response_model=EnrichedRecommendation)
-def enrich_recommendation(request: EnrichRecommendationRequest):
+async def enrich_recommendation(request: EnrichRecommendationRequest):
     print("[API] /enrich-recommendation called with:")
     print(f"Feature: {request.feature}")
     print(f"Current Design: {request.currentDesign}")
@@ -843,20 +1004,19 @@ def enrich_recommendation(request: EnrichRecommendationRequest):
         f"Recommendation: {request.recommendation}\n\n"
         f"Respond ONLY with a valid JSON object."
     )
+    cache_mode = request_cache_mode(request.cache)
     try:
-        answer = call_mistral_via_openrouter(prompt)
-        # Try to extract JSON from the answer
-        import json
+        with stage_cache_mode(cache_mode):
+            answer = await call_mistral_via_openrouter(prompt, cache=True)
         try:
-            data = json.loads(answer)
-        except Exception:
-            # Try to extract JSON substring if LLM wraps it in text
-            import re
-            match = re.search(r'\{.*\}', answer, re.DOTALL)
-            if match:
-                data = json.loads(match.group(0))
-            else:
-                raise HTTPException(status_code=500, detail="Could not parse JSON from LLM response.")
+            try:
+                data = loads_llm_json(answer, context="enrich-recommendation")
+            except PartialJSONError:
+                # Incomplete JSON: one fresh answer, never served from the completion cache
+                answer = await call_mistral_via_openrouter(prompt, cache=False)
+                data = loads_llm_json(answer, context="enrich-recommendation")
+        except ValueError:
+            raise HTTPException(status_code=500, detail="Could not parse JSON from LLM response.")
         return EnrichedRecommendation(**data)
     except Exception as e:
         print(f"[Mistral] Error: {str(e)}")
@@ -889,12 +1049,12 @@ def decode_code_block(encoded_code: str) -> str:
 
 import time
 
-def retry_get_prompt_code(requests_llm, retry_error, max_retries=3, delay=1.0):
+async def retry_get_prompt_code(requests_llm, retry_error, max_retries=3, delay=1.0):
     for i in range(max_retries):
-        result = requests_llm()
+        result = await requests_llm()
         if not retry_error(result):
             return result
-        time.sleep(delay * ( i ** 2))
+        await asyncio.sleep(delay * ( i ** 2))
     return result
 
 def has_error(result):
@@ -929,7 +1089,7 @@ def has_error(result):
     
     return has_error_messages or empty
 
-def get_prompt_code(request):
+async def get_prompt_code(request):
 
     if not (request.outputType and ((request.outputType == 'code' and request.framework) or (request.outputType == 'prompt' and request.platform))):
         return {
@@ -998,34 +1158,9 @@ def get_prompt_code(request):
             'max_tokens': 8000
         }
         
-        headers = {
-            'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-            'Content-Type': 'application/json',
-        }
-        
         print(f'[DEBUG] Requesting code and prompt for {request.featureName}')
-        resp = requests.post(OPENROUTER_API_URL, json=data, headers=headers)
-        
-        if resp.status_code != 200:
-            print('[ERROR] OpenRouter error:', resp.text)
-            raise HTTPException(status_code=500, detail=f"OpenRouter error: {resp.text}")
-            
-        results = resp.json()
-        
-        # Check if the response has the expected structure
-        if "choices" not in results:
-            raise HTTPException(status_code=500, detail=f"Unexpected OpenRouter response format: {results}")
-        
-        if not results["choices"] or len(results["choices"]) == 0:
-            raise HTTPException(status_code=500, detail="No choices in OpenRouter response")
-        
-        if "message" not in results["choices"][0]:
-            raise HTTPException(status_code=500, detail=f"Unexpected choice format: {results['choices'][0]}")
-        
-        if "content" not in results["choices"][0]["message"]:
-            raise HTTPException(status_code=500, detail=f"Unexpected message format: {results['choices'][0]['message']}")
-        
-        response_text = results['choices'][0]['message']['content']
+        completion = await chat_completion(data, label="prompt-code")
+        response_text = completion.content
         
         try:
             sections = ['CODE', 'STYLE']
@@ -1070,7 +1205,7 @@ def get_prompt_code(request):
                 
         except Exception as e:
             print(f"[ERROR] Failed to parse response sections: {e}")
-            print(f"[ERROR] Response text: {results}")
+            print(f"[ERROR] Response text: {response_text}")
             error_result = {
                 'prompt': '',
                 'code': '',
@@ -1111,14 +1246,14 @@ def get_prompt_code(request):
 # FutureHouse API
 
 @app.post("/recommendation-prompt-code", response_model=RecommendationPromptCodeResponse)
-def recommendation_prompt_code(request: RecommendationPromptCodeRequest):
+async def recommendation_prompt_code(request: RecommendationPromptCodeRequest):
     if not OPENROUTER_API_KEY:
         raise HTTPException(status_code=500, detail="OpenRouter API key not set")
     
-    def request_llm():
-        return get_prompt_code(request)
+    async def request_llm():
+        return await get_prompt_code(request)
     
-    result = retry_get_prompt_code(request_llm, has_error, max_retries=3, delay=1.0)
+    result = await retry_get_prompt_code(request_llm, has_error, max_retries=3, delay=1.0)
 
     # Ensure result is a proper dictionary with string keys
     if isinstance(result, dict):
@@ -1132,80 +1267,114 @@ class CropFeatureRequest(BaseModel):
     bounding_box: dict
     feature_name: str
 
+class CropFeatureBox(BaseModel):
+    feature_name: str
+    bounding_box: dict
+
+class CropFeaturesRequest(BaseModel):
+    screenshot_url: str
+    features: List[CropFeatureBox]
+
+SCREENSHOT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def resolve_screenshot(screenshot_url: str) -> tuple[str, str]:
+    """Map a screenshot URL (or bare ID) to (screenshot_id, local path)."""
+    screenshot_id = screenshot_url.rstrip("/").rsplit("/", 1)[-1]
+    screenshot_path = check_existing_screenshot(screenshot_id)
+    if not screenshot_path:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    return screenshot_id, screenshot_path
+
+def save_feature_crops(screenshot_id: str, screenshot_path: str, features: List[CropFeatureBox]) -> List[dict]:
+    """
+    Render every feature crop of one screenshot into the crop cache and return their URLs.
+    The screenshot is decoded once into the shared raster cache; each crop is a slice of it.
+    """
+    bounding_boxes = [feature.bounding_box for feature in features]
+    render_crops(screenshot_id, screenshot_path, bounding_boxes)
+    version = source_version(screenshot_path)
+    results = []
+    for feature, bounding_box in zip(features, bounding_boxes):
+        url = crop_url(screenshot_id, bounding_box, version=version)
+        print(f"[Backend] Feature '{feature.feature_name}' cropped: {url}")
+        results.append({"feature_name": feature.feature_name, "crop_url": url})
+    return results
+
 @app.post("/crop-feature")
 async def crop_feature(request: CropFeatureRequest):
     """
     Crop a feature from a screenshot using bounding box coordinates.
     Returns a URL to the cropped image.
     """
+    screenshot_id, screenshot_path = resolve_screenshot(request.screenshot_url)
     try:
-        from PIL import Image
-        import io
-        
-        # Parse screenshot URL to get the file path
-        screenshot_id = request.screenshot_url.replace("http://localhost:8001/screenshot/", "")
-        screenshots_dir = os.path.join(os.path.dirname(__file__), 'screenshots')
-        
-        # Find the actual screenshot file
-        screenshot_path = None
-        for file in os.listdir(screenshots_dir):
-            if screenshot_id in file:
-                screenshot_path = os.path.join(screenshots_dir, file)
-                break
-        
-        if not screenshot_path or not os.path.exists(screenshot_path):
-            raise HTTPException(status_code=404, detail="Screenshot not found")
-        
-        # Extract bounding box coordinates (percentages)
-        bbox = request.bounding_box
-        x_percent = bbox.get('x', 0)
-        y_percent = bbox.get('y', 0)
-        width_percent = bbox.get('width', 100)
-        height_percent = bbox.get('height', 100)
-        
-        # Open the image and calculate pixel coordinates
-        with Image.open(screenshot_path) as img:
-            img_width, img_height = img.size
-            
-            # Convert percentages to pixels
-            x = int((x_percent / 100) * img_width)
-            y = int((y_percent / 100) * img_height)
-            width = int((width_percent / 100) * img_width)
-            height = int((height_percent / 100) * img_height)
-            
-            # Ensure coordinates are within image bounds
-            x = max(0, min(x, img_width))
-            y = max(0, min(y, img_height))
-            width = max(1, min(width, img_width - x))
-            height = max(1, min(height, img_height - y))
-            
-            # Crop the image
-            cropped_img = img.crop((x, y, x + width, y + height))
-            
-            # Save the cropped image
-            crop_id = str(uuid.uuid4())
-            safe_feature_name = re.sub(r'[^a-zA-Z0-9_-]', '_', request.feature_name.lower())
-            crop_filename = f'feature_{safe_feature_name}_{crop_id}.png'
-            crop_path = os.path.join(CROPS_DIR, crop_filename)
-            
-            cropped_img.save(crop_path, 'PNG')
-            
-            # Return URL to the cropped image
-            crop_url = f'/section-crops/{crop_filename}'
-            print(f"[Backend] Feature '{request.feature_name}' cropped and saved to: {crop_url}")
-            
-            return {
-                "success": True,
-                "crop_url": crop_url,
-                "message": f"Feature '{request.feature_name}' cropped successfully"
-            }
-            
+        feature = CropFeatureBox(feature_name=request.feature_name, bounding_box=request.bounding_box)
+        crop = (await asyncio.to_thread(save_feature_crops, screenshot_id, screenshot_path, [feature]))[0]
+        return {
+            "success": True,
+            "crop_url": crop["crop_url"],
+            "message": f"Feature '{request.feature_name}' cropped successfully"
+        }
     except ImportError:
         raise HTTPException(status_code=500, detail="PIL (Pillow) not available for image processing")
     except Exception as e:
         print(f"[Backend] Error cropping feature: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to crop feature: {str(e)}")
 
+@app.post("/crop-features")
+async def crop_features(request: CropFeaturesRequest):
+    """
+    Crop many features from one screenshot in a single request.
+    The screenshot is decoded once; returns one crop URL per feature, in order.
+    """
+    if not request.features:
+        raise HTTPException(status_code=400, detail="No features to crop")
+    screenshot_id, screenshot_path = resolve_screenshot(request.screenshot_url)
+    try:
+        crops = await asyncio.to_thread(save_feature_crops, screenshot_id, screenshot_path, request.features)
+    except ImportError:
+        raise HTTPException(status_code=500, detail="PIL (Pillow) not available for image processing")
+    except Exception as e:
+        print(f"[Backend] Error cropping features: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to crop features: {str(e)}")
+    return {"success": True, "screenshot_id": screenshot_id, "crops": crops}
+
+@app.get("/crops/{screenshot_id}/{box}/{variant}")
+async def get_crop(screenshot_id: str, box: str, variant: str, v: Optional[str] = None):
+    """
+    Serves a section crop, rendering it on first request. A URL with the version of
+    the current screenshot file fully determines the image (see crop_cache.py), so it
+    is served as immutable; crops of an earlier capture under the same ID are gone.
+    """
+    try:
+        bounding_box, scale, image_format = parse_crop_spec(box, variant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not SCREENSHOT_ID_PATTERN.match(screenshot_id):
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    _, screenshot_path = resolve_screenshot(screenshot_id)
+    version = source_version(screenshot_path)
+    if v is not None and v != version:
+        raise HTTPException(status_code=404, detail="Crop of an earlier capture of this screenshot")
+    crop_path = crop_cache_path(screenshot_id, screenshot_path, bounding_box, scale, image_format)
+    if not os.path.exists(crop_path):
+        try:
+            crop_path = (await asyncio.to_thread(
+                render_crops, screenshot_id, screenshot_path, [bounding_box], scale, image_format
+            ))[0]
+        except ImportError:
+            raise HTTPException(status_code=500, detail="PIL (Pillow) not available for image processing")
+        except Exception as e:
+            print(f"[Backend] Error rendering crop: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to crop feature: {str(e)}")
+    return FileResponse(
+        crop_path,
+        media_type=CROP_FORMATS[image_format][1],
+        # Without a version the URL may show another capture later, so clients revalidate by ETag
+        headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL if v else "no-cache",
+                 "ETag": f'"{os.path.basename(crop_path).split(".")[0]}"'},
+    )
+
 @app.post("/retry-bounding-boxes")
 async def retry_bounding_boxes(request: Request):
     """
@@ -1250,7 +1419,7 @@ async def retry_bounding_boxes(request: Request):
         
         # Extract bounding boxes
         from feature_extraction import extract_bounding_boxes_only
-        bounding_boxes = await extract_bounding_boxes_only(screenshot_url, sections, website_url)
+        bounding_boxes = await extract_bounding_boxes_only(screenshot_url, sections, website_url, screenshot_path=screenshot_path)
         
         if not bounding_boxes:
             return {"success": False, "message": "No bounding boxes detected", "sections": sections}
@@ -1298,12 +1467,16 @@ async def retry_bounding_boxes(request: Request):
         
         # Apply validation
         from feature_extraction import validate_and_fix_bounding_boxes
-        sections_with_boxes = validate_and_fix_bounding_boxes(sections_with_boxes)
+        bbox_corrections = []
+        sections_with_boxes = await asyncio.to_thread(
+            validate_and_fix_bounding_boxes, sections_with_boxes, screenshot_path, bbox_corrections
+        )
         
         return {
             "success": True,
             "message": f"Successfully added bounding boxes to {sections_matched}/{len(sections)} sections",
             "sections": sections_with_boxes,
+            "bbox_corrections": bbox_corrections,
             "screenshot_url": screenshot_url
         }
         
@@ -1359,6 +1532,35 @@ class OpenRouterPromptRequest(BaseModel):
     feature_name: str
     screenshot_url: str = None
     feature_extraction_result: dict = None
+    cache: Optional[str] = None  # "use" (default), "refresh" or "bypass" the memoized research prompt
+
+RESEARCH_PROMPT_SETTINGS = {'model': 'anthropic/claude-3.5-sonnet', 'temperature': 0.3, 'max_tokens': 8000}
+SUMMARY_SETTINGS = {'model': 'anthropic/claude-3.5-sonnet', 'temperature': 0.3, 'max_tokens': 8000}  # Using Claude for better summarization
+# Research prompts and summaries are memoized per normalized prompt (see memoize.py)
+RESEARCH_STAGE_CACHE_TTL = int(os.getenv("RESEARCH_STAGE_CACHE_TTL", str(7 * 24 * 3600)))
+RESEARCH_STAGE_CACHE_BYTES = int(os.getenv("RESEARCH_STAGE_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+
+@memoize_stage("research_prompt", ttl=RESEARCH_STAGE_CACHE_TTL, max_bytes=RESEARCH_STAGE_CACHE_BYTES,
+               settings=RESEARCH_PROMPT_SETTINGS)
+async def generate_research_prompt(openrouter_prompt: str) -> str:
+    """Have the model write the FutureHouse research request for a prompt from build_openrouter_prompt."""
+    openrouter_data = {
+        **RESEARCH_PROMPT_SETTINGS,
+        'messages': [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": openrouter_prompt},
+                    # {"type": "image_url", "image_url": {"url": request.screenshot_url}}
+                ]
+            }
+        ],
+    }
+    # Memoized as a stage, so not stored in the completion cache as well
+    completion = await chat_completion(openrouter_data, label="research-prompt", cache=False)
+    return completion.content.strip()
+
 
 @app.post("/openrouter-generate-research-prompt")
 async def openrouter_generate_research_prompt(request: OpenRouterPromptRequest):
@@ -1383,44 +1585,8 @@ async def openrouter_generate_research_prompt(request: OpenRouterPromptRequest):
         print(f"[DEBUG] No websiteFeatures found in extraction_result")
 
     openrouter_prompt = build_openrouter_prompt(extraction_result, request.feature_name)
-
-    openrouter_data = {
-        'model': 'anthropic/claude-3.5-sonnet', # anthropic/claude-3.5-sonnet
-        'messages': [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": openrouter_prompt},
-                    # {"type": "image_url", "image_url": {"url": request.screenshot_url}}
-                ]
-            }
-        ],
-        'temperature': 0.3,
-        'max_tokens': 8000
-    }
-    headers = {
-        'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-        'Content-Type': 'application/json',
-    }
-    resp = requests.post(OPENROUTER_API_URL, json=openrouter_data, headers=headers)
-    if resp.status_code != 200:
-        raise HTTPException(status_code=500, detail=f"OpenRouter error: {resp.text}")
-    result = resp.json()
-    
-    # Check if the response has the expected structure
-    if "choices" not in result:
-        raise HTTPException(status_code=500, detail=f"Unexpected OpenRouter response format: {result}")
-    
-    if not result["choices"] or len(result["choices"]) == 0:
-        raise HTTPException(status_code=500, detail="No choices in OpenRouter response")
-    
-    if "message" not in result["choices"][0]:
-        raise HTTPException(status_code=500, detail=f"Unexpected choice format: {result['choices'][0]}")
-    
-    if "content" not in result["choices"][0]["message"]:
-        raise HTTPException(status_code=500, detail=f"Unexpected message format: {result['choices'][0]['message']}")
-    
-    openrouter_prompt = result['choices'][0]['message']['content'].strip()
+    with stage_cache_mode(request_cache_mode(request.cache)):
+        openrouter_prompt = await generate_research_prompt(openrouter_prompt)
     print(f"DEBUG: openrouter_prompt: {openrouter_prompt}")
     
     # Find the first occurrence of "provide" (case-insensitive) and extract everything after it
@@ -1515,7 +1681,7 @@ def build_openrouter_prompt(extraction_result, feature_name):
 
 
 @app.post("/futurehouse-research-prompt-direct")
-def futurehouse_research_prompt_direct(data: dict = Body(...)):
+async def futurehouse_research_prompt_direct(data: dict = Body(...)):
     """
     Accepts a raw prompt and sends it directly to FutureHouse API.
     Expects data = { 'prompt': str }
@@ -1527,33 +1693,11 @@ def futurehouse_research_prompt_direct(data: dict = Body(...)):
     FUTURE_HOUSE_API_KEY = os.getenv("FUTURE_HOUSE_API_KEY", "")
     if not FUTURE_HOUSE_API_KEY:
         raise HTTPException(status_code=500, detail="Future House API key not set.")
-    client = FutureHouseClient(api_key=FUTURE_HOUSE_API_KEY)
-    task_data = {
-        "name": JobNames.CROW,
-        "query": prompt.strip(),
-    }
+    result = await run_research_job(prompt.strip())
     try:
-        task_response = client.run_tasks_until_done(task_data)
-        print("[DEBUG]: Raw FutureHouse API response:", task_response)
-
-        # Safely extract answer and formatted_answer from task_response
-        if (
-            not task_response
-            or not isinstance(task_response, list)
-            or len(task_response) == 0
-        ):
-            raise ValueError("Invalid or empty response from FutureHouse API")
-
-        # Get the first response object
-        response_obj = task_response[0]
-
-        # Safely extract answer and formatted_answer with error handling
-        if isinstance(response_obj, dict):
-            answer = response_obj.get("answer", "")
-            formatted_answer = response_obj.get("formatted_answer", "")
-        else:
-            answer = getattr(response_obj, "answer", "")
-            formatted_answer = getattr(response_obj, "formatted_answer", "")
+        print("[DEBUG]: FutureHouse research result:", result)
+        answer = result["answer"]
+        formatted_answer = result["formatted_answer"]
 
         # Extract references from formatted_answer
         references = []
@@ -1619,8 +1763,24 @@ class SummarizeRecommendationsResponse(BaseModel):
     raw_openrouter_response: dict
 
 
+@memoize_stage("research_summary", ttl=RESEARCH_STAGE_CACHE_TTL, max_bytes=RESEARCH_STAGE_CACHE_BYTES,
+               settings=SUMMARY_SETTINGS)
+async def summarize_research(prompt: str) -> dict:
+    """OpenRouter response summarizing FutureHouse findings for a prompt built by the endpoint below."""
+    data = {
+        **SUMMARY_SETTINGS,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ],
+    }
+    # Memoized as a stage, so not stored in the completion cache as well
+    completion = await chat_completion(data, label="research-summary", cache=False)
+    print(f"[DEBUG] Full response: {completion.response}")
+    return completion.response
+
+
 @app.post("/openrouter-summarize-recommendations", response_model=SummarizeRecommendationsResponse)
-def openrouter_summarize_recommendations(request: SummarizeRecommendationsRequest):
+async def openrouter_summarize_recommendations(request: SummarizeRecommendationsRequest):
     """
     Accepts recommendations from FutureHouse, sends them to OpenRouter to summarize and turn into actionable improvements.
     """
@@ -1714,39 +1874,7 @@ def openrouter_summarize_recommendations(request: SummarizeRecommendationsReques
 
     print(f"[DEBUG]: prompt: {prompt}")
 
-    data = {
-        "model": "anthropic/claude-3.5-sonnet",  # Using Claude for better summarization
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.3,
-        "max_tokens": 8000,
-    }
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    resp = requests.post(OPENROUTER_API_URL, json=data, headers=headers)
-    if resp.status_code != 200:
-        raise HTTPException(status_code=500, detail=f"OpenRouter error: {resp.text}")
-    
-    result = resp.json()
-    print(f"[DEBUG] OpenRouter response structure: {list(result.keys())}")
-    print(f"[DEBUG] Full response: {result}")
-    
-    # Check if the response has the expected structure
-    if "choices" not in result:
-        raise HTTPException(status_code=500, detail=f"Unexpected OpenRouter response format: {result}")
-    
-    if not result["choices"] or len(result["choices"]) == 0:
-        raise HTTPException(status_code=500, detail="No choices in OpenRouter response")
-    
-    if "message" not in result["choices"][0]:
-        raise HTTPException(status_code=500, detail=f"Unexpected choice format: {result['choices'][0]}")
-    
-    if "content" not in result["choices"][0]["message"]:
-        raise HTTPException(status_code=500, detail=f"Unexpected message format: {result['choices'][0]['message']}")
-    
+    result = await summarize_research(prompt)
     summary_text = result["choices"][0]["message"]["content"].strip()
     print(f"[DEBUG]: summary_text: {summary_text}")
 
@@ -1786,9 +1914,10 @@ def format_references_for_prompt(references):
         lines.append(line)
     return "\n".join(lines)
 
+RESOLVE_AUTHORS_SETTINGS = {"model": "openai/gpt-4o-mini", "temperature": 0.1}
 
 @app.post("/resolve-authors")
-def resolve_authors(data: dict = Body(...)):
+async def resolve_authors(data: dict = Body(...)):
     """
     Resolve real author names for academic papers with 'unknownauthors' citations.
     Uses OpenRouter with o4-mini to identify real authors from paper titles.
@@ -1799,6 +1928,7 @@ def resolve_authors(data: dict = Body(...)):
     titles = data.get("titles", [])
     if not titles:
         return {"authorsMap": {}}
+    cache_mode = request_cache_mode(data.get("cache"))
     
     prompt = f"""Given these academic paper titles, provide the real author names. These are known papers from Finnish university repositories:
 
@@ -1819,53 +1949,19 @@ Known information:
 - "Conversion rate optimization in online stores for high involvement products with the use of conjoint analysis" by Pauline Sell"""
 
     try:
-        response = requests.post(
-            OPENROUTER_API_URL,
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "openai/gpt-4o-mini",
+        with stage_cache_mode(cache_mode):
+            completion = await chat_completion({
+                **RESOLVE_AUTHORS_SETTINGS,
                 "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.1,
-            }
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"OpenRouter error: {response.text}")
-        
-        result = response.json()
-        
-        # Check if the response has the expected structure
-        if "choices" not in result:
-            raise HTTPException(status_code=500, detail=f"Unexpected OpenRouter response format: {result}")
-        
-        if not result["choices"] or len(result["choices"]) == 0:
-            raise HTTPException(status_code=500, detail="No choices in OpenRouter response")
-        
-        if "message" not in result["choices"][0]:
-            raise HTTPException(status_code=500, detail=f"Unexpected choice format: {result['choices'][0]}")
-        
-        if "content" not in result["choices"][0]["message"]:
-            raise HTTPException(status_code=500, detail=f"Unexpected message format: {result['choices'][0]['message']}")
-        
-        content = result["choices"][0]["message"]["content"].strip()
+            }, label="resolve-authors", cache=True)
+        content = completion.content.strip()
         
-        # Try to extract JSON from the response
-        import json
+        # Salvage what we can from wrapped or truncated JSON
         try:
-            # Try direct JSON parsing first
-            authorsMap = json.loads(content)
-        except json.JSONDecodeError:
-            # Try to extract JSON substring if LLM wraps it
-            import re
-            json_match = re.search(r'\{[\s\S]*\}', content)
-            if json_match:
-                authorsMap = json.loads(json_match.group(0))
-            else:
-                print(f"Could not parse JSON from OpenRouter response: {content}")
-                authorsMap = {}
+            authorsMap = loads_llm_json(content, context="resolve-authors", allow_partial=True)
+        except ValueError:
+            print(f"Could not parse JSON from OpenRouter response: {content}")
+            authorsMap = {}
         
         print(f"[DEBUG] Resolved authors: {authorsMap}")
         return {"authorsMap": authorsMap}
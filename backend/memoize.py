@@ -0,0 +1,111 @@
+"""
+Stage-level memoization on top of the persistent cache (cache_store).
+
+`memoize_stage` wraps an async stage function so its result is stored under a
+hash of its inputs: images (bytes, data URLs, prepared images) by the hash of
+their content, prompt text with whitespace normalized, and the stage's model
+settings (model, temperature...). When only some inputs of a pipeline change,
+only the stages that see the change call the model again. Each stage has its
+own TTL and byte budget.
+
+Requests that refresh or bypass their result cache do the same for every stage
+they run through `stage_cache_mode`; the OpenRouter completion cache follows
+the same setting (see openrouter.py).
+"""
+
+import time
+import asyncio
+import hashlib
+import inspect
+import functools
+import contextlib
+import contextvars
+from typing import Callable, Iterable, Optional
+
+from cache_store import CACHE_MODES, content_hash, get_cache_store
+
+_stage_cache_mode = contextvars.ContextVar("stage_cache_mode", default="use")
+
+
+@contextlib.contextmanager
+def stage_cache_mode(mode: str):
+    """Use, refresh or bypass memoized stages for everything started inside the block (including tasks)."""
+    if mode not in CACHE_MODES:
+        raise ValueError(f"cache must be one of {', '.join(CACHE_MODES)}")
+    token = _stage_cache_mode.set(mode)
+    try:
+        yield
+    finally:
+        _stage_cache_mode.reset(token)
+
+
+def current_cache_mode() -> str:
+    return _stage_cache_mode.get()
+
+
+def _digest(data: bytes) -> dict:
+    return {"sha256": hashlib.sha256(data).hexdigest()}
+
+
+def normalize_input(value):
+    """JSON-serializable form of a stage input that only keeps what affects the result."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return _digest(bytes(value))
+    if isinstance(value, str):
+        if value.startswith("data:") and ";base64," in value[:64]:
+            return _digest(value.encode("ascii", "replace"))
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {str(key): normalize_input(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_input(item) for item in value]
+    data = getattr(value, "data", None)
+    if isinstance(data, bytes):
+        # image_prep.PreparedImage and the like
+        return _digest(data)
+    return repr(value)
+
+
+def memoize_stage(stage: str, ttl: float, max_bytes: Optional[int] = None, settings=None,
+                  ignore: Iterable[str] = (), cache_if: Callable = lambda result: result is not None):
+    """
+    Memoize an async stage function. `settings` (a dict, or a callable returning one)
+    holds model parameters that are part of the key; arguments named in `ignore`
+    (API keys, clients) are not. Results are only stored when `cache_if(result)`.
+    """
+    ignore = frozenset(ignore)
+    namespace = f"stage:{stage}"
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            mode = _stage_cache_mode.get()
+            if mode == "bypass":
+                return await func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            inputs = {name: normalize_input(value) for name, value in bound.arguments.items() if name not in ignore}
+            key = content_hash(stage, settings() if callable(settings) else settings, inputs)
+            store = get_cache_store()
+            if mode == "use":
+                cached = await asyncio.to_thread(store.get, namespace, key)
+                if cached is not None:
+                    print(f"[StageCache] {stage}: hit {key[:12]}")
+                    return cached["value"]
+            started = time.perf_counter()
+            result = await func(*args, **kwargs)
+            if cache_if(result):
+                elapsed = time.perf_counter() - started
+                await asyncio.to_thread(store.set, namespace, key, {"value": result, "seconds": round(elapsed, 3)},
+                                        ttl, max_bytes)
+                print(f"[StageCache] {stage}: stored {key[:12]} ({elapsed:.1f} s to compute)")
+            return result
+
+        wrapper.stage = stage
+        return wrapper
+
+    return decorator
@@ -0,0 +1,326 @@
+"""
+Async gateway for OpenRouter chat completions.
+
+Every OpenRouter call of the backend goes through `chat_completion` (or
+`stream_chat_completion` for streamed output), so request setup, timeouts,
+retries, response validation, usage accounting and debug capture live in one
+place:
+
+- requests share the pooled "openrouter" client (see http_client),
+- the timeout depends on the model (reasoning models take minutes),
+- 408/429/5xx answers, errors returned in a 200 body and transport errors are
+  retried with jittered exponential backoff, honouring Retry-After,
+- a completion without choices/message/content raises OpenRouterError with
+  the same messages everywhere,
+- token usage and cost are totalled per model (see usage_totals),
+- completions of deterministic requests are cached on disk.
+
+The completion cache key is a hash of the whole payload (model, messages and
+sampling parameters). Only requests with temperature 0 are cached by
+default, since any other (or no) temperature samples a different answer each
+time; callers can override this with `cache=`. Entries expire after
+COMPLETION_CACHE_TTL and the least recently used ones are dropped beyond
+COMPLETION_CACHE_BYTES. A request
+refreshes or bypasses the cache with memoize.stage_cache_mode.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from cache_store import content_hash, get_cache_store
+from debug_capture import get_debug_capture
+from http_client import get_http_client
+from memoize import current_cache_mode
+
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+OPENROUTER_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "3"))
+OPENROUTER_BACKOFF_BASE = float(os.getenv("OPENROUTER_BACKOFF_BASE", "1.0"))
+OPENROUTER_BACKOFF_MAX = float(os.getenv("OPENROUTER_BACKOFF_MAX", "20"))
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Request timeout (seconds) by model ID prefix; the first match wins
+MODEL_TIMEOUTS = (
+    ("anthropic/claude-3.7-sonnet:thinking", 240.0),
+    ("anthropic/", 120.0),
+    ("openai/", 90.0),
+    ("mistralai/", 60.0),
+)
+DEFAULT_MODEL_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", "120"))
+
+COMPLETION_CACHE_NAMESPACE = "completion"
+COMPLETION_CACHE_TTL = int(os.getenv("COMPLETION_CACHE_TTL", str(7 * 24 * 3600)))
+COMPLETION_CACHE_BYTES = int(os.getenv("COMPLETION_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+
+class OpenRouterError(HTTPException):
+    """A failed completion; `upstream_status` is OpenRouter's status code, if there was an answer."""
+
+    def __init__(self, detail: str, upstream_status: Optional[int] = None, status_code: int = 500):
+        super().__init__(status_code=status_code, detail=detail)
+        self.upstream_status = upstream_status
+
+
+class OpenRouterResponseError(OpenRouterError):
+    """OpenRouter answered, but without a usable completion."""
+
+
+@dataclass
+class Completion:
+    content: str
+    model: str
+    response: dict                  # Raw response body
+    usage: dict = field(default_factory=dict)
+    attempts: int = 1
+    elapsed: float = 0.0
+    cached: bool = False
+
+
+@dataclass
+class StreamChunk:
+    content: str = ""               # Text appended to the completion
+    comment: str = ""               # SSE comment (keep-alive while the model is thinking)
+
+
+def model_timeout(model: str) -> float:
+    for prefix, timeout in MODEL_TIMEOUTS:
+        if model.startswith(prefix):
+            return timeout
+    return DEFAULT_MODEL_TIMEOUT
+
+
+def _headers(api_key: Optional[str]) -> dict:
+    api_key = api_key or os.getenv("OPENROUTER_API_KEY")
+    if not api_key or api_key.startswith("sk-..."):
+        raise OpenRouterError("OpenRouter API key not configured")
+    return {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After when it is given in seconds."""
+    if retry_after:
+        try:
+            return min(OPENROUTER_BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(OPENROUTER_BACKOFF_MAX, OPENROUTER_BACKOFF_BASE * 2 ** attempt))
+
+
+def completion_content(result: dict) -> str:
+    """The message content of a completion response; raises OpenRouterResponseError if there is none."""
+    if "choices" not in result:
+        raise OpenRouterResponseError(f"Unexpected OpenRouter response format: {result}")
+    if not result["choices"]:
+        raise OpenRouterResponseError("No choices in OpenRouter response")
+    if "message" not in result["choices"][0]:
+        raise OpenRouterResponseError(f"Unexpected choice format: {result['choices'][0]}")
+    if "content" not in result["choices"][0]["message"]:
+        raise OpenRouterResponseError(f"Unexpected message format: {result['choices'][0]['message']}")
+    return result["choices"][0]["message"]["content"] or ""
+
+
+_usage_lock = threading.Lock()
+_usage: Dict[str, dict] = {}
+
+
+def _totals(model: str) -> dict:
+    return _usage.setdefault(model, {
+        "requests": 0, "failures": 0, "cache_hits": 0,
+        "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "seconds": 0.0,
+    })
+
+
+def record_usage(model: str, usage: Optional[dict], elapsed: float, failed: bool = False):
+    with _usage_lock:
+        totals = _totals(model)
+        totals["requests"] += 1
+        totals["failures"] += int(failed)
+        totals["seconds"] = round(totals["seconds"] + elapsed, 3)
+        for key in ("prompt_tokens", "completion_tokens", "cost"):
+            value = (usage or {}).get(key)
+            if isinstance(value, (int, float)):
+                totals[key] += value
+
+
+def record_cache_hit(model: str):
+    with _usage_lock:
+        _totals(model)["cache_hits"] += 1
+
+
+def usage_totals() -> Dict[str, dict]:
+    """Requests, failures, cache hits, tokens, cost and time per model since the process started."""
+    with _usage_lock:
+        return {model: dict(totals) for model, totals in _usage.items()}
+
+
+def _parse_body(text: str) -> dict:
+    # Long requests are kept alive with leading whitespace before the JSON body
+    start = text.find("{")
+    if start == -1:
+        raise OpenRouterResponseError("No JSON found in OpenRouter response")
+    try:
+        return json.loads(text[start:])
+    except ValueError:
+        raise OpenRouterResponseError(f"Invalid JSON from OpenRouter: {text[:500]}")
+
+
+def completion_cacheable(payload: dict) -> bool:
+    """Whether a request is deterministic and cached by default (temperature 0, not streamed)."""
+    temperature = payload.get("temperature")
+    return not payload.get("stream") and isinstance(temperature, (int, float)) and temperature == 0
+
+
+async def chat_completion(payload: dict, label: str = "openrouter", api_key: Optional[str] = None,
+                          timeout: Optional[float] = None, max_retries: int = OPENROUTER_MAX_RETRIES,
+                          cache: Optional[bool] = None) -> Completion:
+    """
+    Send a chat completion request (an OpenRouter payload with model, messages and
+    sampling parameters) and return the validated completion. Raises OpenRouterError.
+    `cache` overrides whether the completion may be served from and stored in the
+    completion cache (by default: see completion_cacheable).
+    """
+    model = payload.get("model", "")
+    headers = _headers(api_key)
+    timeout = timeout or model_timeout(model)
+
+    mode = current_cache_mode()
+    if cache is False or (cache is None and not completion_cacheable(payload)):
+        mode = "bypass"
+    cache_key = content_hash({key: value for key, value in payload.items() if key != "stream"})
+    if mode == "use":
+        cached = await asyncio.to_thread(get_cache_store().get, COMPLETION_CACHE_NAMESPACE, cache_key)
+        if cached is not None:
+            record_cache_hit(model)
+            print(f"[OpenRouter] {label}: {model} served from the completion cache ({cache_key[:12]})")
+            return Completion(cached["content"], cached["model"], cached["response"], cached["usage"],
+                              attempts=0, cached=True)
+    get_debug_capture().capture("openrouter_request", {"data": payload}, model=model, label=label)
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        retry_after = None
+        try:
+            resp = await get_http_client("openrouter").post(
+                OPENROUTER_API_URL, json=payload, headers=headers, timeout=timeout
+            )
+            if resp.status_code == 200:
+                result = _parse_body(resp.text)
+                error = result.get("error") if "choices" not in result else None
+                if not error:
+                    content = completion_content(result)
+                    elapsed = time.perf_counter() - started
+                    usage = result.get("usage") or {}
+                    record_usage(model, usage, elapsed)
+                    print(f"[OpenRouter] {label}: {model} in {elapsed:.1f} s, attempt {attempt + 1}, "
+                          f"{usage.get('prompt_tokens', '?')}+{usage.get('completion_tokens', '?')} tokens")
+                    completion = Completion(content, result.get("model", model), result, usage, attempt + 1, elapsed)
+                    # Output cut off at the token limit is never cached
+                    truncated = result["choices"][0].get("finish_reason") == "length"
+                    if mode != "bypass" and content and not truncated:
+                        await asyncio.to_thread(get_cache_store().set, COMPLETION_CACHE_NAMESPACE, cache_key, {
+                            "content": content, "model": completion.model, "response": result, "usage": usage,
+                        }, COMPLETION_CACHE_TTL, COMPLETION_CACHE_BYTES)
+                    return completion
+                # Provider errors can arrive in a 200 body
+                status = error.get("code") if isinstance(error, dict) else None
+                status = status if isinstance(status, int) else 502
+                failure = OpenRouterResponseError(f"OpenRouter error: {error}", status)
+            else:
+                status = resp.status_code
+                retry_after = resp.headers.get("retry-after")
+                failure = OpenRouterError(f"OpenRouter error: {resp.text}", status)
+            retryable = status in RETRY_STATUSES
+        except httpx.TransportError as e:
+            failure = OpenRouterError(f"OpenRouter request failed: {type(e).__name__}: {e}")
+            retryable = True
+        except OpenRouterError as e:
+            failure, retryable = e, False
+
+        if not retryable or attempt >= max_retries:
+            record_usage(model, None, time.perf_counter() - started, failed=True)
+            print(f"[OpenRouter] {label}: {model} failed after {attempt + 1} attempts: {failure.detail[:300]}")
+            raise failure
+        delay = _backoff(attempt, retry_after)
+        print(f"[OpenRouter] {label}: {failure.detail[:200]}, retrying in {delay:.1f} s")
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def stream_chat_completion(payload: dict, label: str = "openrouter", api_key: Optional[str] = None,
+                                 timeout: Optional[float] = None,
+                                 max_retries: int = OPENROUTER_MAX_RETRIES) -> AsyncIterator[StreamChunk]:
+    """
+    Stream a chat completion as StreamChunks. Failures before the first chunk are retried
+    like chat_completion; once output has been yielded an error is raised instead.
+    """
+    model = payload.get("model", "")
+    headers = _headers(api_key)
+    timeout = timeout or model_timeout(model)
+    payload = {**payload, "stream": True}
+    get_debug_capture().capture("openrouter_request", {"data": payload}, model=model, label=label)
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        retry_after = None
+        yielded = False
+        try:
+            async with get_http_client("openrouter").stream(
+                "POST", OPENROUTER_API_URL, json=payload, headers=headers, timeout=timeout
+            ) as r:
+                if r.status_code == 200:
+                    usage = {}
+                    async for line in r.aiter_lines():
+                        if line.startswith(":"):
+                            yielded = True
+                            yield StreamChunk(comment=line)
+                            continue
+                        if not line.startswith("data: "):
+                            continue
+                        data = line[6:]
+                        if data == "[DONE]":
+                            break
+                        try:
+                            chunk = json.loads(data)
+                        except ValueError:
+                            continue
+                        usage = chunk.get("usage") or usage
+                        try:
+                            delta = chunk["choices"][0]["delta"].get("content")
+                        except (KeyError, IndexError, TypeError, AttributeError):
+                            continue
+                        if delta:
+                            yielded = True
+                            yield StreamChunk(content=delta)
+                    elapsed = time.perf_counter() - started
+                    record_usage(model, usage, elapsed)
+                    print(f"[OpenRouter] {label}: streamed {model} in {elapsed:.1f} s, attempt {attempt + 1}")
+                    return
+                status = r.status_code
+                retry_after = r.headers.get("retry-after")
+                detail = (await r.aread()).decode(errors="replace")
+                failure = OpenRouterError(f"OpenRouter error: {detail}", status)
+                retryable = status in RETRY_STATUSES
+        except httpx.TransportError as e:
+            if yielded:
+                record_usage(model, None, time.perf_counter() - started, failed=True)
+                raise OpenRouterError(f"OpenRouter stream interrupted: {type(e).__name__}: {e}")
+            failure = OpenRouterError(f"OpenRouter request failed: {type(e).__name__}: {e}")
+            retryable = True
+
+        if not retryable or attempt >= max_retries:
+            record_usage(model, None, time.perf_counter() - started, failed=True)
+            print(f"[OpenRouter] {label}: {model} failed after {attempt + 1} attempts: {failure.detail[:300]}")
+            raise failure
+        delay = _backoff(attempt, retry_after)
+        print(f"[OpenRouter] {label}: {failure.detail[:200]}, retrying in {delay:.1f} s")
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,191 @@
+"""
+Decoded-raster cache for cropping screenshots.
+
+Decoding a 2x full-page PNG is the expensive part of a crop, so each screenshot
+is decoded once into a raw RGB array on disk and memory-mapped from there. The
+array shape is part of the filename, so any uvicorn worker can map a raster
+written by another one without a header or a shared index. So is the version
+of the screenshot file (see source_version): a new capture under a reused ID
+never maps the raster of the old one. Cropping is then
+plain slicing. Rasters are evicted least-recently-used (by mtime, touched on
+every access) once the directory exceeds RASTER_CACHE_MAX_BYTES.
+"""
+
+import os
+import re
+import threading
+import contextlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+RASTER_CACHE_DIR = os.getenv(
+    "RASTER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "raster_cache")
+)
+RASTER_CACHE_MAX_BYTES = int(os.getenv("RASTER_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Rasters kept mapped in this process
+MAX_OPEN_RASTERS = 16
+
+_RASTER_FILENAME = re.compile(
+    r"^(?P<id>[A-Za-z0-9_-]+)\.(?P<version>[0-9a-f]+-[0-9a-f]+)\.(?P<h>\d+)x(?P<w>\d+)x(?P<c>\d+)\.raw$"
+)
+
+
+def source_version(source_path: str) -> str:
+    """Identifies one screenshot file (modification time and size), for cache keys derived from it."""
+    stat = os.stat(source_path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def crop_box_pixels(bounding_box: dict, image_width: int, image_height: int) -> Tuple[int, int, int, int]:
+    """Convert a percentage bounding box to a clamped pixel box (x, y, width, height)."""
+    x = int((bounding_box.get('x', 0) / 100) * image_width)
+    y = int((bounding_box.get('y', 0) / 100) * image_height)
+    width = int((bounding_box.get('width', 100) / 100) * image_width)
+    height = int((bounding_box.get('height', 100) / 100) * image_height)
+
+    # Ensure coordinates are within image bounds
+    x = max(0, min(x, image_width - 1))
+    y = max(0, min(y, image_height - 1))
+    width = max(1, min(width, image_width - x))
+    height = max(1, min(height, image_height - y))
+    return x, y, width, height
+
+
+class RasterCache:
+    def __init__(self, directory: str = RASTER_CACHE_DIR, max_bytes: int = RASTER_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._open: "OrderedDict[str, np.memmap]" = OrderedDict()
+        # Guards _open and _decoding only; decoding a screenshot holds that screenshot's own lock
+        self._lock = threading.Lock()
+        self._decoding: Dict[str, Tuple[threading.Lock, int]] = {}
+
+    def _find(self, key: str) -> Optional[Tuple[str, Tuple[int, int, int]]]:
+        prefix = f"{key}."
+        for filename in os.listdir(self.directory):
+            match = _RASTER_FILENAME.match(filename)
+            if filename.startswith(prefix) and match and f"{match.group('id')}.{match.group('version')}" == key:
+                shape = (int(match.group("h")), int(match.group("w")), int(match.group("c")))
+                return os.path.join(self.directory, filename), shape
+        return None
+
+    def get(self, screenshot_id: str, source_path: str) -> np.ndarray:
+        """Return the decoded RGB raster (height, width, 3) of a screenshot, decoding it on a miss."""
+        key = f"{screenshot_id}.{source_version(source_path)}"
+        raster = self._lookup(key)
+        if raster is not None:
+            return raster
+        # Concurrent requests for the same screenshot wait for one decode; others are not blocked
+        with self._key_lock(key):
+            raster = self._lookup(key)
+            if raster is not None:
+                return raster
+            found = self._find(key)
+            if found is None:
+                found = self._decode(key, source_path)
+            path, shape = found
+            os.utime(path)
+            raster = np.memmap(path, dtype=np.uint8, mode="r", shape=shape)
+            with self._lock:
+                self._open[key] = raster
+                while len(self._open) > MAX_OPEN_RASTERS:
+                    self._open.popitem(last=False)
+            return raster
+
+    def _lookup(self, key: str) -> Optional[np.memmap]:
+        with self._lock:
+            raster = self._open.get(key)
+            if raster is None:
+                return None
+            self._open.move_to_end(key)
+        try:
+            os.utime(raster.filename)
+        except FileNotFoundError:
+            # Evicted by another worker
+            with self._lock:
+                self._open.pop(key, None)
+            return None
+        return raster
+
+    @contextlib.contextmanager
+    def _key_lock(self, key: str):
+        with self._lock:
+            lock, users = self._decoding.get(key, (None, 0))
+            lock = lock or threading.Lock()
+            self._decoding[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._decoding[key]
+                if users == 1:
+                    del self._decoding[key]
+                else:
+                    self._decoding[key] = (lock, users - 1)
+
+    def _decode(self, key: str, source_path: str) -> Tuple[str, Tuple[int, int, int]]:
+        from PIL import Image
+
+        with Image.open(source_path) as img:
+            pixels = np.asarray(img.convert("RGB"))
+        shape = pixels.shape
+        filename = f"{key}.{shape[0]}x{shape[1]}x{shape[2]}.raw"
+        path = os.path.join(self.directory, filename)
+        # Write under a per-process temporary name; a concurrent worker decoding the same
+        # screenshot just replaces the file with identical content
+        tmp_path = os.path.join(self.directory, f".{filename}.{os.getpid()}.tmp")
+        pixels.tofile(tmp_path)
+        os.replace(tmp_path, path)
+        print(f"[RasterCache] Decoded {source_path} into {filename} ({pixels.nbytes} bytes)")
+        self._evict(keep=path)
+        return path, shape
+
+    def _evict(self, keep: str):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if _RASTER_FILENAME.match(filename):
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            # Mappings that are still open elsewhere stay valid after unlink
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    def crop(self, screenshot_id: str, source_path: str, bounding_boxes: List[dict]) -> List[Dict]:
+        """Crop several percentage boxes from one screenshot; returns pixel boxes with their pixels."""
+        raster = self.get(screenshot_id, source_path)
+        image_height, image_width = raster.shape[:2]
+        crops = []
+        for bounding_box in bounding_boxes:
+            x, y, width, height = crop_box_pixels(bounding_box, image_width, image_height)
+            crops.append({
+                "box": {"x": x, "y": y, "width": width, "height": height},
+                "pixels": raster[y:y + height, x:x + width],
+            })
+        return crops
+
+
+_raster_cache: Optional[RasterCache] = None
+
+
+def get_raster_cache() -> RasterCache:
+    global _raster_cache
+    if _raster_cache is None:
+        _raster_cache = RasterCache()
+    return _raster_cache
@@ -0,0 +1,239 @@
+"""
+Durable job system for FutureHouse research tasks.
+
+A research run takes minutes, so instead of blocking a request handler in
+`run_tasks_until_done`, jobs are submitted here and return an ID immediately.
+Each job is persisted in SQLite (query, FutureHouse task ID, status, progress,
+result) and driven by a background task that creates the FutureHouse task and
+polls it until it finishes. On startup, unfinished jobs are resumed: jobs that
+already have a FutureHouse task ID are re-attached to it, the others are
+submitted again. A semaphore caps the number of outstanding FutureHouse tasks.
+"""
+
+import os
+import json
+import uuid
+import sqlite3
+import asyncio
+import threading
+from datetime import datetime
+from typing import AsyncIterator, Dict, Optional
+
+from futurehouse_client import FutureHouseClient, JobNames
+
+RESEARCH_JOBS_DB = os.getenv(
+    "RESEARCH_JOBS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "research_jobs.sqlite3")
+)
+FUTUREHOUSE_MAX_CONCURRENCY = int(os.getenv("FUTUREHOUSE_MAX_CONCURRENCY", "3"))
+FUTUREHOUSE_POLL_INTERVAL = float(os.getenv("FUTUREHOUSE_POLL_INTERVAL", "5"))
+
+TERMINAL_STATUSES = ("completed", "failed")
+# FutureHouse task statuses that end a job
+_FUTUREHOUSE_SUCCESS = {"success"}
+_FUTUREHOUSE_FAILURE = {"fail", "cancelled", "truncated"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS research_jobs (
+    id TEXT PRIMARY KEY,
+    job_name TEXT NOT NULL,
+    query TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT,
+    futurehouse_task_id TEXT,
+    result TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+)
+"""
+
+
+def resolve_job_name(job_name: str):
+    """Map a job name such as "crow" or "falcon" to the FutureHouse JobNames member."""
+    try:
+        return JobNames[job_name.upper()]
+    except KeyError:
+        raise ValueError(f"Unknown FutureHouse job '{job_name}'")
+
+
+def serialize_task_response(task_response) -> dict:
+    """Reduce a FutureHouse task response (object, dict or list of them) to JSON-safe fields."""
+    if isinstance(task_response, list):
+        task_response = task_response[0] if task_response else None
+    if task_response is None:
+        raise ValueError("Invalid or empty response from FutureHouse API")
+    if isinstance(task_response, dict):
+        get = task_response.get
+    else:
+        get = lambda key, default=None: getattr(task_response, key, default)
+    references = get("references", None) or []
+    return {
+        "answer": get("answer", "") or "",
+        "formatted_answer": get("formatted_answer", "") or "",
+        "references": json.loads(json.dumps(references, default=str)) if isinstance(references, list) else [],
+    }
+
+
+class ResearchJobManager:
+    def __init__(self, db_path: str = RESEARCH_JOBS_DB, max_concurrency: int = FUTUREHOUSE_MAX_CONCURRENCY,
+                 poll_interval: float = FUTUREHOUSE_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._client: Optional[FutureHouseClient] = None
+
+    def _futurehouse(self) -> FutureHouseClient:
+        if self._client is None:
+            api_key = os.getenv("FUTURE_HOUSE_API_KEY", "")
+            if not api_key:
+                raise RuntimeError("Future House API key not set.")
+            self._client = FutureHouseClient(api_key=api_key)
+        return self._client
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._db_lock:
+            row = self._db.execute("SELECT * FROM research_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = datetime.now().isoformat()
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._db_lock:
+            self._db.execute(f"UPDATE research_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+        # Wake subscribers, then arm a fresh event for the next change
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def submit(self, query: str, job_name: str = "crow") -> dict:
+        """Persist a new job and start it in the background. Returns the job record."""
+        resolve_job_name(job_name)
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO research_jobs (id, job_name, query, status, progress, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', 'Waiting for a FutureHouse slot', ?, ?)",
+                (job_id, job_name.lower(), query, now, now),
+            )
+            self._db.commit()
+        self._start(job_id)
+        return self.get(job_id)
+
+    def resume(self):
+        """Restart every unfinished job; called once on application startup."""
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id FROM research_jobs WHERE status NOT IN (?, ?)", TERMINAL_STATUSES
+            ).fetchall()
+        for row in rows:
+            print(f"[Research] Resuming job {row['id']}")
+            self._start(row["id"])
+
+    def _start(self, job_id: str):
+        if job_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def stop(self):
+        """Stop the background tasks without touching job state, so they resume on the next start."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job_id: str):
+        job = self.get(job_id)
+        try:
+            async with self._slots:
+                client = self._futurehouse()
+                task_id = job["futurehouse_task_id"]
+                if not task_id:
+                    task_data = {"name": resolve_job_name(job["job_name"]), "query": job["query"]}
+                    task_id = str(await asyncio.to_thread(client.create_task, task_data))
+                    self._update(job_id, status="running", futurehouse_task_id=task_id, progress="Submitted to FutureHouse")
+                    print(f"[Research] Job {job_id} submitted as FutureHouse task {task_id}")
+                else:
+                    self._update(job_id, status="running", progress="Re-attached to FutureHouse task")
+                    print(f"[Research] Job {job_id} re-attached to FutureHouse task {task_id}")
+
+                while True:
+                    task_response = await asyncio.to_thread(client.get_task, task_id)
+                    status = str(getattr(task_response, "status", "") or "").lower()
+                    if status in _FUTUREHOUSE_SUCCESS:
+                        self._update(job_id, status="completed", progress=status,
+                                     result=serialize_task_response(task_response))
+                        return
+                    if status in _FUTUREHOUSE_FAILURE:
+                        self._update(job_id, status="failed", progress=status, error=f"FutureHouse task {status}")
+                        return
+                    if status and status != (self.get(job_id) or {}).get("progress"):
+                        self._update(job_id, progress=status)
+                    await asyncio.sleep(self.poll_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Research] Job {job_id} failed: {type(e).__name__}: {e}")
+            self._update(job_id, status="failed", error=f"{type(e).__name__}: {e}")
+
+    async def wait_for_change(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        """Wait until the job is updated. Returns False on timeout."""
+        event = self._changed.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> dict:
+        """Wait until the job is finished and return it. Raises asyncio.TimeoutError."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in TERMINAL_STATUSES:
+                return job
+            remaining = deadline - loop.time() if deadline else None
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError()
+            await self.wait_for_change(job_id, remaining)
+
+    async def events(self, job_id: str, heartbeat: float = 15.0) -> AsyncIterator[Optional[dict]]:
+        """Yield the job on every change until it is finished; None is yielded as a keep-alive."""
+        last_updated = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            if job["updated_at"] != last_updated:
+                last_updated = job["updated_at"]
+                yield job
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            if not await self.wait_for_change(job_id, heartbeat):
+                yield None
+
+
+_manager: Optional[ResearchJobManager] = None
+
+
+def get_research_jobs() -> ResearchJobManager:
+    global _manager
+    if _manager is None:
+        _manager = ResearchJobManager()
+    return _manager
@@ -1,15 +1,31 @@
 import os
-import uuid
+import re
+import base64
 import asyncio
+from collections import OrderedDict
 from datetime import datetime
 from typing import Optional
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, PlainTextResponse
 from pydantic import BaseModel
-from playwright.async_api import async_playwright
+
+from capture_engine import (
+    SCREENSHOTS_DIR,
+    ELEMENTS_DIR,
+    IMAGE_FORMATS,
+    ScreenshotRequest,
+    ElementScreenshotRequest,
+    find_screenshot_file,
+    get_capture_engine,
+    har_archive_path,
+    list_har_archives,
+    new_screenshot_id,
+    resolve_har_id,
+)
+from metrics import PROMETHEUS_CONTENT_TYPE, render_prometheus
 
 app = FastAPI(title="Screenshot API", description="API for taking screenshots of webpages")
 
@@ -22,322 +38,330 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-SCREENSHOTS_DIR = Path("screenshots")
-SCREENSHOTS_DIR.mkdir(exist_ok=True)
-
-# CSS to hide common cookie banners and popups
-POPUP_HIDING_CSS = """
-/* Hide common cookie banner selectors */
-[id*="cookie" i],
-[class*="cookie" i],
-[id*="consent" i],
-[class*="consent" i],
-[id*="gdpr" i],
-[class*="gdpr" i],
-[id*="privacy" i],
-[class*="privacy" i],
-[id*="banner" i],
-[class*="banner" i],
-[id*="notice" i],
-[class*="notice" i],
-[id*="popup" i],
-[class*="popup" i],
-[id*="modal" i],
-[class*="modal" i],
-[id*="overlay" i],
-[class*="overlay" i],
-[id*="notification" i],
-[class*="notification" i],
-[class*="toast" i],
-[id*="toast" i],
-[class*="alert" i],
-[id*="alert" i],
-
-/* Hide common newsletter popups */
-[class*="newsletter" i],
-[id*="newsletter" i],
-[class*="subscribe" i],
-[id*="subscribe" i],
-[class*="signup" i],
-[id*="signup" i],
-
-/* Hide bottom/top banners */
-div[style*="position: fixed"][style*="bottom: 0"],
-div[style*="position: fixed"][style*="top: 0"],
-div[style*="position: sticky"][style*="bottom: 0"],
-div[style*="position: sticky"][style*="top: 0"],
-
-/* Hide common popup frameworks */
-.swal2-container,
-.sweet-alert,
-.vex-content,
-.bootbox,
-.ui-dialog,
-.fancybox-container,
-.mfp-container,
+# Recent capture jobs (status and per-stage timings), oldest evicted first
+MAX_TRACKED_JOBS = 500
+JOBS: "OrderedDict[str, dict]" = OrderedDict()
+# In-flight capture tasks by screenshot ID, cancelled by DELETE /screenshot/{id}
+RUNNING_TASKS: dict[str, asyncio.Task] = {}
 
-/* Hide consent management platforms */
-#onetrust-consent-sdk,
-#CybotCookiebotDialog,
-#cookieChoiceInfo,
-#cookiescript_injected,
-.cc-window,
-.cc-banner,
-.cookie-law-info-bar,
-.gdpr-cookie-notice,
-.cookie-notice-container,
-
-/* Hide specific cookie banner services */
-.osano-cm-widget,
-.trustarc-banner-container,
-.evidon-barrier-wrapper,
-.ot-sdk-container,
-.optanon-alert-box-wrapper,
-
-/* Common z-index overlays */
-[style*="z-index: 999"],
-[style*="z-index: 9999"],
-[style*="z-index: 99999"] {
-    display: none !important;
-    visibility: hidden !important;
-    opacity: 0 !important;
-    pointer-events: none !important;
-}
-
-/* Remove backdrop/overlay elements */
-.modal-backdrop,
-.overlay,
-.backdrop,
-[class*="backdrop" i],
-[id*="backdrop" i] {
-    display: none !important;
-}
-
-/* Remove fixed/sticky positioning that might block content */
-body {
-    overflow: auto !important;
-}
-"""
-
-class ScreenshotRequest(BaseModel):
-    url: str  # Changed from HttpUrl to str for more flexible URL handling
-    width: int = 1920
-    height: int = 1080
-    wait_time: int = 0
-    full_page: bool = True  # Changed default to True for better full-page capture
-    element_selector: Optional[str] = None
-    hide_popups: bool = True  # New option to hide popups
-    
-    def __init__(self, **data):
-        super().__init__(**data)
-        # Normalize URL to ensure it has a protocol
-        self.url = self._normalize_url(self.url)
-    
-    def _normalize_url(self, url: str) -> str:
-        """Normalize URL to ensure it has a protocol"""
-        url = url.strip()
-        
-        # If URL doesn't start with http:// or https://, add https://
-        if not url.startswith(('http://', 'https://')):
-            # If it starts with www., add https://
-            if url.startswith('www.'):
-                url = 'https://' + url
-            # If it doesn't start with www., assume it's a domain and add https://
-            else:
-                url = 'https://' + url
-        
-        return url
+SCREENSHOT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
 
 class ScreenshotResponse(BaseModel):
     screenshot_id: str
     message: str
     url: str
+    har_id: Optional[str] = None
     
-async def take_screenshot_async(request: ScreenshotRequest, screenshot_id: str):
+def register_job(screenshot_id: str, url: str, har_id: Optional[str] = None) -> dict:
+    job = {
+        "screenshot_id": screenshot_id,
+        "url": url,
+        "har_id": har_id,
+        "status": "queued",
+        "created_at": datetime.now().isoformat(),
+        "finished_at": None,
+        "filename": None,
+        "error": None,
+        "timings": {},
+    }
+    JOBS[screenshot_id] = job
+    while len(JOBS) > MAX_TRACKED_JOBS:
+        JOBS.popitem(last=False)
+    return job
+
+async def capture_screenshot(request: ScreenshotRequest, screenshot_id: str) -> tuple[bytes, Optional[Path]]:
     """
-    Asynchronously take a screenshot of the specified URL using Playwright.
-    Enhanced to properly capture full scrollable content.
+    Take a screenshot on the shared capture engine and return the encoded image
+    and, if it was persisted, its path. The job entry tracks status and timings. Raises on failure.
     """
-    filename = f"screenshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{screenshot_id}.png"
-    file_path = SCREENSHOTS_DIR / filename
+    job = JOBS.get(screenshot_id) or register_job(screenshot_id, request.url)
+    job["status"] = "running"
+    try:
+        result = await get_capture_engine().capture(request, screenshot_id, timings=job["timings"])
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        raise
+    except asyncio.TimeoutError:
+        job["status"] = "timeout"
+        job["error"] = "Deadline exceeded"
+        raise
+    except BaseException as e:
+        job["status"] = "failed"
+        job["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        job["finished_at"] = datetime.now().isoformat()
+    job["status"] = "completed"
+    job["filename"] = result.file_path.name if result.file_path else None
+    return result.image_bytes, result.file_path
 
+async def take_screenshot_async(request: ScreenshotRequest, screenshot_id: str):
+    """
+    Background variant of capture_screenshot: errors are logged instead of raised.
+    """
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch()
-            page = await browser.new_page(
-                viewport={'width': request.width, 'height': request.height},
-                device_scale_factor=2
-            )
-            
-            # Navigate to the page with a shorter timeout
-            print(f"[DEBUG] Navigating to {request.url}")
-            await page.goto(request.url, wait_until="domcontentloaded", timeout=15000)
-            print(f"[DEBUG] Navigation completed for {request.url}")
+        await capture_screenshot(request, screenshot_id)
+    except asyncio.CancelledError:
+        print(f"[DEBUG] Screenshot {screenshot_id} cancelled")
+    except Exception as e:
+        print("!!!!!!!!!! An error occurred during screenshot generation !!!!!!!!!!")
+        print(f"Error type: {type(e).__name__}")
+        print(f"Error details: {e}")
 
-            # Wait for initial page load
-            if request.wait_time > 0:
-                await asyncio.sleep(request.wait_time)
-            else:
-                # Default wait for dynamic content
-                await asyncio.sleep(3)
+async def capture_elements(request: ElementScreenshotRequest, screenshot_id: str):
+    """Multi-element variant of capture_screenshot, with the same job tracking."""
+    job = JOBS.get(screenshot_id) or register_job(screenshot_id, request.url)
+    job["status"] = "running"
+    try:
+        result = await get_capture_engine().capture_elements(request, screenshot_id, timings=job["timings"])
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        raise
+    except asyncio.TimeoutError:
+        job["status"] = "timeout"
+        job["error"] = "Deadline exceeded"
+        raise
+    except BaseException as e:
+        job["status"] = "failed"
+        job["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        job["finished_at"] = datetime.now().isoformat()
+    job["status"] = "completed"
+    return result
 
-            # For full page screenshots, ensure all content is loaded
-            if request.full_page:
-                print(f"[DEBUG] Preparing full-page screenshot for {request.url}")
-                
-                # Scroll to trigger lazy loading and get full page height
-                await page.evaluate("""
-                    async () => {
-                        // Disable smooth scrolling for faster execution
-                        document.documentElement.style.scrollBehavior = 'auto';
-                        
-                        // Get initial height
-                        let lastHeight = document.body.scrollHeight;
-                        
-                        // Scroll to bottom to trigger lazy loading
-                        for (let i = 0; i < 10; i++) {
-                            window.scrollTo(0, document.body.scrollHeight);
-                            await new Promise(resolve => setTimeout(resolve, 500));
-                            
-                            let newHeight = document.body.scrollHeight;
-                            if (newHeight === lastHeight) {
-                                break; // No new content loaded
-                            }
-                            lastHeight = newHeight;
-                        }
-                        
-                        // Scroll back to top for the screenshot
-                        window.scrollTo(0, 0);
-                        await new Promise(resolve => setTimeout(resolve, 500));
-                    }
-                """)
-                
-                # Additional wait for content to settle
-                await asyncio.sleep(2)
+def start_capture_task(coro, screenshot_id: str) -> asyncio.Task:
+    """Run a capture as a tracked task so that it can be cancelled by ID."""
+    task = asyncio.create_task(coro)
+    RUNNING_TASKS[screenshot_id] = task
+    task.add_done_callback(lambda _: RUNNING_TASKS.pop(screenshot_id, None))
+    return task
 
-            # Hide popups if requested
-            if request.hide_popups:
-                print(f"[DEBUG] Injecting popup-hiding CSS for {request.url}")
-                await page.add_style_tag(content=POPUP_HIDING_CSS)
-                
-                # Additional JavaScript to remove elements that might not be caught by CSS
-                await page.evaluate("""
-                    // Remove elements that commonly contain popups
-                    const selectors = [
-                        '[role="dialog"]',
-                        '[aria-modal="true"]',
-                        '.modal',
-                        '.popup',
-                        '.overlay',
-                        '.cookie-banner',
-                        '.cookie-notice',
-                        '.gdpr-notice',
-                        '.consent-banner'
-                    ];
-                    
-                    selectors.forEach(selector => {
-                        document.querySelectorAll(selector).forEach(el => {
-                            // Check if element has high z-index (likely a popup)
-                            const style = window.getComputedStyle(el);
-                            const zIndex = parseInt(style.zIndex);
-                            if (zIndex > 100 || el.getAttribute('class')?.toLowerCase().includes('popup') || 
-                                el.getAttribute('class')?.toLowerCase().includes('modal') ||
-                                el.getAttribute('class')?.toLowerCase().includes('cookie')) {
-                                el.style.display = 'none';
-                                el.remove();
-                            }
-                        });
-                    });
-                    
-                    // Remove fixed position elements at the bottom (common for cookie banners)
-                    document.querySelectorAll('*').forEach(el => {
-                        const style = window.getComputedStyle(el);
-                        if (style.position === 'fixed') {
-                            const rect = el.getBoundingClientRect();
-                            // If it's at the bottom and wide, likely a cookie banner
-                            if (rect.bottom >= window.innerHeight - 100 && rect.width > window.innerWidth * 0.5) {
-                                el.style.display = 'none';
-                                el.remove();
-                            }
-                            // If it covers a large portion of the screen, likely a modal
-                            if (rect.width > window.innerWidth * 0.3 && rect.height > window.innerHeight * 0.3) {
-                                el.style.display = 'none';
-                                el.remove();
-                            }
-                        }
-                    });
-                """)
-                
-                # Wait a bit for the changes to take effect
-                await asyncio.sleep(1)
+async def cancel_when_disconnected(task: asyncio.Task, http_request: Request, poll_interval: float = 0.5):
+    """Cancel a synchronous capture as soon as the HTTP client goes away."""
+    while not task.done():
+        if await http_request.is_disconnected():
+            print("[DEBUG] Client disconnected, cancelling synchronous capture")
+            task.cancel()
+            return
+        await asyncio.sleep(poll_interval)
 
-            screenshot_options = {
-                "path": str(file_path),
-                "full_page": request.full_page,
-            }
-            
-            if request.element_selector:
-                element = page.locator(request.element_selector)
-                await element.screenshot(**screenshot_options)
-            else:
-                await page.screenshot(**screenshot_options)
+def cancelled_by_caller() -> bool:
+    """
+    Whether the current (handler) task is itself being cancelled, e.g. on shutdown,
+    as opposed to its capture task having been cancelled by DELETE or a disconnect.
+    """
+    task = asyncio.current_task()
+    return task is not None and task.cancelling() > 0
 
-            await browser.close()
-            print(f"Screenshot saved to {file_path}")
+def resolve_screenshot_id(request: ScreenshotRequest) -> str:
+    """Validate a client-chosen screenshot ID, or generate one."""
+    if request.screenshot_id:
+        if not SCREENSHOT_ID_PATTERN.match(request.screenshot_id):
+            raise HTTPException(status_code=400, detail="screenshot_id may only contain letters, digits, '-' and '_'")
+        if request.screenshot_id in RUNNING_TASKS:
+            raise HTTPException(status_code=409, detail="A capture with this screenshot_id is already running")
+        # Never overwrite a screenshot; after DELETE the ID may be captured again, and its
+        # crop URLs carry the new file version (see crop_cache.py)
+        if find_screenshot_file(request.screenshot_id):
+            raise HTTPException(status_code=409, detail="A screenshot with this screenshot_id already exists")
+    return request.screenshot_id or new_screenshot_id()
 
-    except Exception as e:
-        print(f"!!!!!!!!!! An error occurred during screenshot generation !!!!!!!!!!")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error details: {e}")
-        # Clean up failed screenshot file if it exists
-        if os.path.exists(file_path):
-            os.remove(file_path)
+def resolve_har(request: ScreenshotRequest, screenshot_id: str) -> Optional[str]:
+    """Validate HAR record/replay options up front, so background captures fail fast."""
+    try:
+        return resolve_har_id(request, screenshot_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/screenshot", response_model=ScreenshotResponse)
-async def create_screenshot(request: ScreenshotRequest, background_tasks: BackgroundTasks):
+async def create_screenshot(request: ScreenshotRequest, http_request: Request):
     """
     Accepts a URL and screenshot options, and returns a unique ID for the screenshot.
-    The screenshot is generated in the background.
+    The screenshot is generated in the background, unless `wait` is set: then the
+    capture runs inline and the encoded image is returned as the response body,
+    with the ID and (if saved) the filename in the X-Screenshot-* headers.
+    Captures stop at their `timeout_seconds` deadline, on DELETE /screenshot/{id},
+    or (in `wait` mode) when the client disconnects.
     """
-    screenshot_id = str(uuid.uuid4())[:8]
-    background_tasks.add_task(take_screenshot_async, request, screenshot_id)
+    screenshot_id = resolve_screenshot_id(request)
+    har_id = resolve_har(request, screenshot_id)
+    register_job(screenshot_id, request.url, har_id)
+    if request.wait:
+        task = start_capture_task(capture_screenshot(request, screenshot_id), screenshot_id)
+        watcher = asyncio.create_task(cancel_when_disconnected(task, http_request))
+        try:
+            image_bytes, file_path = await task
+        except asyncio.CancelledError:
+            if cancelled_by_caller():
+                raise
+            raise HTTPException(status_code=499, detail="Screenshot cancelled")
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Screenshot deadline exceeded")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            print(f"[ERROR] Synchronous screenshot failed for {request.url}: {type(e).__name__}: {e}")
+            raise HTTPException(status_code=502, detail=f"Screenshot failed: {e}")
+        finally:
+            watcher.cancel()
+        headers = {"X-Screenshot-Id": screenshot_id}
+        if file_path:
+            headers["X-Screenshot-Filename"] = file_path.name
+        if har_id:
+            headers["X-Har-Id"] = har_id
+        return Response(content=image_bytes, media_type=IMAGE_FORMATS[request.image_format][1], headers=headers)
+
+    start_capture_task(take_screenshot_async(request, screenshot_id), screenshot_id)
     return ScreenshotResponse(
         screenshot_id=screenshot_id,
         message="Screenshot creation initiated.",
-        url=request.url
+        url=request.url,
+        har_id=har_id
     )
 
+@app.post("/screenshot/elements")
+async def create_element_screenshots(request: ElementScreenshotRequest, http_request: Request):
+    """
+    Loads the page once and returns one image per element matched by
+    `element_selectors` and per entry of `regions`, with page bounding boxes in CSS
+    pixels and in percent of the full page. Always synchronous.
+    """
+    if not request.element_selectors and not request.regions:
+        raise HTTPException(status_code=400, detail="Provide element_selectors and/or regions")
+    screenshot_id = resolve_screenshot_id(request)
+    register_job(screenshot_id, request.url, resolve_har(request, screenshot_id))
+    task = start_capture_task(capture_elements(request, screenshot_id), screenshot_id)
+    watcher = asyncio.create_task(cancel_when_disconnected(task, http_request))
+    try:
+        result = await task
+    except asyncio.CancelledError:
+        if cancelled_by_caller():
+            raise
+        raise HTTPException(status_code=499, detail="Screenshot cancelled")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Screenshot deadline exceeded")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"[ERROR] Element capture failed for {request.url}: {type(e).__name__}: {e}")
+        raise HTTPException(status_code=502, detail=f"Screenshot failed: {e}")
+    finally:
+        watcher.cancel()
+
+    elements = []
+    for n, element in enumerate(result.elements):
+        entry = {
+            "selector": element.selector,
+            "index": element.index,
+            "bounding_box": element.bounding_box,
+            "bounding_box_percent": element.bounding_box_percent,
+            "image_url": f"/screenshot/{screenshot_id}/elements/{n}" if element.file_path else None,
+        }
+        if request.inline_images:
+            entry["image_base64"] = base64.b64encode(element.image_bytes).decode("utf-8")
+        elements.append(entry)
+    return {
+        "screenshot_id": screenshot_id,
+        "url": request.url,
+        "media_type": result.media_type,
+        "page_size": result.page_size,
+        "elements": elements,
+        "timings": result.timings,
+        "har_id": result.har_id,
+    }
+
+@app.get("/screenshot/{screenshot_id}/elements/{element_index}")
+async def get_element_screenshot(screenshot_id: str, element_index: int):
+    """Returns one element image of a multi-element capture."""
+    if not SCREENSHOT_ID_PATTERN.match(screenshot_id):
+        raise HTTPException(status_code=404, detail="Element screenshot not found.")
+    for extension, _ in IMAGE_FORMATS.values():
+        file_path = ELEMENTS_DIR / f"{screenshot_id}_{element_index}.{extension}"
+        if file_path.exists():
+            return FileResponse(file_path)
+    raise HTTPException(status_code=404, detail="Element screenshot not found.")
+
+@app.on_event("shutdown")
+async def shutdown_capture_engine():
+    await get_capture_engine().stop()
+
 @app.get("/screenshots")
 async def list_screenshots():
     """Lists all available screenshots."""
-    files = [f for f in os.listdir(SCREENSHOTS_DIR) if f.endswith(".png")]
+    extensions = tuple(f".{extension}" for extension, _ in IMAGE_FORMATS.values())
+    files = [f for f in os.listdir(SCREENSHOTS_DIR) if f.endswith(extensions)]
     return {"screenshots": files}
 
 @app.get("/screenshot/{screenshot_id}")
 async def get_screenshot(screenshot_id: str):
     """Returns the specified screenshot image."""
     # Find the file that contains the screenshot_id
-    found_files = list(SCREENSHOTS_DIR.glob(f"*_{screenshot_id}.png"))
-    if not found_files:
+    file_path = find_screenshot_file(screenshot_id)
+    if not file_path:
         raise HTTPException(status_code=404, detail="Screenshot not found.")
     
-    file_path = found_files[0]
     return FileResponse(file_path)
 
+@app.get("/screenshot/{screenshot_id}/status")
+async def get_screenshot_status(screenshot_id: str):
+    """Returns the job status and per-stage timing breakdown (seconds) of a capture."""
+    job = JOBS.get(screenshot_id)
+    if job:
+        return job
+    file_path = find_screenshot_file(screenshot_id)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="Screenshot job not found.")
+    # Finished before this process started tracking it
+    return {"screenshot_id": screenshot_id, "status": "completed", "filename": file_path.name, "timings": {}}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage histograms, queue depth, browsers/contexts, bytes, cache and failures."""
+    return PlainTextResponse(render_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.delete("/screenshot/{screenshot_id}")
 async def delete_screenshot(screenshot_id: str):
-    """Deletes the specified screenshot."""
-    found_files = list(SCREENSHOTS_DIR.glob(f"*_{screenshot_id}.png"))
-    if not found_files:
+    """
+    Deletes the specified screenshot. If the capture is still in flight it is
+    cancelled first, which frees its browser context immediately.
+    """
+    task = RUNNING_TASKS.get(screenshot_id)
+    if task and not task.done():
+        task.cancel()
+        print(f"[DEBUG] Cancelled in-flight capture {screenshot_id}")
+        return {"message": f"Screenshot {screenshot_id} cancelled."}
+
+    file_path = find_screenshot_file(screenshot_id)
+    if not file_path:
         raise HTTPException(status_code=404, detail="Screenshot to delete not found.")
     
-    file_path = found_files[0]
     try:
         os.remove(file_path)
         return {"message": f"Screenshot {screenshot_id} deleted successfully."}
     except OSError as e:
         raise HTTPException(status_code=500, detail=f"Error deleting file: {e}")
 
+@app.get("/har")
+async def list_har():
+    """Lists recorded HAR archives available for replay."""
+    return {"archives": list_har_archives()}
+
+@app.delete("/har/{har_id}")
+async def delete_har(har_id: str):
+    """Deletes a recorded HAR archive."""
+    try:
+        path = har_archive_path(har_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="HAR archive not found.")
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="HAR archive not found.")
+    try:
+        path.unlink()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to delete HAR archive: {e}")
+    return {"message": f"HAR archive {har_id} deleted successfully"}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,209 @@
+"""
+Event-driven readiness for files in the shared screenshots directory.
+
+The capture engine writes every screenshot to a hidden temporary name and
+renames it into place, so a rename into the directory (IN_MOVED_TO) means the
+file is complete; IN_CLOSE_WRITE covers writers that do not rename. On Linux
+the directory is watched with inotify through the event loop, and waiters are
+woken as soon as their file is finalized. Other hosts fall back to polling.
+
+The watcher also keeps an index of screenshot ID -> path, so lookups by ID do
+not list the whole directory.
+"""
+
+import os
+import re
+import sys
+import time
+import errno
+import ctypes
+import ctypes.util
+import struct
+import asyncio
+from typing import Dict, List, Optional
+
+SCREENSHOT_FILENAME_PATTERN = re.compile(r"^screenshot_\d{8}_\d{6}_(?P<id>[A-Za-z0-9_-]+)\.(?:png|jpg)$")
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+_EVENT_HEADER = struct.Struct("iIII")
+
+POLL_INTERVAL = float(os.getenv("SCREENSHOT_POLL_INTERVAL", "0.25"))
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class ScreenshotWatcher:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._index: Dict[str, str] = {}
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._fd: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started = False
+        self._poll_task: Optional[asyncio.Task] = None
+
+    @property
+    def event_driven(self) -> bool:
+        return self._fd is not None
+
+    def start(self):
+        """Start watching; must be called from the running event loop. Safe to call repeatedly."""
+        if self._started:
+            return
+        self._started = True
+        os.makedirs(self.directory, exist_ok=True)
+        self._loop = asyncio.get_running_loop()
+        libc = _load_libc()
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF
+                if libc.inotify_add_watch(fd, self.directory.encode(), mask) >= 0:
+                    self._fd = fd
+                    self._loop.add_reader(fd, self._on_readable)
+                else:
+                    os.close(fd)
+        if self._fd is None:
+            print(f"[DEBUG] inotify unavailable, polling {self.directory} every {POLL_INTERVAL}s")
+        # Scan after the watch is in place so no file can slip between the two
+        self._rescan()
+
+    def stop(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._started = False
+
+    def lookup(self, screenshot_id: str) -> Optional[str]:
+        """Return the path of a finalized screenshot, or None."""
+        if not self.event_driven:
+            # Without events the index can be stale in both directions
+            self._rescan()
+        path = self._index.get(screenshot_id)
+        if path and not os.path.exists(path):
+            self._index.pop(screenshot_id, None)
+            path = None
+        return path
+
+    async def wait_for(self, screenshot_id: str, timeout_seconds: float) -> str:
+        """Wait until the screenshot is finalized and return its path. Raises asyncio.TimeoutError."""
+        self.start()
+        path = self.lookup(screenshot_id)
+        if path:
+            return path
+        if not self.event_driven:
+            return await self._poll_for(screenshot_id, timeout_seconds)
+        future = self._loop.create_future()
+        self._waiters.setdefault(screenshot_id, []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout_seconds)
+        finally:
+            waiters = self._waiters.get(screenshot_id, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(screenshot_id, None)
+
+    async def _poll_for(self, screenshot_id: str, timeout_seconds: float) -> str:
+        deadline = time.monotonic() + timeout_seconds
+        while time.monotonic() < deadline:
+            path = self.lookup(screenshot_id)
+            if path:
+                return path
+            await asyncio.sleep(POLL_INTERVAL)
+        raise asyncio.TimeoutError()
+
+    async def _poll_waiters(self):
+        """Wake waiters that were registered for events by rescanning until none are left."""
+        while self._waiters and not self.event_driven:
+            self._rescan()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def _rescan(self):
+        index = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    match = SCREENSHOT_FILENAME_PATTERN.match(entry.name)
+                    if match and entry.is_file() and entry.stat().st_size > 0:
+                        index[match.group("id")] = entry.path
+        except FileNotFoundError:
+            pass
+        self._index = index
+        for screenshot_id, path in index.items():
+            self._notify(screenshot_id, path)
+
+    def _notify(self, screenshot_id: str, path: str):
+        for future in self._waiters.pop(screenshot_id, []):
+            if not future.done():
+                future.set_result(path)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                print(f"[DEBUG] inotify read failed: {e}")
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b"\0").decode(errors="replace")
+            offset += name_length
+            self._handle_event(mask, name)
+
+    def _handle_event(self, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self._rescan()
+            return
+        if mask & (IN_DELETE_SELF | IN_IGNORED):
+            # The directory itself went away; degrade to polling
+            print(f"[DEBUG] Lost inotify watch on {self.directory}, falling back to polling")
+            self.stop()
+            self._started = True
+            # New waiters poll by themselves; the pending ones were waiting for an event
+            if self._waiters and (self._poll_task is None or self._poll_task.done()):
+                self._poll_task = self._loop.create_task(self._poll_waiters())
+            return
+        match = SCREENSHOT_FILENAME_PATTERN.match(name)
+        if not match:
+            return
+        screenshot_id = match.group("id")
+        path = os.path.join(self.directory, name)
+        if mask & (IN_MOVED_TO | IN_CLOSE_WRITE):
+            self._index[screenshot_id] = path
+            self._notify(screenshot_id, path)
+        elif mask & (IN_MOVED_FROM | IN_DELETE):
+            if self._index.get(screenshot_id) == path:
+                self._index.pop(screenshot_id, None)
+
+
+_watcher: Optional[ScreenshotWatcher] = None
+
+
+def get_screenshot_watcher() -> ScreenshotWatcher:
+    global _watcher
+    if _watcher is None:
+        _watcher = ScreenshotWatcher(os.path.join(os.path.dirname(os.path.abspath(__file__)), "screenshots"))
+    return _watcher
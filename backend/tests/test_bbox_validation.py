@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from bbox_validation import validate_boxes
+
+
+def _section(name, x, y, width, height):
+    return {'featureName': name, 'bounding_box': {'x': x, 'y': y, 'width': width, 'height': height}}
+
+
+def _corrections(report):
+    return {entry['featureName']: entry['corrections'] for entry in report}
+
+
+def test_clips_to_the_page_and_flips_inverted_boxes():
+    sections, report = validate_boxes([_section('hero', -5, 10, 110, -10)])
+    assert sections[0]['bounding_box'] == {'x': 0.0, 'y': 0.0, 'width': 100.0, 'height': 10.0}
+    assert _corrections(report)['hero'] == ['clipped']
+
+
+def test_invalid_box_is_removed():
+    sections, report = validate_boxes([_section('broken', 'left', 0, 10, 10)])
+    assert 'bounding_box' not in sections[0]
+    assert _corrections(report)['broken'] == ['invalid_removed']
+
+
+def test_stacked_siblings_are_split_in_the_middle():
+    sections, report = validate_boxes([_section('header', 0, 0, 100, 30), _section('hero', 0, 20, 100, 30)])
+    assert sections[0]['bounding_box']['height'] == 25.0
+    assert sections[1]['bounding_box']['y'] == 25.0
+    assert all('overlap_resolved' in corrections for corrections in _corrections(report).values())
+
+
+def test_merged_duplicates_share_the_resolved_box():
+    sections, report = validate_boxes([
+        _section('a', 0, 0, 100, 30),
+        _section('b', 0, 10, 100, 40),
+        _section('c', 0, 10.5, 100, 40),
+    ])
+    a, b, c = (section['bounding_box'] for section in sections)
+    assert b == c == {'x': 0.0, 'y': 20.0, 'width': 100.0, 'height': 30.5}
+    assert a['y'] + a['height'] <= b['y']
+    corrections = _corrections(report)
+    assert corrections['c'] == ['merged_duplicate_of:b', 'overlap_resolved']
+    assert 'merged_duplicates' in corrections['b']
+
+
+def test_remaining_overlap_is_reported():
+    # `outer` contains `inner` and overlaps `below`, which is not its neighbour once sorted
+    sections, report = validate_boxes([
+        _section('outer', 0, 0, 100, 60),
+        _section('inner', 0, 10, 100, 20),
+        _section('below', 0, 40, 100, 40),
+    ])
+    corrections = _corrections(report)
+    assert 'overlap_unresolved' in corrections['outer']
+    assert 'overlap_resolved' not in corrections['below']
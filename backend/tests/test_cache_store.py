@@ -0,0 +1,87 @@
+import io
+import time
+
+import pytest
+
+from cache_store import CacheStore, canonical_url, resolve_cache_mode, screenshot_matches
+from image_prep import image_fingerprint
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CacheStore(str(tmp_path / "cache.sqlite3"))
+
+
+def test_canonical_url():
+    assert canonical_url("Example.com/pricing/?b=2&a=1#top") == "https://example.com/pricing?a=1&b=2"
+    assert canonical_url("http://example.com:80") == "http://example.com/"
+
+
+def test_resolve_cache_mode():
+    assert resolve_cache_mode(None) == "use"
+    assert resolve_cache_mode("REFRESH") == "refresh"
+    assert resolve_cache_mode("use", bypass=True) == "bypass"
+    with pytest.raises(ValueError):
+        resolve_cache_mode("sometimes")
+
+
+def _screenshot(height=2400, heading=(30, 30, 30), longer_line=0, image_format="PNG", **options):
+    """A page of grey 'text' lines under a heading bar, encoded as a screenshot."""
+    Image = pytest.importorskip("PIL.Image")
+    ImageDraw = pytest.importorskip("PIL.ImageDraw")
+    image = Image.new("RGB", (1200, height), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 1200, 160), fill=heading)
+    for y in range(240, height - 80, 48):
+        draw.rectangle((120, y, 120 + (y * 37) % 900 + (longer_line if y == 480 else 0), y + 16), fill=(90, 90, 90))
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def test_screenshot_that_looks_the_same_matches():
+    fingerprint = image_fingerprint(_screenshot())
+    assert fingerprint.startswith("gray:1200x2400:")
+    assert screenshot_matches(fingerprint, image_fingerprint(_screenshot()))
+    # Different bytes, same page
+    assert screenshot_matches(fingerprint, image_fingerprint(_screenshot(image_format="JPEG", quality=70)))
+    assert screenshot_matches(fingerprint, image_fingerprint(_screenshot(height=2410)))
+    assert not screenshot_matches(None, fingerprint)
+    assert not screenshot_matches(fingerprint, None)
+
+
+def test_changed_screenshot_does_not_match():
+    fingerprint = image_fingerprint(_screenshot())
+    assert not screenshot_matches(fingerprint, image_fingerprint(_screenshot(heading=(200, 40, 40))))
+    assert not screenshot_matches(fingerprint, image_fingerprint(_screenshot(longer_line=40)))
+    assert not screenshot_matches(fingerprint, image_fingerprint(_screenshot(height=3600)))
+
+
+def test_undecodable_screenshot_falls_back_to_content_hash():
+    fingerprint = image_fingerprint(b"\x89PNG page")
+    assert fingerprint.startswith("sha256:")
+    assert screenshot_matches(fingerprint, image_fingerprint(b"\x89PNG page"))
+    assert not screenshot_matches(fingerprint, image_fingerprint(b"\x89PNG page with new copy"))
+
+
+def test_fingerprint_of_file_and_bytes_agree(tmp_path):
+    path = tmp_path / "shot.png"
+    path.write_bytes(_screenshot())
+    assert image_fingerprint(str(path)) == image_fingerprint(_screenshot())
+
+
+def test_expired_entries_are_not_returned(store):
+    store.set("ns", "fresh", {"a": 1}, ttl=60)
+    store.set("ns", "stale", {"a": 2}, ttl=-1)
+    assert store.get("ns", "fresh") == {"a": 1}
+    assert store.get("ns", "stale") is None
+
+
+def test_least_recently_used_entries_are_evicted(store):
+    store.set("ns", "old", "x" * 100, ttl=60)
+    time.sleep(0.01)
+    store.set("ns", "new", "y" * 100, ttl=60)
+    store.set("ns", "newest", "z" * 100, ttl=60, max_bytes=250)
+    assert store.get("ns", "old") is None
+    assert store.get("ns", "new") == "y" * 100
+    assert store.stats()["namespaces"]["ns"]["entries"] == 2
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+import crop_cache
+from crop_cache import crop_url, parse_crop_spec, render_crops
+from raster_cache import RasterCache, source_version
+
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(crop_cache, "CROP_CACHE_DIR", str(tmp_path / "crops"))
+    os.makedirs(crop_cache.CROP_CACHE_DIR)
+    rasters = RasterCache(str(tmp_path / "rasters"))
+    monkeypatch.setattr(crop_cache, "get_raster_cache", lambda: rasters)
+    return rasters
+
+
+def _screenshot(path, color, mtime):
+    Image.new("RGB", (40, 100), color).save(path)
+    os.utime(path, ns=(mtime, mtime))
+    return str(path)
+
+
+def test_crop_url_round_trips_through_parse_crop_spec():
+    url = crop_url("abc", {"x": 0, "y": 12.5, "width": 100, "height": 20}, 0.5, "webp")
+    assert url == "/crops/abc/0.00,12.50,100.00,20.00/0.5.webp"
+    _, _, box, variant = url.rsplit("/", 3)
+    assert parse_crop_spec(box, variant) == ({"x": 0, "y": 12.5, "width": 100, "height": 20}, 0.5, "webp")
+
+
+def test_crop_url_of_a_new_capture_under_the_same_id_changes(tmp_path):
+    box = {"x": 0, "y": 0, "width": 100, "height": 100}
+    old_url = crop_url("abc", box, version=source_version(_screenshot(tmp_path / "shot.png", (255, 0, 0), 10**18)))
+    new_url = crop_url("abc", box, version=source_version(_screenshot(tmp_path / "shot.png", (0, 0, 255), 2 * 10**18)))
+    assert old_url.startswith("/crops/abc/0.00,0.00,100.00,100.00/1.png?v=")
+    assert new_url != old_url
+
+
+@pytest.mark.parametrize("bounding_box, expected", [
+    ({"x": -5, "y": 90, "width": 30, "height": 20}, "0.00,90.00,30.00,10.00"),
+    ({"x": 120, "y": 100, "width": 0, "height": -3}, "99.99,99.99,0.01,0.01"),
+    ({"x": 10, "y": 10, "width": 0.001, "height": 250}, "10.00,10.00,0.01,90.00"),
+])
+def test_crop_url_clamps_boxes_to_what_parse_crop_spec_accepts(bounding_box, expected):
+    url = crop_url("abc", bounding_box)
+    _, _, box, variant = url.rsplit("/", 3)
+    assert box == expected
+    parse_crop_spec(box, variant)
+
+
+@pytest.mark.parametrize("box, variant", [
+    ("0,0,100", "1.png"),
+    ("0,0,0,10", "1.png"),
+    ("0,0,100,101", "1.png"),
+    ("0,0,100,10", "1.gif"),
+    ("0,0,100,10", "2.png"),
+    ("a,0,100,10", "1.png"),
+])
+def test_invalid_crop_specs(box, variant):
+    with pytest.raises(ValueError):
+        parse_crop_spec(box, variant)
+
+
+def test_crops_are_rendered_once(caches, tmp_path, monkeypatch):
+    screenshot = _screenshot(tmp_path / "shot.png", (255, 0, 0), 10**18)
+    box = {"x": 0, "y": 0, "width": 50, "height": 10}
+    [path] = render_crops("abc", screenshot, [box])
+    with Image.open(path) as crop:
+        assert crop.size == (20, 10)
+    monkeypatch.setattr(crop_cache, "get_raster_cache", lambda: pytest.fail("crop rendered twice"))
+    assert render_crops("abc", screenshot, [box]) == [path]
+
+
+def test_new_capture_under_the_same_id_is_not_served_stale(caches, tmp_path):
+    box = {"x": 0, "y": 0, "width": 100, "height": 100}
+    old = _screenshot(tmp_path / "old.png", (255, 0, 0), 10**18)
+    [old_crop] = render_crops("abc", old, [box])
+    new = _screenshot(tmp_path / "old.png", (0, 0, 255), 2 * 10**18)
+    [new_crop] = render_crops("abc", new, [box])
+    assert new_crop != old_crop
+    with Image.open(new_crop) as crop:
+        assert crop.getpixel((0, 0)) == (0, 0, 255)
+    assert tuple(caches.get("abc", new)[0, 0]) == (0, 0, 255)
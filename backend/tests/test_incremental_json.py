@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from llm_json import IncrementalJSONParser
+
+RESULT = {
+    "websiteFeatures": [
+        {"featureName": "Header", "detailedDescription": "Logo and {menu}"},
+        {"featureName": "Hero", "detailedDescription": 'Headline "quoted" and [CTA]'},
+    ],
+    "siteUXArchitecture": {"targetAudience": "Founders"},
+    "business_analysis": {"model": "SaaS"},
+    "notes": ["short"],
+}
+OUTPUT = "Here is the analysis:\n```json\n" + json.dumps(RESULT, indent=2) + "\n```"
+
+
+def _feed(chunks):
+    parser = IncrementalJSONParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return parser, events
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, len(OUTPUT)])
+def test_events_do_not_depend_on_chunking(size):
+    parser, events = _feed(OUTPUT[i:i + size] for i in range(0, len(OUTPUT), size))
+    assert [(event["event"], event["key"]) for event in events] == [
+        ("section", "websiteFeatures"),
+        ("section", "websiteFeatures"),
+        ("architecture", "siteUXArchitecture"),
+        ("summary", "business_analysis"),
+        ("field", "notes"),
+    ]
+    assert [event["index"] for event in events[:2]] == [0, 1]
+    assert events[1]["data"] == RESULT["websiteFeatures"][1]
+    assert parser.done
+    assert parser.result() == RESULT
+
+
+def test_section_is_reported_as_soon_as_it_closes():
+    text = json.dumps(RESULT)
+    cut = text.index(', {"featureName": "Hero"')
+    parser, events = _feed([text[:cut]])
+    assert [event["data"] for event in events] == [RESULT["websiteFeatures"][0]]
+    assert parser.result() is None
+
+
+def test_unfinished_output_has_no_result():
+    parser, _ = _feed(['{"websiteFeatures": [{"featureName": "Hea'])
+    assert not parser.done
+    assert parser.result() is None
+
+
+@pytest.mark.parametrize("text, key", [
+    ('{"sec\\qtions": [1]}', "sec\\qtions"),
+    ('{"bad\\u12": [1]}', "bad\\u12"),
+    ('{"line\nbreak": [1]}', "line\nbreak"),
+])
+def test_malformed_keys_do_not_stop_the_parser(text, key):
+    parser, events = _feed([text])
+    assert [(event["key"], event["data"]) for event in events] == [(key, [1])]
+    assert parser.done
+
+
+def test_sections_after_a_malformed_key_are_still_reported():
+    text = '{"no\\te\\s": "x", "websiteFeatures": [{"featureName": "Hero"}]}'
+    _, events = _feed(text[i:i + 3] for i in range(0, len(text), 3))
+    assert {"event": "section", "key": "websiteFeatures", "index": 0, "data": {"featureName": "Hero"}} in events
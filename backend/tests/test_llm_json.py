@@ -0,0 +1,66 @@
+import pytest
+
+from llm_json import PartialJSONError, loads_llm_json, repair_json
+
+
+def test_clean_object_is_complete():
+    repaired = repair_json('{"sections": [{"name": "Hero"}]}')
+    assert repaired.value == {"sections": [{"name": "Hero"}]}
+    assert repaired.complete
+    assert repaired.repairs == []
+
+
+def test_prose_brackets_before_the_object_are_skipped():
+    repaired = repair_json('Based on the screenshot [1], here:\n{"sections": []}', dict)
+    assert repaired.value == {"sections": []}
+    assert repaired.complete
+
+
+def test_invalid_prose_object_is_not_taken():
+    repaired = repair_json('Note {x} then {"a": 1}', dict)
+    assert repaired.value == {"a": 1}
+    assert repaired.complete
+
+
+def test_code_fence_wins_over_prose():
+    repaired = repair_json('Here is the result [as JSON]: ```json\n{"a": [1, 2]}\n```', dict)
+    assert repaired.value == {"a": [1, 2]}
+    assert repaired.complete
+
+
+def test_any_container_without_expect():
+    assert repair_json("[1, 2]").value == [1, 2]
+    assert repair_json("[1, 2]", dict).value is None
+
+
+def test_syntax_repairs():
+    repaired = repair_json('{"a": True, "b": [1, 2,], "c": "line\nbreak",}')
+    assert repaired.value == {"a": True, "b": [1, 2], "c": "line\nbreak"}
+    assert repaired.complete
+    assert {"python_literal", "trailing_comma", "escaped_control_characters"} <= set(repaired.repairs)
+
+
+def test_truncated_output_is_partial():
+    repaired = repair_json('{"websiteFeatures": [{"featureName": "Nav", "detailedDescription": "Top bar"}, '
+                           '{"featureName": "Hero", "detailedDescrip')
+    assert not repaired.complete
+    assert "truncated" in repaired.repairs
+    assert repaired.value["websiteFeatures"][0] == {"featureName": "Nav", "detailedDescription": "Top bar"}
+
+
+def test_nested_candidates_do_not_replace_a_truncated_value():
+    repaired = repair_json('{"sections": [{"name": "a"}, {"name": "b"}, {"na', dict)
+    assert not repaired.complete
+    assert repaired.value == {"sections": [{"name": "a"}, {"name": "b"}, {}]}
+
+
+def test_loads_llm_json_rejects_partial_output():
+    with pytest.raises(PartialJSONError) as excinfo:
+        loads_llm_json('{"a": [1, 2', context="test")
+    assert excinfo.value.repaired.value == {"a": [1, 2]}
+    assert loads_llm_json('{"a": [1, 2', context="test", allow_partial=True) == {"a": [1, 2]}
+
+
+def test_loads_llm_json_without_json():
+    with pytest.raises(ValueError):
+        loads_llm_json("Sorry, I cannot help with that.")
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import memoize
+from cache_store import CacheStore
+from memoize import memoize_stage, normalize_input, stage_cache_mode
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    store = CacheStore(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(memoize, "get_cache_store", lambda: store)
+    return store
+
+
+def _counting_stage(settings=None, **options):
+    calls = []
+
+    @memoize_stage("test", ttl=60, settings=settings, **options)
+    async def stage(prompt, image=None, api_key=None):
+        calls.append(prompt)
+        return {"answer": len(calls)}
+
+    return stage, calls
+
+
+def test_normalize_input():
+    assert normalize_input("  two\n words ") == "two words"
+    assert normalize_input(b"png") == normalize_input(bytearray(b"png"))
+    assert normalize_input("data:image/png;base64,AAAA") != normalize_input("data:image/png;base64,AAAB")
+    assert normalize_input({"n": (1, None)}) == {"n": [1, None]}
+
+
+def test_same_inputs_are_served_from_the_cache():
+    stage, calls = _counting_stage()
+    assert asyncio.run(stage("describe the page", b"png")) == {"answer": 1}
+    assert asyncio.run(stage("describe  the\npage", image=b"png")) == {"answer": 1}
+    assert len(calls) == 1
+
+
+def test_changed_inputs_and_settings_are_new_keys():
+    stage, calls = _counting_stage(settings={"model": "a"})
+    asyncio.run(stage("prompt", b"png"))
+    asyncio.run(stage("prompt", b"other png"))
+    other_model, other_calls = _counting_stage(settings={"model": "b"})
+    asyncio.run(other_model("prompt", b"png"))
+    assert len(calls) == 2 and len(other_calls) == 1
+
+
+def test_ignored_arguments_are_not_part_of_the_key():
+    stage, calls = _counting_stage(ignore=("api_key",))
+    asyncio.run(stage("prompt", api_key="one"))
+    asyncio.run(stage("prompt", api_key="two"))
+    assert len(calls) == 1
+
+
+def test_cache_modes():
+    stage, calls = _counting_stage()
+    asyncio.run(stage("prompt"))
+    with stage_cache_mode("refresh"):
+        assert asyncio.run(stage("prompt")) == {"answer": 2}
+    assert asyncio.run(stage("prompt")) == {"answer": 2}
+    with stage_cache_mode("bypass"):
+        assert asyncio.run(stage("prompt")) == {"answer": 3}
+    assert asyncio.run(stage("prompt")) == {"answer": 2}
+
+
+def test_results_rejected_by_cache_if_are_not_stored():
+    stage, calls = _counting_stage(cache_if=lambda result: False)
+    asyncio.run(stage("prompt"))
+    asyncio.run(stage("prompt"))
+    assert len(calls) == 2
@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("fastapi")
+
+from openrouter import completion_cacheable
+
+
+@pytest.mark.parametrize("payload, cacheable", [
+    ({"temperature": 0}, True),
+    ({"temperature": 0.0, "max_tokens": 100}, True),
+    ({"temperature": 0, "stream": True}, False),
+    ({"temperature": 0.1}, False),
+    ({"temperature": 0.3}, False),
+    ({}, False),
+])
+def test_only_deterministic_requests_are_cached_by_default(payload, cacheable):
+    assert completion_cacheable(payload) is cacheable
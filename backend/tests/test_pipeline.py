@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from pipeline import Stage, run_stages
+
+
+def _run(stages):
+    timings = {}
+    return asyncio.run(run_stages(stages, timings)), timings
+
+
+def test_stages_get_their_dependencies_results_in_order():
+    async def capture():
+        return "shot"
+
+    async def text():
+        return "text"
+
+    async def combine(text_result, capture_result):
+        return f"{text_result}+{capture_result}"
+
+    results, timings = _run([
+        Stage("combine", combine, depends_on=("text", "capture")),
+        Stage("capture", capture),
+        Stage("text", text),
+    ])
+    assert results == {"capture": "shot", "text": "text", "combine": "text+shot"}
+    assert set(timings) == {"capture", "text", "combine", "total"}
+
+
+def test_independent_stages_overlap():
+    async def main():
+        started = []
+        both_running = asyncio.Event()
+
+        async def stage(name):
+            started.append(name)
+            if len(started) == 2:
+                both_running.set()
+            # Times out if the stages run one after the other
+            await asyncio.wait_for(both_running.wait(), 1)
+            return name
+
+        return await run_stages([Stage("a", lambda: stage("a")), Stage("b", lambda: stage("b"))], {})
+
+    assert asyncio.run(main()) == {"a": "a", "b": "b"}
+
+
+def test_failure_cancels_running_stages():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    async def broken():
+        await asyncio.sleep(0)
+        raise RuntimeError("vision failed")
+
+    with pytest.raises(RuntimeError, match="vision failed"):
+        _run([Stage("slow", slow), Stage("broken", broken)])
+    assert cancelled == ["slow"]
+
+
+@pytest.mark.parametrize("stages, message", [
+    ([Stage("a", None, ("b",)), Stage("b", None, ("a",))], "cycle"),
+    ([Stage("a", None, ("missing",))], "unknown stage"),
+    ([Stage("a", None), Stage("a", None)], "unique"),
+])
+def test_invalid_graphs(stages, message):
+    with pytest.raises(ValueError, match=message):
+        _run(stages)
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from raster_cache import RasterCache, crop_box_pixels
+
+
+def _screenshot(path, color):
+    Image.new("RGB", (20, 40), color).save(path)
+    return str(path)
+
+
+def test_crop_box_pixels_are_clamped():
+    assert crop_box_pixels({"x": 50, "y": 90, "width": 80, "height": 20}, 200, 100) == (100, 90, 100, 10)
+
+
+def test_crop_slices_the_decoded_raster(tmp_path):
+    cache = RasterCache(str(tmp_path / "rasters"))
+    [crop] = cache.crop("abc", _screenshot(tmp_path / "shot.png", (0, 255, 0)), [{"x": 0, "y": 50, "width": 50, "height": 25}])
+    assert crop["box"] == {"x": 0, "y": 20, "width": 10, "height": 10}
+    assert tuple(crop["pixels"][0, 0]) == (0, 255, 0)
+
+
+def test_decode_of_one_screenshot_does_not_block_another(tmp_path):
+    cache = RasterCache(str(tmp_path / "rasters"))
+    slow = _screenshot(tmp_path / "slow.png", (255, 0, 0))
+    fast = _screenshot(tmp_path / "fast.png", (0, 0, 255))
+    release, decoding = threading.Event(), threading.Event()
+    decode = cache._decode
+    calls = []
+
+    def blocking_decode(key, source_path):
+        calls.append(key)
+        if source_path == slow:
+            decoding.set()
+            assert release.wait(5)
+        return decode(key, source_path)
+
+    cache._decode = blocking_decode
+    waiters = [threading.Thread(target=cache.get, args=("slow", slow)) for _ in range(3)]
+    for thread in waiters:
+        thread.start()
+    assert decoding.wait(5)
+    other = threading.Thread(target=cache.get, args=("fast", fast))
+    other.start()
+    other.join(2)
+    finished_while_blocked = not other.is_alive()
+    release.set()
+    assert finished_while_blocked
+    for thread in waiters:
+        thread.join(5)
+    # The slow screenshot was decoded once for all three requests
+    assert sum(key.startswith("slow.") for key in calls) == 1
@@ -0,0 +1,53 @@
+import os
+import sys
+import shutil
+import asyncio
+
+import pytest
+
+from screenshot_watcher import ScreenshotWatcher
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+
+FILENAME = "screenshot_20240101_120000_{}.png"
+
+
+def _write(directory, screenshot_id):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, FILENAME.format(screenshot_id))
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG")
+    return path
+
+
+def test_waiter_is_woken_by_the_event(tmp_path):
+    directory = str(tmp_path / "screenshots")
+
+    async def run():
+        watcher = ScreenshotWatcher(directory)
+        watcher.start()
+        assert watcher.event_driven
+        waiter = asyncio.ensure_future(watcher.wait_for("abc", 5))
+        await asyncio.sleep(0.05)
+        path = _write(directory, "abc")
+        assert await waiter == path
+        watcher.stop()
+
+    asyncio.run(run())
+
+
+def test_pending_waiter_falls_back_to_polling_when_the_watch_is_lost(tmp_path):
+    directory = str(tmp_path / "screenshots")
+
+    async def run():
+        watcher = ScreenshotWatcher(directory)
+        watcher.start()
+        waiter = asyncio.ensure_future(watcher.wait_for("abc", 5))
+        await asyncio.sleep(0.05)
+        shutil.rmtree(directory)
+        await asyncio.sleep(0.05)
+        assert not watcher.event_driven
+        path = _write(directory, "abc")
+        assert await waiter == path
+
+    asyncio.run(run())
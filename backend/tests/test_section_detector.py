@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from section_detector import detect_sections
+
+
+def _page(height=1200, width=320):
+    return np.full((height, width, 3), 255, np.uint8)
+
+
+def _band(page, top, bottom, color, left=40, right=280):
+    """A coloured band with lines of 'text' from left to right."""
+    page[top:bottom, :] = color
+    for y in range(top + 20, bottom - 20, 12):
+        page[y:y + 4, left:right] = 255 - np.array(color)
+
+
+def _rows(section, height):
+    box = section["bounding_box"]
+    return round(box["y"] * height / 100), round((box["y"] + box["height"]) * height / 100)
+
+
+def test_bands_are_found_top_to_bottom_and_trimmed_to_their_content():
+    page = _page()
+    _band(page, 0, 100, (30, 30, 30))
+    _band(page, 300, 700, (40, 90, 200))
+    _band(page, 1000, 1200, (0, 0, 0))
+    sections = detect_sections(page)
+    assert [_rows(section, 1200) for section in sections] == [(20, 72), (320, 672), (1020, 1180)]
+    assert all(section["source"] == "cv" and 0 < section["confidence"] <= 1 for section in sections)
+
+
+def test_side_by_side_blocks():
+    page = _page(600)
+    for y in range(120, 380, 12):
+        page[y:y + 4, 20:140] = 0
+        page[y:y + 4, 180:300] = 0
+    [section] = detect_sections(page)
+    assert len(section["blocks"]) == 2
+    left, right = (block["bounding_box"] for block in section["blocks"])
+    assert left["x"] + left["width"] <= right["x"]
+
+
+def test_weakest_separators_are_merged_down_to_max_sections():
+    page = _page(1600)
+    for top in range(0, 1600, 200):
+        _band(page, top + 40, top + 160, (255, 255, 255))
+    assert len(detect_sections(page)) == 8
+    assert len(detect_sections(page, max_sections=3)) == 3
+
+
+def test_blank_page_has_no_sections():
+    assert detect_sections(_page(400)) == []